@@ -1,20 +1,23 @@
 #!/usr/bin/python
 __author__ = 'Ethan A. Hill'
-import itertools
 import threading
 import logging
 import logging.config
 import os
 from Queue import Queue
-from xml.etree import cElementTree as ElementTree
 
-from constants import ccg_values
 from utilities import system_utilities
 from utilities import disambig_utilities
+from utilities import worker_utilities
+from utilities import batch_utilities
+from utilities import cache_utilities
+from utilities import dump_utilities
+from utilities import journal_utilities
 
 
 def gather_file_names_from_arguments(arguments):
-    working_directory = arguments.working_directory
+    working_directory = system_utilities.ccgbank_path(
+        arguments.working_directory)
     if arguments.include_list:
         # Explicit listing of files to process
         files = system_utilities.file_names_sorted_by_file_size(
@@ -27,7 +30,8 @@ def gather_file_names_from_arguments(arguments):
 
     elif arguments.include_list_file:
         # We have a file with a list of file names to process
-        include_file_path = os.path.abspath(arguments.include_list_file[0])
+        include_file_path = system_utilities.ccgbank_path(
+            arguments.include_list_file[0])
         with open(include_file_path) as f:
             file_list = [l.rstrip() for l in f.readlines()]
         files = system_utilities.file_names_sorted_by_file_size(
@@ -35,7 +39,8 @@ def gather_file_names_from_arguments(arguments):
 
     elif arguments.reject_list_file:
         # We have a file with list of file names to reject, process all others
-        include_file_path = os.path.abspath(arguments.reject_list_file[0])
+        include_file_path = system_utilities.ccgbank_path(
+            arguments.reject_list_file[0])
         with open(include_file_path) as f:
             file_list = [l.rstrip() for l in f.readlines()]
         files = system_utilities.file_names_sorted_by_file_size(
@@ -83,54 +88,232 @@ def setup_logger(package_path):
     return logger
 
 
-def further_processing(arguments, sentences):
+def dump_paths(arguments):
+    xml_dump_path, option_dump_path = None, None
     if arguments.xml_dump:
-        xml_file_path = arguments.xml_dump[0]
-        xml_root = ElementTree.Element('raw_data')
-        for sentence in sentences:
-            xml_root.append(sentence.xmlize())
-        xml_tree = ElementTree.ElementTree(xml_root)
-        xml_tree.write(xml_file_path, encoding='utf-8')
+        xml_dump_path = system_utilities.ccgbank_path(arguments.xml_dump[0])
     if arguments.option_dump:
-        xml_file_path = arguments.option_dump[0]
-        xml_root = ElementTree.Element('novel_disambiguation')
-        options = disambig_utilities.gather_disambiguation_options(sentences)
-        for option in options:
-            xml_root.append(option.xmlize())
-        xml_tree = ElementTree.ElementTree(xml_root)
-        xml_tree.write(xml_file_path, encoding='utf-8')
+        option_dump_path = system_utilities.ccgbank_path(
+            arguments.option_dump[0])
+    return xml_dump_path, option_dump_path
 
 
-def main(arguments):
-    original_working_directory = os.getcwd()
-    # Change our working directory to CCGBANK_PATH
-    os.chdir(os.path.expandvars(ccg_values.CCGBANK_PATH))
+def open_dump_writers(arguments):
+    # With a shard directory, results go to shards and the dumps are brought
+    # up to date from them once the run is over
+    if arguments.shard_directory:
+        return dump_utilities.ShardWriter(
+            os.path.abspath(arguments.shard_directory[0]))
+    return dump_utilities.DumpWriters(*dump_paths(arguments))
 
-    text_files = gather_file_names_from_arguments(arguments)
-    # Find out how many threads we can make for this task
-    num_threads = system_utilities.total_effective_processes(len(text_files))
 
+def open_journal(arguments):
+    if not arguments.journal:
+        return None
+    journal = journal_utilities.Journal(
+        os.path.abspath(arguments.journal[0]), arguments.resume)
+    if arguments.resume:
+        __logger.info('Resuming from journal %s, %d jobs finished',
+                      journal.path, len(journal))
+    return journal
+
+
+def result_writer(writers, chunked_files, journal=None):
+    # Writes a finished job's sentences out to the dumps straight away, or
+    # with a journal, saves them for the dumps to be assembled from
+    def write_result(item, result):
+        if not isinstance(result, disambig_utilities.DisambiguationResult):
+            # Chunks report under their own file, put them back under the
+            # original
+            batch_utilities.reassemble_chunks(result, chunked_files)
+            result = disambig_utilities.DisambiguationResult(sorted(result))
+        if journal is None:
+            writers.write_result(result, item)
+        else:
+            journal.save_result(item, result)
+    return write_result
+
+
+def job_with_item(job_function):
+    # Outputs carry their item along, so they can be journaled under it
+    def run_job(item, post_process, worker_pool):
+        return item, job_function(item, post_process, worker_pool)
+    return run_job
+
+
+def handle_output(out_queue, result_handler):
+    while True:
+        output = out_queue.get()
+        if output is None:
+            return
+        try:
+            result_handler(*output)
+        except Exception, e:
+            __logger.exception('Exception %s encountered writing out %s', e,
+                               output[0])
+
+
+def process_files(text_files, num_threads, post_process, worker_pool,
+                  job_function, result_handler):
     job_queue, out_queue = Queue(), Queue()
     # range is end value exclusive
     for thread_number in xrange(1, num_threads + 1):
         thread = threading.Thread(
             target=disambig_utilities.disambiguation_worker,
             args=(job_queue, out_queue, ),
-            kwargs={'post_process': arguments.post_process})
+            kwargs={'post_process': post_process,
+                    'worker_pool': worker_pool,
+                    'job_function': job_with_item(job_function)})
         thread.daemon = True
         thread.start()
+    # Output is handled as each file finishes, not once all of them have
+    output_thread = threading.Thread(
+        target=handle_output, args=(out_queue, result_handler))
+    output_thread.start()
     # Dump the text files in for processing
     for text_file in text_files:
         job_queue.put(text_file)
     job_queue.join()
+    out_queue.put(None)
+    output_thread.join()
+
+
+def main(arguments):
+    # Every path from here on is absolute, so nothing depends on the working
+    # directory and files can be processed from any number of processes
+    text_files = gather_file_names_from_arguments(arguments)
+    # Large files run as chunks, so no one file keeps the others waiting
+    text_files, chunked_files = batch_utilities.split_large_files(
+        list(text_files), arguments.split_sentences)
+    job_function = disambig_utilities.disambiguate
+    if arguments.batch_sentences or arguments.batch_bytes:
+        # Each job is now a batch of files sharing its OpenCCG runs
+        text_files = batch_utilities.pack_batches(
+            text_files, arguments.batch_sentences, arguments.batch_bytes)
+        job_function = disambig_utilities.disambiguate_batch
+    text_files = batch_utilities.longest_first(text_files)
+    # Find out how many threads we can make for this task
+    if arguments.max_ccg_jobs:
+        # A fixed number, whatever the machine, so runs can be compared
+        num_threads = min(len(text_files), arguments.max_ccg_jobs)
+    else:
+        # A thread per job, whatever the heap size. Their OpenCCG jobs are
+        # only started while memory has room for them, persistent workers
+        # are fewer still.
+        num_threads = min(len(text_files), worker_utilities.MAX_POOL_WORKERS)
+    seconds_per_sentence = {}
+    if arguments.parse_deadline:
+        seconds_per_sentence[worker_utilities.PARSE_TASK] = \
+            arguments.parse_deadline
+    if arguments.realize_deadline:
+        seconds_per_sentence[worker_utilities.REALIZE_TASK] = \
+            arguments.realize_deadline
+    journal = open_journal(arguments)
+    jobs = text_files
+    if journal is not None:
+        # Finished jobs are already saved in the journal
+        text_files = [item for item in jobs if not journal.finished(item)]
+        __logger.info('%d of %d jobs left to process', len(text_files),
+                      len(jobs))
+    # The dumps are open from the start and closed whatever happens
+    writers = open_dump_writers(arguments)
+    try:
+        if arguments.processes:
+            process_in_processes(
+                arguments, text_files, chunked_files, job_function,
+                num_threads, seconds_per_sentence, writers, journal)
+        else:
+            process_in_threads(
+                arguments, text_files, chunked_files, job_function,
+                num_threads, seconds_per_sentence, writers, journal)
+        if journal is not None:
+            # Earlier runs' results included, those of jobs no longer in the
+            # run left out
+            for item, result in journal.results(jobs):
+                writers.write_result(result, item)
+    finally:
+        writers.close()
+        if journal is not None:
+            journal.close()
+    if arguments.shard_directory:
+        dump_utilities.update_dumps(
+            os.path.abspath(arguments.shard_directory[0]),
+            *dump_paths(arguments))
+
 
-    sentence_sets = list(out_queue.queue)
-    # Reduce the sentence sets to a single list of sentences for processing
-    sentences = list(itertools.chain.from_iterable(sentence_sets))
+def process_in_processes(arguments, text_files, chunked_files, job_function,
+                         num_threads, seconds_per_sentence, writers,
+                         journal=None):
+    num_processes = arguments.processes
+    if not arguments.post_process:
+        # Every process may run a JVM of its own, and nothing admits them
+        # across processes
+        num_processes = min(num_processes, num_threads)
+        if not arguments.max_ccg_jobs:
+            num_processes = min(num_processes,
+                                worker_utilities.memory_worker_limit())
+    pool_arguments = {'backend': arguments.worker_backend,
+                      'worker_command': arguments.worker_command,
+                      'seconds_per_sentence': seconds_per_sentence}
+    if arguments.cache_directory:
+        pool_arguments['cache_directory'] = os.path.abspath(
+            arguments.cache_directory[0])
+        pool_arguments['cache_bytes'] = arguments.cache_size * 1024 * 1024
+    if arguments.skip_list:
+        pool_arguments['skip_list_path'] = os.path.abspath(
+            arguments.skip_list[0])
+    if journal is not None:
+        pool_arguments['journal_path'] = journal.path
+    __logger.info('Processing %d jobs in %d processes', len(text_files),
+                  num_processes)
+    disambig_utilities.disambiguate_in_processes(
+        text_files, num_processes, arguments.post_process, pool_arguments,
+        job_function, chunked_files,
+        result_writer(writers, chunked_files, journal))
 
-    further_processing(arguments, sentences)
 
-    os.chdir(original_working_directory)
+def process_in_threads(arguments, text_files, chunked_files, job_function,
+                       num_threads, seconds_per_sentence, writers,
+                       journal=None):
+    # OpenCCG jobs start only while memory has room for them
+    admission = worker_utilities.memory_admission_controller(
+        arguments.max_ccg_jobs)
+    cache = None
+    if arguments.cache_directory:
+        cache = cache_utilities.OutputCache(
+            os.path.abspath(arguments.cache_directory[0]),
+            arguments.cache_size * 1024 * 1024)
+    skip_list = None
+    if arguments.skip_list:
+        skip_list = worker_utilities.SkipList(
+            os.path.abspath(arguments.skip_list[0]))
+    # File threads share the OpenCCG workers, as many as memory allows
+    worker_pool = worker_utilities.worker_pool_factory(
+        arguments.worker_backend, num_threads, arguments.worker_command,
+        cache=cache, admission=admission,
+        seconds_per_sentence=seconds_per_sentence, skip_list=skip_list,
+        journal=journal)
+
+    result_handler = result_writer(writers, chunked_files, journal)
+    # Batches already share their stages, so they are never pipelined
+    pipelined = (arguments.pipeline_stages and
+                 job_function is disambig_utilities.disambiguate)
+    if pipelined:
+        # Stages of different files overlap rather than files as a whole
+        scheduler = disambig_utilities.disambiguation_scheduler(worker_pool)
+        disambig_utilities.disambiguate_pipelined(
+            text_files, arguments.post_process, worker_pool, scheduler,
+            result_handler)
+        for line in scheduler.utilization_report():
+            __logger.info(line)
+    else:
+        process_files(
+            text_files, num_threads, arguments.post_process, worker_pool,
+            job_function, result_handler)
+    worker_pool.close()
+    __logger.info(admission.report())
+    if cache is not None:
+        __logger.info(cache.report())
 
 
 # This is used for logging...
@@ -139,4 +322,7 @@ __package_path = os.path.dirname(__file__)
 __logger = setup_logger(__package_path)
 if __name__ == '__main__':
     argument_parser = system_utilities.initialize_arg_parser()
-    main(argument_parser.parse_args())
+    parsed_arguments = argument_parser.parse_args()
+    if parsed_arguments.resume and not parsed_arguments.journal:
+        argument_parser.error('--resume needs the --journal to resume from')
+    main(parsed_arguments)
@@ -4,8 +4,12 @@ __author__ = 'Ethan A. Hill'
 OPENCCG_HOME_PATH = '$OPENCCG_HOME'
 CCGBANK_PATH = '$OPENCCG_HOME/ccgbank'
 OPENCCG_BIN_ENV_FILE_PATH = '$OPENCCG_HOME/bin/ccg-env'
+# Cached parses and realizations are only valid for this grammar
+CCG_GRAMMAR_PATH = '$OPENCCG_HOME/ccgbank/extract'
 
 JAVA_MEMORY_VARIABLE_REGEX_STRING = '^JAVA_MEM="-Xmx([0-9]+).*"$'
+# ccg-build names the sentence it is working on in its java task output
+CCG_PROGRESS_REGEX_STRING = r'\[java\].*\b(s[0-9]+)(?:-[0-9]+)?\b'
 
 # Constants for tests
 DATA_NOVEL_SUB_PATH = 'data/novel'
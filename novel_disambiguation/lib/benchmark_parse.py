@@ -0,0 +1,99 @@
+"""Times Parse construction against the old multi-pass logical form extraction.
+
+usage: python benchmark_parse.py [tb.xml] [repeats]
+
+Without a tb.xml, a synthetic 50-best file of 40 word sentences is used.
+"""
+__author__ = 'Ethan A. Hill'
+import os
+import re
+import sys
+import timeit
+from xml.etree import cElementTree as ElementTree
+
+# Allow running this as a plain script from anywhere
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from novel_disambiguation.models.parse import Parse
+
+
+def legacy_word_info_map(lf):
+    word_info_map = {}
+    full_words = lf.find('full-words').text.split()[1:-1]
+    for index, info in enumerate(full_words, start=1):
+        matches = re.match('(^.*):S-.*:P-(.*):T-', info)
+        if matches:
+            word_info_map[index - 1] = (matches.group(1), index,
+                                        matches.group(2), '')
+    for info in lf.find('pred-info').attrib.get('data').split():
+        match = re.match('^.([0-9]+).*:.*:.*:(.*)$', info)
+        index = int(match.group(1))
+        word, _, pos_tag, _ = word_info_map[index]
+        word_info_map[index] = (word, index, pos_tag, match.group(2))
+    return word_info_map
+
+
+def legacy_parse(lf):
+    # Mirrors the original constructor: the word map is built twice
+    word_info_map = legacy_word_info_map(lf)
+    dependencies = {}
+    for node in lf.findall('.//node/rel/..'):
+        head_id = node.attrib.get('id', node.attrib.get('idref'))
+        head = word_info_map[int(re.match('.([0-9]+).*', head_id).group(1))]
+        for sub_node in node.findall('rel/*'):
+            dependent_id = sub_node.attrib.get(
+                'id', sub_node.attrib.get('idref'))
+            dependent = word_info_map[
+                int(re.match('.([0-9]+).*', dependent_id).group(1))]
+            dependencies[head, dependent] = head[0], dependent[0]
+    legacy_word_info_map(lf)
+    return dependencies
+
+
+def synthetic_items(num_sentences=20, num_parses=50, num_words=40):
+    root = ElementTree.Element('regression')
+    words = ['word%d' % i for i in xrange(num_words)]
+    full_words = ' '.join(['<s>'] + ['%s:S-%s:P-NN:T-NN' % (w, w)
+                                     for w in words] + ['</s>'])
+    pred_info = ' '.join('w%d:X:NN:%s' % (i, w) for i, w in enumerate(words))
+    for sentence in xrange(1, num_sentences + 1):
+        for parse in xrange(1, num_parses + 1):
+            item = ElementTree.SubElement(root, 'item', {
+                'numOfParses': str(num_parses),
+                'info': 's%d-%d' % (sentence, parse),
+                'string': ' '.join(words)})
+            node = ElementTree.SubElement(item, 'lf')
+            # A right branching chain of nodes, one per word
+            for index in xrange(num_words):
+                node = ElementTree.SubElement(
+                    node, 'node', {'id': 'w%d' % index, 'pred': words[index]})
+                if index + 1 < num_words:
+                    node = ElementTree.SubElement(
+                        node, 'rel', {'name': 'Arg%d' % (index % 2)})
+            ElementTree.SubElement(item, 'full-words').text = full_words
+            ElementTree.SubElement(item, 'pred-info', {'data': pred_info})
+    return root.findall('item')
+
+
+def main():
+    if len(sys.argv) > 1:
+        items = ElementTree.parse(sys.argv[1]).findall('.//item')
+        items = [i for i in items if int(i.attrib.get('numOfParses')) > 0 and
+                 '#' not in i.attrib.get('info')]
+    else:
+        items = synthetic_items()
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    legacy = min(timeit.repeat(
+        lambda: [legacy_parse(item) for item in items],
+        repeat=repeats, number=1))
+    current = min(timeit.repeat(
+        lambda: [Parse('benchmark', item) for item in items],
+        repeat=repeats, number=1))
+    print '%d parses' % len(items)
+    print 'legacy:  %8.1f us/parse' % (legacy / len(items) * 1e6)
+    print 'current: %8.1f us/parse' % (current / len(items) * 1e6)
+    print 'speedup: %8.2fx' % (legacy / current)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Times post processing a corpus with file threads against file processes.
+
+usage: python benchmark_workers.py [num_files] [sentences_per_file]
+
+A synthetic corpus of the test fixture sentence is parsed and realized once
+with stub ccg workers, then post processed by 1, 4, 16 and 32 threads and
+processes in turn.
+"""
+__author__ = 'Ethan A. Hill'
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from Queue import Queue
+from xml.etree import cElementTree as ElementTree
+
+# Allow running this as a plain script from anywhere
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from novel_disambiguation.tests import constant_values
+from novel_disambiguation.utilities import disambig_utilities
+from novel_disambiguation.utilities import worker_utilities
+
+WORKER_COUNTS = [1, 4, 16, 32]
+
+
+def repeated_xml(xml_string, tag, id_attribute, num_sentences):
+    # The fixture's first sentence, once for every sentence of a file
+    root = ElementTree.fromstring(xml_string)
+    repeated = ElementTree.Element(root.tag, root.attrib)
+    elements = [e for e in root.iter(tag)
+                if e.attrib[id_attribute].split('-')[0].split('#')[0] == 's1']
+    for number in xrange(1, num_sentences + 1):
+        for element in elements:
+            element_copy = copy.deepcopy(element)
+            element_copy.set(id_attribute, 's%d%s' % (
+                number, element.attrib[id_attribute][2:]))
+            repeated.append(element_copy)
+    return ElementTree.tostring(repeated)
+
+
+def write_corpus(directory, num_files, num_sentences):
+    text_files = []
+    for number in xrange(num_files):
+        path_to_text = os.path.join(directory, 'novel%d' % number)
+        with open(path_to_text, 'w') as text_file:
+            text_file.write('He saw the man with the telescope\n' *
+                            num_sentences)
+        text_files.append(path_to_text)
+    pool = worker_utilities.worker_pool_factory('stub', 1, task_files={
+        worker_utilities.PARSE_TASK: {'tb.xml': repeated_xml(
+            constant_values.TEST_PP_ATTACHMENT_LF, 'item', 'info',
+            num_sentences)},
+        worker_utilities.REALIZE_TASK: {'realize.nbest': repeated_xml(
+            constant_values.TEST_REALIZE_NBEST, 'seg', 'id',
+            num_sentences)}})
+    for text_file in text_files:
+        disambig_utilities.disambiguate(text_file, worker_pool=pool)
+    return text_files
+
+
+def run_threads(text_files, num_threads):
+    job_queue, out_queue = Queue(), Queue()
+    for _ in xrange(num_threads):
+        thread = threading.Thread(
+            target=disambig_utilities.disambiguation_worker,
+            args=(job_queue, out_queue), kwargs={'post_process': True})
+        thread.daemon = True
+        thread.start()
+    for text_file in text_files:
+        job_queue.put(text_file)
+    job_queue.join()
+    return [disambig_utilities.DisambiguationResult(sentences)
+            for sentences in out_queue.queue]
+
+
+def run_processes(text_files, num_processes):
+    return disambig_utilities.disambiguate_in_processes(
+        text_files, num_processes, post_process=True,
+        pool_arguments={'backend': 'stub'})
+
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    num_sentences = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    directory = tempfile.mkdtemp()
+    try:
+        text_files = write_corpus(directory, num_files, num_sentences)
+        print '%d files of %d sentences' % (num_files, num_sentences)
+        print '%8s %12s %12s' % ('workers', 'threads', 'processes')
+        for num_workers in WORKER_COUNTS:
+            timings = []
+            for runner in [run_threads, run_processes]:
+                start_time = time.time()
+                results = runner(text_files, num_workers)
+                timings.append(time.time() - start_time)
+                assert len(results) == num_files
+            print '%8d %11.2fs %11.2fs' % (num_workers, timings[0],
+                                            timings[1])
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Merges the result shards of runs into the combined xml and option dumps.
+
+usage: python merge_shards.py shard_directory [-xd xml_dump] [-od option_dump]
+                              [--rebuild] [--prune text_file_list]
+
+A dump that was merged from the shards before only has the files of the
+shards that changed since replaced, unless --rebuild is given. Shards of
+files no run processes anymore stay until pruned: with --prune, only the
+shards of the text files listed, one per line relative to ccgbank as in
+the dumps, are kept and the rest deleted.
+"""
+__author__ = 'Ethan A. Hill'
+import argparse
+import logging
+import os
+import sys
+
+# Allow running this as a plain script from anywhere
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from novel_disambiguation.utilities import dump_utilities
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Merges result shards into the combined dumps.')
+    parser.add_argument('shard_directory', help='directory of the shards')
+    parser.add_argument('-xd', '--xml-dump',
+                        help='the combined xml dump to create or patch')
+    parser.add_argument('-od', '--option-dump',
+                        help='the combined option dump to create or patch')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='merge every shard, even into an existing dump')
+    parser.add_argument('--prune', metavar='TEXT_FILE_LIST',
+                        help='delete the shards of every text file not in '
+                             'this list')
+    arguments = parser.parse_args()
+    if not (arguments.xml_dump or arguments.option_dump):
+        parser.error('nothing to merge into, give -xd and/or -od')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    keep_text_files = None
+    if arguments.prune:
+        with open(arguments.prune) as text_file_list:
+            keep_text_files = [line.strip() for line in text_file_list
+                               if line.strip()]
+    dump_utilities.update_dumps(arguments.shard_directory,
+                                arguments.xml_dump, arguments.option_dump,
+                                arguments.rebuild, keep_text_files)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+__author__ = 'Ethan A. Hill'
+import re
+
+__NODE_INDEX_REGEX = re.compile('.([0-9]+)')
+
+
+def node_index(node_id):
+    # Node ids are prefixed with a single character, ie. 'w12' or 'x1'
+    return int(__NODE_INDEX_REGEX.match(node_id).group(1))
+
+
+class LogicalFormIndex(object):
+    # Structural lookups over one logical form, built in a single walk
+
+    def __init__(self, lf, pos_tag_lookup=None):
+        self.root = lf
+        # Every element of the tree in document (pre-)order
+        self.elements = []
+        self.child_parent_map = {}
+        self.id_node_map = {}
+        self.index_node_map = {}
+        # element -> (preorder number, postorder number)
+        self.__intervals = {}
+        # Maps a word index to a pos tag, used to find verb ancestors
+        self.__pos_tag_lookup = pos_tag_lookup
+        self.__verb_ancestor_map = None
+        self.__build(lf)
+
+    def __build(self, lf):
+        postorder = 0
+        stack = [(lf, None, False)]
+        while stack:
+            element, parent, finished = stack.pop()
+            if finished:
+                preorder = self.__intervals[element]
+                self.__intervals[element] = preorder, postorder
+                postorder += 1
+                continue
+            self.__intervals[element] = len(self.elements)
+            self.elements.append(element)
+            if parent is not None:
+                self.child_parent_map[element] = parent
+            node_id = element.attrib.get('id')
+            if element.tag == 'node' and node_id is not None:
+                # Like find(), the first node in document order wins
+                if node_id not in self.id_node_map:
+                    self.id_node_map[node_id] = element
+                index = node_index(node_id)
+                if index not in self.index_node_map:
+                    self.index_node_map[index] = element
+            stack.append((element, parent, True))
+            # Reversed so that children are visited in document order
+            stack.extend((child, element, False) for child in reversed(element))
+
+    def node_at_index(self, index):
+        return self.index_node_map.get(index)
+
+    def node_with_id(self, node_id):
+        return self.id_node_map.get(node_id)
+
+    def parent(self, element):
+        return self.child_parent_map.get(element)
+
+    def is_descendant(self, element, ancestor):
+        # Constant time using the pre and post order numbers of the walk
+        if element not in self.__intervals or ancestor not in self.__intervals:
+            return False
+        element_pre, element_post = self.__intervals[element]
+        ancestor_pre, ancestor_post = self.__intervals[ancestor]
+        return ancestor_pre < element_pre and element_post < ancestor_post
+
+    def parent_verb_node(self, node):
+        if self.__verb_ancestor_map is None:
+            self.__verb_ancestor_map = self.__build_verb_ancestor_map()
+        return self.__verb_ancestor_map.get(node)
+
+    def __is_verb_node(self, element):
+        if 'id' not in element.attrib or self.__pos_tag_lookup is None:
+            return False
+        tag = self.__pos_tag_lookup(node_index(element.attrib.get('id')))
+        return tag is not None and 'VB' in tag
+
+    def __build_verb_ancestor_map(self):
+        verb_ancestor_map = {}
+        # Parents come before their children in document order
+        for element in self.elements:
+            parent = self.child_parent_map.get(element)
+            # The search for a verb never goes above the 'lf' element
+            if parent is None or element.tag == 'lf':
+                continue
+            if parent.tag != 'lf' and self.__is_verb_node(parent):
+                verb_ancestor_map[element] = parent
+            elif parent in verb_ancestor_map:
+                verb_ancestor_map[element] = verb_ancestor_map[parent]
+        return verb_ancestor_map
+
+
+def align_logical_forms(lf, other_lf):
+    # Pairs every element below lf with the first element below other_lf,
+    # in document order, reached through the same chain of tags and non-id
+    # attributes. This is what finding an id-free path to each element would
+    # return, but in one walk over both trees.
+    alignment = {}
+    stack = [(child, [other_lf]) for child in reversed(lf)]
+    while stack:
+        element, other_parents = stack.pop()
+        tag = element.tag
+        attributes = [(name, value) for name, value in element.items()
+                      if name != 'id']
+        candidates = [
+            other for other_parent in other_parents for other in other_parent
+            if other.tag == tag and
+            all(other.get(name) == value for name, value in attributes)]
+        # Nothing below an unmatched element can be matched either
+        if candidates:
+            alignment[element] = candidates[0]
+            stack.extend((child, candidates) for child in reversed(element))
+    return alignment
@@ -1,28 +1,83 @@
 __author__ = 'Ethan A. Hill'
 import re
+import array
+import itertools
 import collections
 from xml.etree import cElementTree as ElementTree
+from vocabulary import VOCABULARY
+from lf_index import LogicalFormIndex, node_index
 
 WordInfo = collections.namedtuple(
     'WordInfo', ['word', 'index', 'pos_tag', 'stem'])
 UnlabeledDependency = collections.namedtuple(
     'UnlabeledDependency', ['head', 'dependent'])
+# Everything a single walk over an lf gathers. Dependencies are kept as two
+# aligned arrays: (head index, dependent index) and interned (head, dependent)
+LogicalFormTables = collections.namedtuple(
+    'LogicalFormTables', ['word_info_map', 'dependency_indices',
+                          'dependency_codes', 'lf_index'])
 
 
-class Parse:
+class Parse(object):
     __REFERENCE = 'string'
     __FULL_WORDS = 'full-words'
     __PRED_INFO = 'pred-info'
 
-    def __init__(self, parent_filename, xml_lf):
+    __PRED_INFO_REGEX = re.compile('^.([0-9]+).*:.*:.*:(.*)$')
+    __FULL_WORDS_REGEX = re.compile('(^.*):S-.*:P-(.*):T-')
+    # (head index, dependent index) pairs are packed into a single integer
+    __INDEX_BITS = 32
+    __INDEX_MASK = (1 << __INDEX_BITS) - 1
+    __SUBSTITUTIONS = [('&apos;', "'"), ('&quot;', '"'), ('&#45;', '-'),
+                       ('&#58;', ':'), ('&amp;', '&'), ('&#45;', '-'),
+                       ('&lt;', '<'), ('&gt;', '>'), ('\\/', '/')]
+
+    def __init__(self, parent_filename, xml_lf, lazy=False):
         self.xml_lf = xml_lf
         self.filename = str(parent_filename.encode('utf8'))
         self.full_id = self.xml_lf.attrib['info']
         self.text = str(self.xml_lf.attrib['string'].encode('utf8'))
-        self.dependency_details_map = self.__get_dependencies_from_lf(xml_lf)
+        self.sort_key = self.__sort_key(self.full_id)
         self.reversal = None
         self.rewrites = []
-        self.__word_info_map = self.__get_word_info_map(xml_lf)
+        # A lazy parse waits to walk its lf until the details are needed
+        self.__lf_tables = None
+        self.__dependency_code_set = None
+        self.__dependency_details_map = None
+        if not lazy:
+            self.__compiled_lf()
+
+    @property
+    def dependency_details_map(self):
+        # Only built for callers which want the strings, ie. xml output
+        if self.__dependency_details_map is None:
+            self.__dependency_details_map = {
+                details: UnlabeledDependency(details[0].word, details[1].word)
+                for details, code in self.__coded_dependency_details()}
+        return self.__dependency_details_map
+
+    @property
+    def lf_index(self):
+        # Structural lookups shared by the rewrite and reversal utilities
+        return self.__compiled_lf().lf_index
+
+    @property
+    def id_node_map(self):
+        return self.lf_index.id_node_map
+
+    @property
+    def child_parent_map(self):
+        return self.lf_index.child_parent_map
+
+    def is_compiled(self):
+        return self.__lf_tables is not None
+
+    def __compiled_lf(self):
+        if self.__lf_tables is None:
+            # A single walk of the lf gathers everything we need from it
+            self.__lf_tables = self.__compile_lf(
+                self.xml_lf, self.pos_tag_of_word_at_index)
+        return self.__lf_tables
 
     def __str__(self):
         rep = 'Parse(parent_filename: {!s}, full_id: {!s}, text: {!s})'.format(
@@ -39,17 +94,7 @@ class Parse:
         return rep
 
     def __cmp__(self, other):
-        sentence_id, parse_number = self.full_id.split('-')
-        other_sentence_id, other_parse_number = other.full_id.split('-')
-
-        sentence_number = int(sentence_id[1:])
-        other_sentence_number = int(other_sentence_id[1:])
-        if sentence_number == other_sentence_number:
-            parse_number = int(parse_number)
-            other_parse_number = int(other_parse_number)
-            return cmp(parse_number, other_parse_number)
-        else:
-            return cmp(sentence_number, other_sentence_number)
+        return cmp(self.sort_key, other.sort_key)
 
     def __eq__(self, other):
         return (self.full_id == other.full_id and
@@ -60,59 +105,42 @@ class Parse:
                 self.dependency_detail_set() != other.dependency_detail_set())
 
     def __lt__(self, other):
-        sentence_id, parse_number = self.full_id.split('-')
-        other_sentence_id, other_parse_number = other.full_id.split('-')
-
-        sentence_number = int(sentence_id[1:])
-        other_sentence_number = int(other_sentence_id[1:])
-        if sentence_number == other_sentence_number:
-            parse_number = int(parse_number)
-            other_parse_number = int(other_parse_number)
-            return parse_number < other_parse_number
-        else:
-            return sentence_number < other_sentence_number
+        return self.sort_key < other.sort_key
 
     def __gt__(self, other):
-        sentence_id, parse_number = self.full_id.split('-')
-        other_sentence_id, other_parse_number = other.full_id.split('-')
-
-        sentence_number = int(sentence_id[1:])
-        other_sentence_number = int(other_sentence_id[1:])
-        if sentence_number == other_sentence_number:
-            parse_number = int(parse_number)
-            other_parse_number = int(other_parse_number)
-            return parse_number > other_parse_number
-        else:
-            return sentence_number > other_sentence_number
+        return self.sort_key > other.sort_key
 
     def __le__(self, other):
-        sentence_id, parse_number = self.full_id.split('-')
-        other_sentence_id, other_parse_number = other.full_id.split('-')
-
-        sentence_number = int(sentence_id[1:])
-        other_sentence_number = int(other_sentence_id[1:])
-        if sentence_number == other_sentence_number:
-            parse_number = int(parse_number)
-            other_parse_number = int(other_parse_number)
-            return parse_number <= other_parse_number
-        else:
-            return sentence_number <= other_sentence_number
+        return self.sort_key <= other.sort_key
 
     def __ge__(self, other):
-        sentence_id, parse_number = self.full_id.split('-')
-        other_sentence_id, other_parse_number = other.full_id.split('-')
-
-        sentence_number = int(sentence_id[1:])
-        other_sentence_number = int(other_sentence_id[1:])
-        if sentence_number == other_sentence_number:
-            parse_number = int(parse_number)
-            other_parse_number = int(other_parse_number)
-            return parse_number >= other_parse_number
-        else:
-            return sentence_number >= other_sentence_number
+        return self.sort_key >= other.sort_key
+
+    def unlabeled_dependency_codes(self):
+        # Interned (head, dependent) word pairs, see vocabulary.VOCABULARY
+        if self.__dependency_code_set is None:
+            self.__dependency_code_set = frozenset(
+                self.__compiled_lf().dependency_codes)
+        return self.__dependency_code_set
 
     def unlabeled_dependency_set(self):
-        return set(self.dependency_details_map.values())
+        return {UnlabeledDependency._make(VOCABULARY.decode_dependency(code))
+                for code in self.unlabeled_dependency_codes()}
+
+    def dependency_details_for(self, codes):
+        # Details of the dependencies whose unlabeled codes are in codes
+        return [details for details, code in self.__coded_dependency_details()
+                if code in codes]
+
+    def __coded_dependency_details(self):
+        tables = self.__compiled_lf()
+        word_info_map = tables.word_info_map
+        for packed, code in itertools.izip(tables.dependency_indices,
+                                           tables.dependency_codes):
+            head_index = packed >> Parse.__INDEX_BITS
+            dependent_index = packed & Parse.__INDEX_MASK
+            details = word_info_map[head_index], word_info_map[dependent_index]
+            yield details, code
 
     def dependency_detail_set(self):
         return set(self.dependency_details_map.keys())
@@ -125,51 +153,80 @@ class Parse:
         return self.xml_lf.attrib.get(self.__REFERENCE, '')
 
     @staticmethod
-    def __get_word_info_map(lf):
-        full_words_text = lf.find(Parse.__FULL_WORDS).text
-        word_info_map = Parse.__get_info_word_tag_index(full_words_text)
+    def __sort_key(full_id):
+        # Parses sort by sentence number and then by parse number
+        sentence_id, parse_number = full_id.split('-')
+        return int(sentence_id[1:]), int(parse_number)
 
-        pred_info_node = lf.find(Parse.__PRED_INFO)
-        pred_info_text = pred_info_node.attrib.get('data')
+    @staticmethod
+    def __compile_lf(lf, pos_tag_lookup):
+        # The index walks the whole item once, everything else reads from it
+        lf_index = LogicalFormIndex(lf, pos_tag_lookup)
+        # (head index, dependent index) pairs in document order
+        index_pairs = []
+        full_words_text = None
+        pred_info_text = None
+        for element in lf_index.elements:
+            tag = element.tag
+            if tag == 'node':
+                head_index = None
+                for rel in element:
+                    if rel.tag != 'rel':
+                        continue
+                    if head_index is None:
+                        # Some nested trickery with dict's get method
+                        head_id = element.attrib.get(
+                            'id', element.attrib.get('idref'))
+                        head_index = node_index(head_id)
+                    for sub_node in rel:
+                        dependent_id = sub_node.attrib.get(
+                            'id', sub_node.attrib.get('idref'))
+                        dependent_index = node_index(dependent_id)
+                        index_pairs.append((head_index, dependent_index))
+            elif tag == Parse.__FULL_WORDS and lf_index.parent(element) is lf:
+                full_words_text = element.text
+            elif tag == Parse.__PRED_INFO and lf_index.parent(element) is lf:
+                pred_info_text = element.attrib.get('data')
+
+        word_info_map = Parse.__get_info_word_tag_index(full_words_text)
         word_stem_map = Parse.__get_word_stem(pred_info_text)
         word_info_map = Parse.__combine_info_and_stem_map(
             word_info_map, word_stem_map)
-        return word_info_map
 
-    @staticmethod
-    def __get_dependencies_from_lf(lf):
-        word_info_map = Parse.__get_word_info_map(lf)
-        dependency_details = {}
-        # Find all nodes which have a 'rel' child
-        for sub_element in lf.findall('.//node/rel/..'):
-            # Update the dictionary as we go along
-            sub_map = Parse.__get_dependency_details(sub_element, word_info_map)
-            dependency_details.update(sub_map)
-        return dependency_details
+        # Array backed storage, strings are only looked up again for output
+        dependency_indices = array.array('l')
+        dependency_codes = array.array('l')
+        seen = set()
+        for head_index, dependent_index in index_pairs:
+            packed = (head_index << Parse.__INDEX_BITS) | dependent_index
+            if packed in seen:
+                continue
+            seen.add(packed)
+            code = VOCABULARY.encode_dependency(
+                word_info_map[head_index].word,
+                word_info_map[dependent_index].word)
+            dependency_indices.append(packed)
+            dependency_codes.append(code)
+        return LogicalFormTables(word_info_map, dependency_indices,
+                                 dependency_codes, lf_index)
 
     @staticmethod
     def __get_word_stem(pred_info):
         word_stem_map = {}
         pred_info_split = pred_info.split()
         for info in pred_info_split:
-            match = re.match('^.([0-9]+).*:.*:.*:(.*)$', info)
+            match = Parse.__PRED_INFO_REGEX.match(info)
             index = int(match.group(1))
             word_stem = match.group(2)
             word_stem = Parse.__restore_subbed_tokens(word_stem)
-            word_stem_map[index] = word_stem
+            word_stem_map[index] = VOCABULARY.canonical(word_stem)
         return word_stem_map
 
     @staticmethod
     def __restore_subbed_tokens(tokenized):
-        tokenized = re.sub(r'&apos;', "'", tokenized)
-        tokenized = re.sub(r'&quot;', '"', tokenized)
-        tokenized = re.sub(r'&#45;', '-', tokenized)
-        tokenized = re.sub(r'&#58;', ':', tokenized)
-        tokenized = re.sub(r'&amp;', '&', tokenized)
-        tokenized = re.sub(r'&#45;', '-', tokenized)
-        tokenized = re.sub(r'&lt;', '<', tokenized)
-        tokenized = re.sub(r'&gt;', '>', tokenized)
-        tokenized = re.sub(r'\\/', '/', tokenized)
+        # Plain replacements, applied in order, are all that is needed here
+        for token, replacement in Parse.__SUBSTITUTIONS:
+            tokenized = tokenized.replace(token, replacement)
         return tokenized
 
     @staticmethod
@@ -180,11 +237,12 @@ class Parse:
         word_info_map = {}
         for index, info in enumerate(info_list, start=1):
             # Here our match groups will grab the info we need
-            matches = re.match('(^.*):S-.*:P-(.*):T-', info)
+            matches = Parse.__FULL_WORDS_REGEX.match(info)
             if matches:
                 # Fix the substitutions
                 word = Parse.__restore_subbed_tokens(matches.group(1))
-                pos_tag = matches.group(2)
+                word = VOCABULARY.canonical(word)
+                pos_tag = VOCABULARY.canonical(matches.group(2))
                 word_info = WordInfo(word, index, pos_tag, '')
                 word_info_map[index - 1] = word_info
         return word_info_map
@@ -201,35 +259,62 @@ class Parse:
         return word_info_map
 
     @staticmethod
-    def __get_dependency_details(node, word_info_map):
-        # Some nested trickery with dict's get method
-        head_id = node.attrib.get('id', node.attrib.get('idref'))
-        match = re.match('.([0-9]+).*', head_id)
-        head_index = int(match.group(1))
-
-        head_details = word_info_map[head_index]
-        dependency_map = {}
-        # Examine all nodes whose parent is 'rel'
-        for sub_node in node.findall('rel/*'):
-            dependent_id = sub_node.attrib.get(
-                'id', sub_node.attrib.get('idref'))
-            match = re.match('.([0-9]+).*', dependent_id)
-            dependent_index = int(match.group(1))
-
-            dependent_details = word_info_map[dependent_index]
-            dependency = UnlabeledDependency(
-                head_details.word, dependent_details.word)
-            dependency_map[head_details, dependent_details] = dependency
-        return dependency_map
+    def __is_parse_item(item):
+        # Ignore items with no parse lfs and don't create parses for rewrites
+        return (int(item.attrib.get('numOfParses')) > 0 and
+                '#' not in item.attrib.get('info'))
 
     @staticmethod
-    def parse_factory(parent_filename, logical_form_file):
-        parse_tree = ElementTree.parse(logical_form_file)
-        lfs = parse_tree.findall('.//item')
-        # Ignore items with no parse lfs
-        lfs = [lf for lf in lfs if int(lf.attrib.get('numOfParses')) > 0]
-        # Don't create parses for rewrite lfs
-        return [Parse(parent_filename, lf) for lf in lfs if '#' not in lf.attrib.get('info')]
+    def sentence_parse_factory(parent_filename, logical_form_file,
+                               lazy=False):
+        # OpenCCG writes the n-best parses of a sentence one after the other,
+        # so we can hand back one sentence worth of parses at a time
+        sentence_id, sentence_parses = None, []
+        open_elements = []
+        skipping = False
+        events = ElementTree.iterparse(
+            logical_form_file, events=('start', 'end'))
+        for event, element in events:
+            if event == 'start':
+                if element.tag == 'item':
+                    skipping = not Parse.__is_parse_item(element)
+                open_elements.append(element)
+                continue
+            open_elements.pop()
+            if element.tag != 'item':
+                # Don't hold on to the insides of items we are ignoring
+                if skipping:
+                    element.clear()
+                continue
+            # Detach finished items so the tree does not keep them alive
+            if open_elements:
+                open_elements[-1].remove(element)
+            if skipping:
+                element.clear()
+                skipping = False
+                continue
+            parse = Parse(parent_filename, element, lazy=lazy)
+            if parse.sentence_id() != sentence_id and sentence_parses:
+                yield sentence_parses
+                sentence_parses = []
+            sentence_id = parse.sentence_id()
+            sentence_parses.append(parse)
+        if sentence_parses:
+            yield sentence_parses
+
+    @staticmethod
+    def parse_factory(parent_filename, logical_form_file, lazy=False):
+        sentence_parses = Parse.sentence_parse_factory(
+            parent_filename, logical_form_file, lazy=lazy)
+        return list(itertools.chain.from_iterable(sentence_parses))
+
+    def relabel(self, parent_filename, full_id):
+        # Moves the parse to another file and sentence, ie. from a chunk of a
+        # file back to the file itself
+        self.filename = str(parent_filename.encode('utf8'))
+        self.full_id = full_id
+        self.xml_lf.set('info', full_id)
+        self.sort_key = self.__sort_key(full_id)
 
     def has_valid_reversal(self):
         # is_validated can return None if the reversal was not yet checked
@@ -239,16 +324,18 @@ class Parse:
             return False
 
     def pos_tag_of_word_at_index(self, word_index):
-        if word_index in self.__word_info_map:
-            info = self.__word_info_map.get(word_index)
+        word_info_map = self.__compiled_lf().word_info_map
+        if word_index in word_info_map:
+            info = word_info_map.get(word_index)
             return info.pos_tag
         else:
             # TODO:Probably should throw an exception here
             return None
 
     def stem_of_word_at_index(self, word_index):
-        if word_index in self.__word_info_map:
-            info = self.__word_info_map.get(word_index)
+        word_info_map = self.__compiled_lf().word_info_map
+        if word_index in word_info_map:
+            info = word_info_map.get(word_index)
             return info.stem
         else:
             # TODO:Probably should throw an exception here
@@ -263,11 +350,11 @@ class Parse:
     def has_disambiguation_options(self):
         return self.has_valid_reversal() or self.has_valid_rewrites()
 
-    def xmlize(self, ambiguous_span):
+    def xmlize(self, ambiguous_codes):
         attributes = {'id': self.full_id, }
         parse_xml = ElementTree.Element('parse', attributes)
         info_xml = ElementTree.SubElement(parse_xml, 'dependencies')
-        for info, unlabeled in self.dependency_details_map.iteritems():
+        for info, code in self.__coded_dependency_details():
             head, dependent = info
             # These are namedtuples, _asdict is public but gives OrderedDict
             head_dict = dict(head._asdict())
@@ -275,7 +362,7 @@ class Parse:
             info_attributes = {
                 'head': str(head_dict),
                 'dependent': str(dependent_dict),
-                'ambiguous': str(unlabeled in ambiguous_span)}
+                'ambiguous': str(code in ambiguous_codes)}
             ElementTree.SubElement(info_xml, 'dependency', info_attributes)
         if self.reversal:
             parse_xml.append(self.reversal.xmlize())
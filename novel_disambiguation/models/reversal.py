@@ -17,14 +17,15 @@ class Reversal:
         # Returns None if validate was not yet called
         return self.validated
 
-    def validate(self, parent_parse, reparse, ambiguous_span):
+    def validate(self, parent_parse, reparse, ambiguous_codes):
+        # The span and dependencies are the interned codes of the parses
         self.reparse = reparse
-        parse_unlabeled = parent_parse.unlabeled_dependency_set()
-        parse_specific_span = parse_unlabeled.intersection(ambiguous_span)
+        parse_unlabeled = parent_parse.unlabeled_dependency_codes()
+        parse_specific_span = parse_unlabeled.intersection(ambiguous_codes)
         # Get the ambiguity that didn't exist in the parse
-        #unrelated_span = ambiguous_span.difference(parse_unlabeled)
+        #unrelated_span = ambiguous_codes.difference(parse_unlabeled)
         # Check if the parse specific ambiguous span exists in the reparse
-        reparse_unlabeled = reparse.unlabeled_dependency_set()
+        reparse_unlabeled = reparse.unlabeled_dependency_codes()
         self.validated = parse_specific_span.issubset(reparse_unlabeled)
         #has_subset = parse_specific_span.issubset(reparse_unlabeled)
         # Now check if the reparse excludes the unrelated span
@@ -3,10 +3,10 @@ from xml.etree import cElementTree as ElementTree
 
 
 class Rewrite():
-    def __init__(self, rewrite_id, validation_map):
+    def __init__(self, rewrite_id, rewrite_lf):
         self.full_id = rewrite_id
-        # This is used in setting up a correspondence for the realization
-        self.validation_map = validation_map
+        # This is aligned with a realization to set up a correspondence
+        self.rewrite_lf = rewrite_lf
 
         self.is_valid = None
         self.realization = None
@@ -1,4 +1,6 @@
 from xml.etree import cElementTree as ElementTree
+from parse import UnlabeledDependency
+from vocabulary import VOCABULARY
 
 __author__ = 'Ethan A. Hill'
 
@@ -11,6 +13,7 @@ class Sentence:
         self.next_best_parse = next_best_parse
         self.reference = top_parse.reference_sentence()
         self.full_id = top_parse.sentence_id()
+        self.__ambiguous_codes = None
 
     def __repr__(self):
         repr_rep = ('Sentence(parent_file_name: {!s}, '
@@ -78,31 +81,36 @@ class Sentence:
         else:
             return self.parent_file_name >= other.parent_file_name
 
+    def ambiguous_codes(self):
+        # The parses never change, so the interned span is only built once
+        if self.__ambiguous_codes is None:
+            if self.top_parse is not None and self.next_best_parse is not None:
+                dependencies = self.top_parse.unlabeled_dependency_codes()
+                other_depend = self.next_best_parse.unlabeled_dependency_codes()
+                self.__ambiguous_codes = dependencies.symmetric_difference(
+                    other_depend)
+            else:
+                # If there is no second parse, then there is no ambiguity
+                self.__ambiguous_codes = frozenset()
+        return self.__ambiguous_codes
+
     def ambiguous_span(self):
-        if self.top_parse is not None and self.next_best_parse is not None:
-            dependencies = self.top_parse.unlabeled_dependency_set()
-            other_depend = self.next_best_parse.unlabeled_dependency_set()
-            difference = dependencies.symmetric_difference(other_depend)
-        else:
-            # If there is no second parse, then there is no ambiguity
-            difference = set()
-        return difference
+        return {UnlabeledDependency._make(VOCABULARY.decode_dependency(code))
+                for code in self.ambiguous_codes()}
 
     def is_ambiguous(self):
-        return True if self.ambiguous_span() else False
+        return True if self.ambiguous_codes() else False
 
     def is_unambiguous(self):
-        return True if not self.ambiguous_span() else False
+        return True if not self.ambiguous_codes() else False
 
     def detailed_ambiguous_span(self):
-        span = self.ambiguous_span()
+        codes = self.ambiguous_codes()
         # Only look at existing parses
         parses = [p for p in [self.top_parse, self.next_best_parse] if p]
         detailed_span = set()
         for parse in parses:
-            for details, unlabeled in parse.dependency_details_map.iteritems():
-                if unlabeled in span:
-                    detailed_span.add(details)
+            detailed_span.update(parse.dependency_details_for(codes))
         return detailed_span
 
     def parse_specific_ambiguity_details(self, parse):
@@ -161,7 +169,7 @@ class Sentence:
             'ambiguous': str(self.is_ambiguous())}
         sentence_xml = ElementTree.Element('sentence', attributes)
         parses = [p for p in [self.top_parse, self.next_best_parse] if p]
-        if self.ambiguous_span():
+        if self.ambiguous_codes():
             ambiguous_span_xml = ElementTree.SubElement(
                 sentence_xml, 'ambiguous_span')
             for head, dependent in self.ambiguous_span():
@@ -172,6 +180,6 @@ class Sentence:
                     'dependency', unlabeled_attributes)
                 ambiguous_span_xml.append(dependency_xml)
         for parse in parses:
-            sentence_xml.append(parse.xmlize(self.ambiguous_span()))
+            sentence_xml.append(parse.xmlize(self.ambiguous_codes()))
         return sentence_xml
 
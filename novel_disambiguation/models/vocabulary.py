@@ -0,0 +1,59 @@
+__author__ = 'Ethan A. Hill'
+import threading
+
+
+class Vocabulary(object):
+    # Dependencies are packed into one integer as (head id, dependent id)
+    __DEPENDENT_BITS = 32
+    __DEPENDENT_MASK = (1 << __DEPENDENT_BITS) - 1
+
+    def __init__(self):
+        self.__string_ids = {}
+        self.__strings = []
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__strings)
+
+    def intern(self, string):
+        string_id = self.__string_ids.get(string)
+        if string_id is None:
+            # Worker threads share the table, so only one may add at a time
+            with self.__lock:
+                string_id = self.__string_ids.get(string)
+                if string_id is None:
+                    string_id = len(self.__strings)
+                    self.__strings.append(string)
+                    self.__string_ids[string] = string_id
+        return string_id
+
+    def string(self, string_id):
+        return self.__strings[string_id]
+
+    def canonical(self, string):
+        # Equal strings across all parses end up sharing one object
+        return self.__strings[self.intern(string)]
+
+    def encode_dependency(self, head, dependent):
+        return ((self.intern(head) << Vocabulary.__DEPENDENT_BITS) |
+                self.intern(dependent))
+
+    def decode_dependency(self, code):
+        head_id = code >> Vocabulary.__DEPENDENT_BITS
+        dependent_id = code & Vocabulary.__DEPENDENT_MASK
+        return self.__strings[head_id], self.__strings[dependent_id]
+
+    @staticmethod
+    def reverse_dependency(code):
+        head_id = code >> Vocabulary.__DEPENDENT_BITS
+        dependent_id = code & Vocabulary.__DEPENDENT_MASK
+        return (dependent_id << Vocabulary.__DEPENDENT_BITS) | head_id
+
+    @staticmethod
+    def is_self_reference(code):
+        head_id = code >> Vocabulary.__DEPENDENT_BITS
+        return head_id == code & Vocabulary.__DEPENDENT_MASK
+
+
+# Words, stems and pos tags of every parse in a run share this table
+VOCABULARY = Vocabulary()
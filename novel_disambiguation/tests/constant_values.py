@@ -69,4 +69,169 @@ TEST_DEPENDENCY_DETAILS = {(('announced', 1, 'VBD', 'announce.01'),
                                ('offer', 6, 'VB', 'offer.01'),
                                ('it', 4, 'PRP', 'it')), (
                                ('announced', 1, 'VBD', 'announce.01'),
-                               ('today', 2, 'NN', 'today'))}
\ No newline at end of file
+                               ('today', 2, 'NN', 'today'))}
+
+# A small tb.xml with a prepositional attachment ambiguity, used by tests
+# which should not depend on an OpenCCG installation
+TEST_PP_ATTACHMENT_LF = '''<?xml version="1.0" encoding="UTF-8"?>
+<regression>
+  <item numOfParses="3" info="s1-1" string="He saw the man with the telescope">
+    <lf>
+      <node id="w1" pred="see.01" tense="past" mood="dcl">
+        <rel name="Arg0"><node id="w0" pred="he" num="sg"/></rel>
+        <rel name="Arg1">
+          <node id="w3" pred="man" num="sg">
+            <rel name="Det"><node id="w2" pred="the"/></rel>
+          </node>
+        </rel>
+        <rel name="ArgM">
+          <node id="w4" pred="with">
+            <rel name="Arg1">
+              <node id="w6" pred="telescope" num="sg">
+                <rel name="Det"><node id="w5" pred="the"/></rel>
+              </node>
+            </rel>
+          </node>
+        </rel>
+      </node>
+    </lf>
+    <full-words>&lt;s&gt; He:S-he:P-PRP:T-PRP saw:S-see:P-VBD:T-VBD the:S-the:P-DT:T-DT man:S-man:P-NN:T-NN with:S-with:P-IN:T-IN the:S-the:P-DT:T-DT telescope:S-telescope:P-NN:T-NN &lt;/s&gt;</full-words>
+    <pred-info data="w0:X:PRP:he w1:X:VBD:see.01 w2:X:DT:the w3:X:NN:man w4:X:IN:with w5:X:DT:the w6:X:NN:telescope"/>
+  </item>
+  <item numOfParses="3" info="s1-2" string="He saw the man with the telescope">
+    <lf>
+      <node id="w1" pred="see.01" tense="past" mood="dcl">
+        <rel name="Arg0"><node id="w0" pred="he" num="sg"/></rel>
+        <rel name="Arg1">
+          <node id="w3" pred="man" num="sg">
+            <rel name="Det"><node id="w2" pred="the"/></rel>
+            <rel name="Mod">
+              <node id="w4" pred="with">
+                <rel name="Arg1">
+                  <node id="w6" pred="telescope" num="sg">
+                    <rel name="Det"><node id="w5" pred="the"/></rel>
+                  </node>
+                </rel>
+              </node>
+            </rel>
+          </node>
+        </rel>
+      </node>
+    </lf>
+    <full-words>&lt;s&gt; He:S-he:P-PRP:T-PRP saw:S-see:P-VBD:T-VBD the:S-the:P-DT:T-DT man:S-man:P-NN:T-NN with:S-with:P-IN:T-IN the:S-the:P-DT:T-DT telescope:S-telescope:P-NN:T-NN &lt;/s&gt;</full-words>
+    <pred-info data="w0:X:PRP:he w1:X:VBD:see.01 w2:X:DT:the w3:X:NN:man w4:X:IN:with w5:X:DT:the w6:X:NN:telescope"/>
+  </item>
+  <item numOfParses="3" info="s1-3" string="He saw the man with the telescope">
+    <lf>
+      <node id="w1" pred="see.01" tense="past" mood="dcl">
+        <rel name="Arg0"><node id="w0" pred="he" num="sg"/></rel>
+        <rel name="Arg1">
+          <node id="w3" pred="man" num="sg">
+            <rel name="Det"><node id="w2" pred="the"/></rel>
+          </node>
+        </rel>
+        <rel name="ArgM">
+          <node id="w4" pred="with">
+            <rel name="Arg1">
+              <node id="w6" pred="telescope" num="sg">
+                <rel name="Det"><node id="w5" pred="the"/></rel>
+              </node>
+            </rel>
+          </node>
+        </rel>
+      </node>
+    </lf>
+    <full-words>&lt;s&gt; He:S-he:P-PRP:T-PRP saw:S-see:P-VBD:T-VBD the:S-the:P-DT:T-DT man:S-man:P-NN:T-NN with:S-with:P-IN:T-IN the:S-the:P-DT:T-DT telescope:S-telescope:P-NN:T-NN &lt;/s&gt;</full-words>
+    <pred-info data="w0:X:PRP:he w1:X:VBD:see.01 w2:X:DT:the w3:X:NN:man w4:X:IN:with w5:X:DT:the w6:X:NN:telescope"/>
+  </item>
+  <item numOfParses="0" info="s2-1" string="Unparsable ."/>
+  <item numOfParses="1" info="s1-1#passive" string="">
+    <lf><node id="w0pass" pred="PASS"/></lf>
+  </item>
+</regression>
+'''
+
+TEST_PP_ATTACHMENT_TOP_DEPENDENCIES = {('saw', 'He'), ('saw', 'man'),
+                                       ('man', 'the'), ('saw', 'with'),
+                                       ('with', 'telescope'),
+                                       ('telescope', 'the')}
+TEST_PP_ATTACHMENT_NEXT_DEPENDENCIES = {('saw', 'He'), ('saw', 'man'),
+                                        ('man', 'the'), ('man', 'with'),
+                                        ('with', 'telescope'),
+                                        ('telescope', 'the')}
+
+TEST_REALIZE_NBEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<nbest>
+  <seg id="s1-1#passive" complete="true">
+    <best score="0.91">
+      <str>The man was seen by him with the telescope</str>
+      <lf>
+        <node id="w2" pred="PASS" tense="past" mood="dcl">
+          <rel name="Arg0">
+            <node id="w1" pred="man" num="sg">
+              <rel name="Det"><node id="w0" pred="the"/></rel>
+            </node>
+          </rel>
+          <rel name="Arg1">
+            <node id="w3" pred="see.01" partic="pass">
+              <rel name="ArgM">
+                <node id="w6" pred="with">
+                  <rel name="Arg1">
+                    <node id="w8" pred="telescope" num="sg">
+                      <rel name="Det"><node id="w7" pred="the"/></rel>
+                    </node>
+                  </rel>
+                </node>
+              </rel>
+              <rel name="Arg1"><node idref="w1"/></rel>
+              <rel name="Arg0">
+                <node id="w4" pred="by">
+                  <rel name="Arg1"><node id="w5" pred="him" num="sg"/></rel>
+                </node>
+              </rel>
+            </node>
+          </rel>
+        </node>
+      </lf>
+    </best>
+    <next score="0.42">
+      <str>The man with the telescope was seen by him</str>
+      <lf><node id="w5" pred="PASS" tense="past" mood="dcl"/></lf>
+    </next>
+  </seg>
+  <seg id="s1-1#cleft" complete="false">
+    <best score="0.12">
+      <str>It was the man he saw</str>
+      <lf><node id="w1" pred="be"/></lf>
+    </best>
+  </seg>
+  <seg id="s1-1" complete="true">
+    <best score="0.88">
+      <str>He saw the man with the telescope</str>
+      <lf><node id="w1" pred="see.01" tense="past" mood="dcl"/></lf>
+    </best>
+    <next score="0.65">
+      <str>With the telescope he saw the man</str>
+      <lf>
+        <node id="w4" pred="see.01" tense="past" mood="dcl">
+          <rel name="Arg0"><node id="w3" pred="he" num="sg"/></rel>
+          <rel name="Arg1">
+            <node id="w6" pred="man" num="sg">
+              <rel name="Det"><node id="w5" pred="the"/></rel>
+            </node>
+          </rel>
+          <rel name="ArgM">
+            <node id="w0" pred="with">
+              <rel name="Arg1">
+                <node id="w2" pred="telescope" num="sg">
+                  <rel name="Det"><node id="w1" pred="the"/></rel>
+                </node>
+              </rel>
+            </node>
+          </rel>
+        </node>
+      </lf>
+    </next>
+  </seg>
+</nbest>
+'''
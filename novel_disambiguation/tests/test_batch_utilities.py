@@ -0,0 +1,164 @@
+__author__ = 'Ethan A. Hill'
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+import constant_values
+from xml.etree import cElementTree as ElementTree
+from ..utilities import batch_utilities
+from ..utilities import disambig_utilities
+from ..utilities import worker_utilities
+
+
+def renumbered_xml(xml_string, tag, id_attribute, num_sentences):
+    # Repeats the fixture's first sentence once per sentence of a text file
+    root = ElementTree.fromstring(xml_string)
+    renumbered = ElementTree.Element(root.tag, root.attrib)
+    for number in xrange(1, num_sentences + 1):
+        for element in root.iter(tag):
+            number_, suffix = batch_utilities.split_sentence_id(
+                element.attrib[id_attribute])
+            if number_ == 1:
+                element_copy = copy.deepcopy(element)
+                element_copy.set(id_attribute, 's%d%s' % (number, suffix))
+                renumbered.append(element_copy)
+    return ElementTree.tostring(renumbered)
+
+
+class FixtureCcgWorker(worker_utilities.CcgWorker):
+    # Answers any text file as if each line were the fixture sentence
+
+    def __init__(self):
+        self.jobs = []
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        self.jobs.append((task, path_to_text))
+        num_sentences = len(batch_utilities.sentence_lines(path_to_text))
+        output_directory = '%s.dir' % path_to_text
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        if task == worker_utilities.PARSE_TASK:
+            file_name, contents = 'tb.xml', renumbered_xml(
+                constant_values.TEST_PP_ATTACHMENT_LF, 'item', 'info',
+                num_sentences)
+        else:
+            file_name, contents = 'realize.nbest', renumbered_xml(
+                constant_values.TEST_REALIZE_NBEST, 'seg', 'id',
+                num_sentences)
+        with open(os.path.join(output_directory, file_name), 'w') as f:
+            f.write(contents)
+        return 'BUILD SUCCESSFUL'
+
+
+class TestBatchUtilities(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.text_files = []
+        for name, num_lines in [('a', 2), ('b', 1), ('c', 3)]:
+            path = os.path.join(self.directory, name)
+            with open(path, 'w') as text_file:
+                text_file.write('He saw the man with the telescope\n' *
+                                num_lines)
+            self.text_files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pack_batches(self):
+        a, b, c = self.text_files
+        self.assertEqual(batch_utilities.pack_batches(self.text_files),
+                         [[a, b, c]])
+        self.assertEqual(batch_utilities.pack_batches(
+            self.text_files, max_sentences=3), [[a, b], [c]])
+        self.assertEqual(batch_utilities.pack_batches(
+            self.text_files, max_sentences=1), [[a], [b], [c]])
+
+    def test_sentence_id_remapping(self):
+        a, b, c = self.text_files
+        batch = batch_utilities.write_batch(
+            batch_utilities.batch_path_for(self.text_files), self.text_files)
+        self.assertEqual(batch.num_sentences, 6)
+        self.assertEqual(batch.member_sentence_id('s2-1'), (a, 's2-1'))
+        self.assertEqual(batch.member_sentence_id('s3-2#passive'),
+                         (b, 's1-2#passive'))
+        self.assertEqual(batch.member_sentence_id('s6'), (c, 's3'))
+        self.assertEqual(batch.member_sentence_id('s7'), (None, None))
+        self.assertEqual(batch.batch_sentence_id(c, 's1-1'), 's4-1')
+
+    def test_split_and_merge_logical_forms(self):
+        batch = batch_utilities.write_batch(
+            batch_utilities.batch_path_for(self.text_files), self.text_files)
+        FixtureCcgWorker().run(worker_utilities.PARSE_TASK, batch.path_to_text)
+        batch_path = os.path.join(batch.output_directory(), 'tb.xml')
+        original = ElementTree.parse(batch_path).getroot()
+        batch_utilities.split_logical_forms(batch)
+        c_items = ElementTree.parse(os.path.join(
+            '%s.dir' % self.text_files[2], 'tb.xml')).findall('item')
+        self.assertEqual([item.attrib['info'] for item in c_items][:4],
+                         ['s1-1', 's1-2', 's1-3', 's1-1#passive'])
+        self.assertEqual(len(c_items), 12)
+        batch_utilities.merge_logical_forms(batch)
+        merged = ElementTree.parse(batch_path).getroot()
+        self.assertEqual([item.attrib['info'] for item in merged],
+                         [item.attrib['info'] for item in original])
+
+    def test_disambiguate_batch_matches_single_files(self):
+        worker = FixtureCcgWorker()
+        batch_sentences = disambig_utilities.disambiguate_batch(
+            self.text_files, worker_pool=worker)
+        # One parse, one realize and one reparse for the whole batch
+        self.assertEqual([task for task, path in worker.jobs],
+                         ['parse', 'realize', 'parse'])
+        single_sentences = []
+        for text_file in self.text_files:
+            single_sentences.extend(disambig_utilities.disambiguate(
+                text_file, worker_pool=FixtureCcgWorker()))
+        self.assertEqual(len(batch_sentences), 6)
+        for batch_sentence, single_sentence in zip(batch_sentences,
+                                                   single_sentences):
+            self.assertEqual(ElementTree.tostring(batch_sentence.xmlize()),
+                             ElementTree.tostring(single_sentence.xmlize()))
+
+    def test_longest_first(self):
+        a, b, c = self.text_files
+        self.assertEqual(batch_utilities.longest_first(self.text_files),
+                         [c, a, b])
+        self.assertEqual(batch_utilities.longest_first([[b], [a, b], c]),
+                         [[a, b], c, [b]])
+
+    def test_split_large_files(self):
+        a, b, c = self.text_files
+        files, chunked_files = batch_utilities.split_large_files(
+            self.text_files, 2)
+        chunks, = chunked_files
+        self.assertEqual(chunks.path_to_text, c)
+        self.assertEqual(chunks.sentence_counts, [2, 1])
+        self.assertEqual(files, [a, b] + chunks.member_paths)
+        self.assertEqual(batch_utilities.sentence_lines(
+            chunks.member_paths[1]), ['He saw the man with the telescope'])
+        self.assertEqual(batch_utilities.split_large_files(
+            self.text_files, None), (self.text_files, []))
+
+    def test_chunks_reassemble_into_whole_file(self):
+        c = self.text_files[2]
+        _, chunked_files = batch_utilities.split_large_files([c], 2)
+        chunk_sentences = []
+        for chunk_path in chunked_files[0].member_paths:
+            chunk_sentences.extend(disambig_utilities.disambiguate(
+                chunk_path, worker_pool=FixtureCcgWorker()))
+        sentences = batch_utilities.reassemble_chunks(
+            chunk_sentences, chunked_files)
+        whole_sentences = disambig_utilities.disambiguate(
+            c, worker_pool=FixtureCcgWorker())
+        self.assertEqual([sentence.full_id for sentence in sentences],
+                         ['s1', 's2', 's3'])
+        for sentence, whole_sentence in zip(sentences, whole_sentences):
+            self.assertEqual(ElementTree.tostring(sentence.xmlize()),
+                             ElementTree.tostring(whole_sentence.xmlize()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import os
 import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 import constant_values
 from xml.etree import cElementTree as ElementTree
@@ -107,5 +110,54 @@ class TestBuildUtilities(unittest.TestCase):
         self.assertTrue(os.path.exists(expanded),
                         'Did not successfully create realize.nbest...')
 
+
+class TestRunCcgBuild(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'novel.dir', 'parse.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fake_build(self, lines, exit_code=0):
+        script = 'import sys\nfor line in %r:\n    print line\n' \
+                 'sys.exit(%d)\n' % (lines, exit_code)
+        return [sys.executable, '-c', script]
+
+    def test_output_is_streamed_to_log(self):
+        lines = ['[java] Parsing s%d-1' % (number / 2 + 1)
+                 for number in xrange(6)]
+        lines += ['noise %d' % number for number in xrange(300)]
+        lines.append('BUILD SUCCESSFUL')
+        progress = build_utilities.BuildProgress('novel')
+        output = build_utilities.run_ccg_build(
+            self.fake_build(lines), self.log_path, progress)
+        with open(self.log_path) as log_file:
+            self.assertEqual(log_file.read().splitlines(), lines)
+        # Only the tail is kept in memory
+        self.assertEqual(output.splitlines(),
+                         lines[-build_utilities.BUILD_OUTPUT_TAIL_LINES:])
+        self.assertEqual(progress.sentence_ids, set(['s1', 's2', 's3']))
+        self.assertEqual(progress.num_lines, len(lines))
+
+    def test_failed_build_raises_with_tail(self):
+        progress = build_utilities.BuildProgress('novel')
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            build_utilities.run_ccg_build(
+                self.fake_build(['BUILD FAILED'], 1), self.log_path, progress)
+        self.assertEqual(context.exception.returncode, 1)
+        self.assertEqual(context.exception.output, 'BUILD FAILED\n')
+
+    def test_build_past_deadline_is_killed(self):
+        progress = build_utilities.BuildProgress('novel')
+        command = [sys.executable, '-c',
+                   'import time\nprint "[java] s1"\ntime.sleep(30)\n']
+        with self.assertRaises(build_utilities.DeadlineExceeded) as context:
+            build_utilities.run_ccg_build(command, self.log_path, progress,
+                                          deadline=0.2)
+        self.assertEqual(context.exception.output, '[java] s1\n')
+        self.assertEqual(progress.sentence_ids, set(['s1']))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,146 @@
+__author__ = 'Ethan A. Hill'
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+import constant_values
+from ..utilities import cache_utilities
+from ..utilities import worker_utilities
+
+
+class TestOutputCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = os.path.join(self.directory, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, name, contents):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as output_file:
+            output_file.write(contents)
+        return path
+
+    def test_put_and_get(self):
+        cache = cache_utilities.OutputCache(self.store, 1024)
+        output_path = self.write_file('tb.xml', '<regression/>')
+        cache.put('key', [output_path])
+        restore_directory = os.path.join(self.directory, 'restored')
+        self.assertFalse(cache.get('other', restore_directory))
+        self.assertTrue(cache.get('key', restore_directory))
+        with open(os.path.join(restore_directory, 'tb.xml')) as restored:
+            self.assertEqual(restored.read(), '<regression/>')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # A new cache over the same store still has the entry
+        cache = cache_utilities.OutputCache(self.store, 1024)
+        self.assertTrue(cache.get('key', restore_directory))
+
+    def test_entry_stored_by_another_cache(self):
+        # ie. the cache of another process over the same store
+        cache = cache_utilities.OutputCache(self.store, 1024)
+        other_cache = cache_utilities.OutputCache(self.store, 1024)
+        output_path = self.write_file('tb.xml', '<regression/>')
+        cache.put('key', [output_path])
+        other_cache.put('key', [output_path])
+        self.assertEqual(os.listdir(self.store), ['key'])
+        self.assertEqual(other_cache.size(), cache.size())
+
+    def test_entry_evicted_by_another_cache(self):
+        output_path = self.write_file('tb.xml', '<regression/>')
+        cache = cache_utilities.OutputCache(self.store, 1024)
+        cache.put('key', [output_path])
+        # Sees the entry on opening, then the first cache evicts it
+        other_cache = cache_utilities.OutputCache(self.store, 1024)
+        cache.max_bytes = 0
+        cache.put('other', [output_path])
+        self.assertFalse(os.path.exists(os.path.join(self.store, 'key')))
+        restore_directory = os.path.join(self.directory, 'restored')
+        self.assertFalse(other_cache.get('key', restore_directory))
+        self.assertEqual((other_cache.hits, other_cache.misses), (0, 1))
+        self.assertFalse(other_cache.get('key', restore_directory))
+        self.assertEqual(other_cache.misses, 2)
+
+    def test_only_abandoned_puts_are_cleaned_up(self):
+        os.makedirs(self.store)
+        finished = subprocess.Popen(['true'])
+        finished.wait()
+        names = {'running': 'key.%d.1' % os.getpid(),
+                 'dead': 'key.%d.1' % finished.pid,
+                 'old': 'other.%d.1' % os.getpid()}
+        for name in names.itervalues():
+            os.makedirs(os.path.join(self.store, name))
+        long_ago = time.time() - cache_utilities.UNFINISHED_PUT_SECONDS - 1
+        os.utime(os.path.join(self.store, names['old']),
+                 (long_ago, long_ago))
+        cache_utilities.OutputCache(self.store, 1024)
+        self.assertEqual(os.listdir(self.store), [names['running']])
+
+    def test_least_recently_used_is_evicted(self):
+        cache = cache_utilities.OutputCache(self.store, 250)
+        output_path = self.write_file('realize.nbest', 'x' * 100)
+        cache.put('first', [output_path])
+        time.sleep(0.01)
+        cache.put('second', [output_path])
+        time.sleep(0.01)
+        self.assertTrue(cache.get('first', self.directory))
+        cache.put('third', [output_path])
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.get('first', self.directory))
+        self.assertFalse(cache.get('second', self.directory))
+        self.assertLessEqual(cache.size(), 250)
+
+    def test_store_is_bounded_across_caches(self):
+        cache = cache_utilities.OutputCache(self.store, 250)
+        other_cache = cache_utilities.OutputCache(self.store, 250)
+        output_path = self.write_file('realize.nbest', 'x' * 100)
+        cache.put('first', [output_path])
+        time.sleep(0.01)
+        other_cache.put('second', [output_path])
+        time.sleep(0.01)
+        other_cache.put('third', [output_path])
+        self.assertEqual(sorted(os.listdir(self.store)), ['second', 'third'])
+        self.assertEqual(other_cache.evictions, 1)
+        self.assertFalse(cache.get('first', self.directory))
+
+    def test_caching_worker_runs_changed_inputs_only(self):
+        cache = cache_utilities.OutputCache(self.store, 1 << 20)
+        stub = worker_utilities.StubCcgWorker({
+            worker_utilities.PARSE_TASK: {
+                'tb.xml': constant_values.TEST_PP_ATTACHMENT_LF},
+            worker_utilities.REALIZE_TASK: {
+                'realize.nbest': constant_values.TEST_REALIZE_NBEST}})
+        worker = worker_utilities.CachingCcgWorker(stub, cache)
+        path_to_text = self.write_file(
+            'novel', 'He saw the man with the telescope\n')
+        for _ in xrange(2):
+            worker.run(worker_utilities.PARSE_TASK, path_to_text)
+            worker.run(worker_utilities.REALIZE_TASK, path_to_text)
+        self.assertEqual(len(stub.jobs), 2)
+        # Appending rewrites to tb.xml changes what gets realized
+        with open('%s.dir/tb.xml' % path_to_text, 'a') as lf_file:
+            lf_file.write('\n')
+        worker.run(worker_utilities.REALIZE_TASK, path_to_text)
+        self.assertEqual(len(stub.jobs), 3)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+    def test_caching_worker_survives_a_failed_put(self):
+        class BrokenCache(cache_utilities.OutputCache):
+            def put(self, key, file_paths):
+                raise IOError('No space left on device')
+        stub = worker_utilities.StubCcgWorker({
+            worker_utilities.PARSE_TASK: {
+                'tb.xml': constant_values.TEST_PP_ATTACHMENT_LF}})
+        worker = worker_utilities.CachingCcgWorker(
+            stub, BrokenCache(self.store, 1024))
+        path_to_text = self.write_file(
+            'novel', 'He saw the man with the telescope\n')
+        self.assertEqual(worker.run(worker_utilities.PARSE_TASK, path_to_text),
+                         'BUILD SUCCESSFUL')
+
+
+if __name__ == '__main__':
+    unittest.main()
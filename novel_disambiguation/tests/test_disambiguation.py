@@ -1,7 +1,12 @@
+import itertools
 import os
+import shutil
+import tempfile
 import unittest
 from ..utilities import disambig_utilities
 from ..utilities import build_utilities
+from ..utilities import system_utilities
+from ..utilities import worker_utilities
 from ..constants import ccg_values
 from ..tests import constant_values
 
@@ -42,5 +47,57 @@ class TestDisambiguation(unittest.TestCase):
     def test_disambiguate_post_process_true(self):
         disambig_utilities.disambiguate(self.path_to_text, True)
 
+
+class TestProcessExecution(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.text_files = []
+        for name in ['first', 'second', 'third']:
+            path_to_text = os.path.join(self.directory, name)
+            with open(path_to_text, 'w') as text_file:
+                text_file.write('He saw the man with the telescope\n')
+            self.text_files.append(path_to_text)
+        self.pool_arguments = {'backend': 'stub', 'task_files': {
+            worker_utilities.PARSE_TASK: {
+                'tb.xml': constant_values.TEST_PP_ATTACHMENT_LF},
+            worker_utilities.REALIZE_TASK: {
+                'realize.nbest': constant_values.TEST_REALIZE_NBEST}}}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_processes_match_threads(self):
+        results = disambig_utilities.disambiguate_in_processes(
+            self.text_files, 2, pool_arguments=self.pool_arguments)
+        entries = sorted(itertools.chain.from_iterable(
+            result.entries for result in results))
+        # Text files are relative to ccgbank in the output, as ever
+        self.assertEqual(
+            [key for key, _, _ in entries],
+            [(system_utilities.ccgbank_relative_path(path), 1)
+             for path in sorted(self.text_files)])
+        # The processes left their output behind for a post processing run
+        expected = []
+        for text_file in sorted(self.text_files):
+            sentences = disambig_utilities.disambiguate(text_file, True)
+            expected.extend(
+                disambig_utilities.DisambiguationResult(sentences).entries)
+        self.assertEqual(entries, expected)
+        # Options come along for the ambiguous sentence
+        self.assertTrue(all(options for _, _, options in entries))
+
+    def test_failed_job_is_skipped(self):
+        # Under a file, so not even its output directory can be made
+        missing = os.path.join(self.text_files[1], 'missing')
+        results = disambig_utilities.disambiguate_in_processes(
+            [missing] + self.text_files[:1], 2,
+            pool_arguments=self.pool_arguments)
+        # Only the file that is there comes back
+        self.assertEqual(len(results), 1)
+        self.assertEqual(
+            [key for key, _, _ in results[0].entries],
+            [(system_utilities.ccgbank_relative_path(self.text_files[0]),
+              1)])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,199 @@
+__author__ = 'Ethan A. Hill'
+
+import os
+import shutil
+import tempfile
+import unittest
+from xml.etree import cElementTree as ElementTree
+from ..utilities import dump_utilities
+from ..utilities import system_utilities
+
+
+class FixtureResult(object):
+    def __init__(self, entries):
+        self.entries = entries
+
+
+class TestDumpWriters(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xml_dump = os.path.join(self.directory, 'xml_dump.xml')
+        self.option_dump = os.path.join(self.directory, 'option_dump.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_streaming_writer(self):
+        writer = dump_utilities.StreamingXmlWriter(self.xml_dump, 'root')
+        writer.write(ElementTree.Element('first'))
+        writer.write('<second />')
+        writer.flush()
+        # Everything written so far is on disk, short of the end tag
+        with open(self.xml_dump) as dump_file:
+            self.assertNotIn('</root>', dump_file.read())
+        writer.close()
+        writer.close()
+        root = ElementTree.parse(self.xml_dump).getroot()
+        self.assertEqual(root.tag, 'root')
+        self.assertEqual([e.tag for e in root], ['first', 'second'])
+        self.assertEqual(writer.num_elements, 2)
+
+    def test_results_are_written_to_both_dumps(self):
+        writers = dump_utilities.DumpWriters(self.xml_dump, self.option_dump)
+        writers.write_result(FixtureResult([
+            (('novel', 1), '<sentence id="1" />',
+             ['<option id="1a" />', '<option id="1b" />'])]))
+        writers.write_result(FixtureResult([
+            (('other', 1), '<sentence id="2" />', [])]))
+        writers.close()
+        xml_root = ElementTree.parse(self.xml_dump).getroot()
+        self.assertEqual(xml_root.tag, dump_utilities.XML_DUMP_ROOT)
+        self.assertEqual([e.get('id') for e in xml_root], ['1', '2'])
+        option_root = ElementTree.parse(self.option_dump).getroot()
+        self.assertEqual(option_root.tag, dump_utilities.OPTION_DUMP_ROOT)
+        self.assertEqual([e.get('id') for e in option_root], ['1a', '1b'])
+
+    def test_dumps_may_be_off(self):
+        writers = dump_utilities.DumpWriters(option_dump_path=self.option_dump)
+        writers.write_result(FixtureResult([
+            (('novel', 1), '<sentence />', ['<option />'])]))
+        writers.close()
+        self.assertFalse(os.path.exists(self.xml_dump))
+        self.assertEqual(
+            len(ElementTree.parse(self.option_dump).getroot()), 1)
+
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shard_directory = os.path.join(self.directory, 'shards')
+        self.xml_dump = os.path.join(self.directory, 'xml_dump.xml')
+        self.option_dump = os.path.join(self.directory, 'option_dump.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def result(self, text_file, numbers, version=''):
+        entries = []
+        for number in numbers:
+            attributes = 'text_file="%s" sentence_id="s%d"' % (text_file,
+                                                               number)
+            entries.append(((text_file, number),
+                            '<sentence %s version="%s" />' % (attributes,
+                                                               version),
+                            ['<option %s option="%s" />' % (attributes, o)
+                             for o in 'ab']))
+        return FixtureResult(entries)
+
+    def dump_ids(self, dump_path, *attribute_names):
+        return [tuple(e.get(name) for name in attribute_names)
+                for e in ElementTree.parse(dump_path).getroot()]
+
+    def test_merge_is_in_sentence_order(self):
+        shards = dump_utilities.ShardWriter(self.shard_directory)
+        shards.write_result(self.result('b', [2, 1, 10]), 'b')
+        # A batch gets a shard per file, the chunks of a file one each
+        shards.write_result(self.result('a', [3]), [
+            system_utilities.ccgbank_path(text_file)
+            for text_file in ['a', 'empty']])
+        shards.write_result(self.result('c', [4, 3]), '/.chunks/c.part2')
+        shards.write_result(self.result('c', [1, 2]), '/.chunks/c.part1')
+        self.assertEqual(len(os.listdir(self.shard_directory)), 6)
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump,
+                                    self.option_dump)
+        expected = [('a', 's3'), ('b', 's1'), ('b', 's2'), ('b', 's10'),
+                    ('c', 's1'), ('c', 's2'), ('c', 's3'), ('c', 's4')]
+        self.assertEqual(self.dump_ids(
+            self.xml_dump, 'text_file', 'sentence_id'), expected)
+        self.assertEqual(
+            self.dump_ids(self.option_dump, 'text_file', 'sentence_id',
+                          'option'),
+            [ids + (o, ) for ids in expected for o in 'ab'])
+
+    def test_patch_replaces_changed_shards(self):
+        shards = dump_utilities.ShardWriter(self.shard_directory)
+        for text_file in ['a', 'b', 'c']:
+            shards.write_result(self.result(text_file, [1, 2]), text_file)
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump,
+                                    self.option_dump)
+        # Only /b changed, and lost a sentence
+        shards.write_result(self.result('b', [1], 'new'), 'b')
+        shards.write_result(self.result('c', [1, 2]), 'c')
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump,
+                                    self.option_dump)
+        self.assertEqual(
+            self.dump_ids(self.xml_dump, 'text_file', 'sentence_id',
+                          'version'),
+            [('a', 's1', ''), ('a', 's2', ''), ('b', 's1', 'new'),
+             ('c', 's1', ''), ('c', 's2', '')])
+        # Patched, the dumps are as if merged from scratch
+        for dump_path, root_tag in [
+                (self.xml_dump, dump_utilities.XML_DUMP_ROOT),
+                (self.option_dump, dump_utilities.OPTION_DUMP_ROOT)]:
+            rebuilt_path = os.path.join(self.directory, 'rebuilt.xml')
+            dump_utilities.update_dump(self.shard_directory, rebuilt_path,
+                                       root_tag, rebuild=True)
+            with open(dump_path) as dump_file:
+                with open(rebuilt_path) as rebuilt_file:
+                    self.assertEqual(dump_file.read(), rebuilt_file.read())
+
+    def test_later_run_supersedes_chunks(self):
+        shards = dump_utilities.ShardWriter(self.shard_directory)
+        shards.write_result(self.result('a', [1]), 'a')
+        for part in xrange(1, 4):
+            shards.write_result(self.result('c', [part]),
+                                '/.chunks/c.part%d' % part)
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump)
+        # The next run no longer chunks c
+        shards = dump_utilities.ShardWriter(self.shard_directory)
+        shards.write_result(self.result('c', [1, 2, 3], 'whole'), 'c')
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump)
+        self.assertEqual(
+            self.dump_ids(self.xml_dump, 'text_file', 'sentence_id',
+                          'version'),
+            [('a', 's1', ''), ('c', 's1', 'whole'), ('c', 's2', 'whole'),
+             ('c', 's3', 'whole')])
+        self.assertEqual(
+            sorted(os.listdir(self.shard_directory)),
+            sorted([dump_utilities.SHARD_INDEX_NAME,
+                    dump_utilities.shard_name('a'),
+                    dump_utilities.shard_name('c')]))
+
+    def test_partial_run_keeps_untouched_shards(self):
+        shards = dump_utilities.ShardWriter(self.shard_directory)
+        for text_file in ['a', 'b', 'c', 'd']:
+            shards.write_result(self.result(text_file, [1]), text_file)
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump)
+        # The next run only processes b
+        shards = dump_utilities.ShardWriter(self.shard_directory)
+        shards.write_result(self.result('b', [1], 'new'), 'b')
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump)
+        self.assertEqual(
+            self.dump_ids(self.xml_dump, 'text_file', 'version'),
+            [('a', ''), ('b', 'new'), ('c', ''), ('d', '')])
+        self.assertEqual(
+            sorted(os.listdir(self.shard_directory)),
+            sorted([dump_utilities.SHARD_INDEX_NAME] +
+                   [dump_utilities.shard_name(text_file)
+                    for text_file in ['a', 'b', 'c', 'd']]))
+        # Pruning is asked for
+        dump_utilities.update_dumps(self.shard_directory, self.xml_dump,
+                                    keep_text_files=['a', 'b'])
+        self.assertEqual(self.dump_ids(self.xml_dump, 'text_file'),
+                         [('a', ), ('b', )])
+        self.assertEqual(
+            sorted(dump_utilities.read_shard_index(self.shard_directory)),
+            sorted(dump_utilities.shard_name(text_file)
+                   for text_file in ['a', 'b']))
+
+    def test_merged_records_ties_keep_stream_order(self):
+        merged = dump_utilities.merged_records([
+            iter([(('a', 1), 'first'), (('a', 3), 'third')]),
+            iter([(('a', 1), 'second'), (('a', 2), 'between')])])
+        self.assertEqual([xml for _, xml in merged],
+                         ['first', 'second', 'between', 'third'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+__author__ = 'Ethan A. Hill'
+
+import os
+import shutil
+import tempfile
+import unittest
+import constant_values
+from ..utilities import disambig_utilities
+from ..utilities import journal_utilities
+from ..utilities import worker_utilities
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal')
+        self.novel = os.path.join(self.directory, 'novel')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_survive_a_resume(self):
+        journal = journal_utilities.Journal(self.path)
+        journal.record(self.novel, worker_utilities.PARSE_TASK)
+        journal.save_result(self.novel, ['sentence'])
+        journal.close()
+        journal = journal_utilities.Journal(self.path, resume=True)
+        self.assertTrue(journal.completed(self.novel,
+                                          worker_utilities.PARSE_TASK))
+        self.assertFalse(journal.completed(self.novel,
+                                           worker_utilities.REALIZE_TASK))
+        self.assertTrue(journal.finished(self.novel))
+        self.assertEqual(list(journal.results()),
+                         [(self.novel, ['sentence'])])
+        journal.close()
+        # Without resuming, the run starts over
+        journal = journal_utilities.Journal(self.path)
+        self.assertFalse(journal.finished(self.novel))
+        self.assertEqual(len(journal), 0)
+        self.assertEqual(os.listdir(journal.results_directory), [])
+        journal.close()
+
+    def test_torn_record_is_ignored(self):
+        journal = journal_utilities.Journal(self.path)
+        journal.save_result(self.novel, 'first')
+        journal.close()
+        with open(self.path, 'a') as journal_file:
+            journal_file.write('{"job": "/half')
+        journal = journal_utilities.Journal(self.path, resume=True)
+        other = os.path.join(self.directory, 'other')
+        journal.save_result(other, 'second')
+        journal.close()
+        journal = journal_utilities.Journal(self.path, resume=True)
+        self.assertEqual([result for _, result in journal.results()],
+                         ['first', 'second'])
+        journal.close()
+
+    def test_results_of_given_jobs(self):
+        journal = journal_utilities.Journal(self.path)
+        batch = [self.novel, os.path.join(self.directory, 'other')]
+        journal.save_result(batch, 'batch')
+        journal.save_result(self.novel, 'novel')
+        journal.close()
+        journal = journal_utilities.Journal(self.path, resume=True)
+        self.assertTrue(journal.finished(list(batch)))
+        self.assertEqual(list(journal.results([self.novel])),
+                         [(self.novel, 'novel')])
+        self.assertEqual(list(journal.results([batch, self.novel])),
+                         [(tuple(batch), 'batch'), (self.novel, 'novel')])
+        journal.close()
+
+
+class TestJournalingWorker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path_to_text = os.path.join(self.directory, 'novel')
+        with open(self.path_to_text, 'w') as text_file:
+            text_file.write('He saw the man with the telescope\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stub(self):
+        return worker_utilities.StubCcgWorker({
+            worker_utilities.PARSE_TASK: {
+                'tb.xml': constant_values.TEST_PP_ATTACHMENT_LF},
+            worker_utilities.REALIZE_TASK: {
+                'realize.nbest': constant_values.TEST_REALIZE_NBEST}})
+
+    def test_journaled_jobs_are_not_run_again(self):
+        journal_path = os.path.join(self.directory, 'journal')
+        journal = journal_utilities.Journal(journal_path)
+        stub = self.stub()
+        worker = worker_utilities.JournalingCcgWorker(stub, journal)
+        disambig_utilities.disambiguate(self.path_to_text, worker_pool=worker)
+        self.assertEqual(len(stub.jobs), 3)
+        journal.close()
+        # Resumed, the jobs are left from the first run
+        journal = journal_utilities.Journal(journal_path, resume=True)
+        stub = self.stub()
+        worker = worker_utilities.JournalingCcgWorker(stub, journal)
+        for task in [worker_utilities.PARSE_TASK,
+                     worker_utilities.REALIZE_TASK]:
+            worker.run(task, self.path_to_text)
+        self.assertEqual(stub.jobs, [])
+        other = os.path.join(self.directory, 'other')
+        worker.run(worker_utilities.PARSE_TASK, other)
+        self.assertEqual(stub.jobs, [(worker_utilities.PARSE_TASK, other)])
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+__author__ = 'Ethan A. Hill'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import constant_values
+from xml.etree import cElementTree as ElementTree
+from ..utilities import disambig_utilities
+from ..utilities import manifest_utilities
+from ..utilities import worker_utilities
+
+
+class TestStageManifest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_directory = os.path.join(self.directory, 'novel.dir')
+        os.makedirs(self.output_directory)
+        self.text = self.write_file('novel', 'He saw the man')
+        self.lf = os.path.join(self.output_directory, 'tb.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, name, contents):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as output_file:
+            output_file.write(contents)
+        return path
+
+    def run_stage(self, manifest, stage, inputs, outputs, contents):
+        input_hashes = manifest.hashes(inputs)
+        for output in outputs:
+            with open(output, 'w') as output_file:
+                output_file.write(contents)
+        manifest.record(stage, input_hashes, outputs, {'grammar': 'g'})
+
+    def test_stage_is_fresh_until_something_changes(self):
+        manifest = manifest_utilities.StageManifest(self.output_directory)
+        self.assertFalse(manifest.is_fresh('parse', [self.text], [self.lf]))
+        self.run_stage(manifest, 'parse', [self.text], [self.lf], '<lf/>')
+        # Read back from the sidecar
+        manifest = manifest_utilities.StageManifest(self.output_directory)
+        parameters = {'grammar': 'g'}
+        self.assertTrue(manifest.is_fresh('parse', [self.text], [self.lf],
+                                          parameters))
+        self.assertFalse(manifest.is_fresh('parse', [self.text], [self.lf],
+                                           {'grammar': 'other'}))
+        # The same contents written again are still fresh
+        time.sleep(0.01)
+        self.write_file('novel', 'He saw the man')
+        self.assertTrue(manifest.is_fresh('parse', [self.text], [self.lf],
+                                          parameters))
+        self.write_file('novel', 'He saw the woman')
+        self.assertFalse(manifest.is_fresh('parse', [self.text], [self.lf],
+                                           parameters))
+
+    def test_outputs_changed_in_place(self):
+        manifest = manifest_utilities.StageManifest(self.output_directory)
+        self.run_stage(manifest, 'parse', [self.text], [self.lf], '<lf/>')
+        self.run_stage(manifest, 'rewrite', [self.lf], [self.lf],
+                       '<lf><rewrite/></lf>')
+        parameters = {'grammar': 'g'}
+        # The rewrites are the parse's own output carried on
+        self.assertTrue(manifest.is_fresh('parse', [self.text], [self.lf],
+                                          parameters))
+        self.assertTrue(manifest.is_fresh('rewrite', [self.lf], [self.lf],
+                                          parameters))
+        # A new parse leaves the rewrites to be done again
+        self.run_stage(manifest, 'parse', [self.text], [self.lf], '<lf/>')
+        self.assertTrue(manifest.is_fresh('parse', [self.text], [self.lf],
+                                          parameters))
+        self.assertFalse(manifest.is_fresh('rewrite', [self.lf], [self.lf],
+                                           parameters))
+        os.remove(self.lf)
+        self.assertFalse(manifest.is_fresh('parse', [self.text], [self.lf],
+                                           parameters))
+
+
+class TestIncrementalDisambiguation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path_to_text = os.path.join(self.directory, 'novel')
+        self.write_text('He saw the man with the telescope\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_text(self, contents):
+        with open(self.path_to_text, 'w') as text_file:
+            text_file.write(contents)
+
+    def stub(self):
+        return worker_utilities.StubCcgWorker({
+            worker_utilities.PARSE_TASK: {
+                'tb.xml': constant_values.TEST_PP_ATTACHMENT_LF},
+            worker_utilities.REALIZE_TASK: {
+                'realize.nbest': constant_values.TEST_REALIZE_NBEST}})
+
+    def test_only_stale_stages_run(self):
+        stub = self.stub()
+        expected = disambig_utilities.DisambiguationResult(
+            disambig_utilities.disambiguate(self.path_to_text,
+                                            worker_pool=stub))
+        self.assertEqual(len(stub.jobs), 3)
+        lf_path = '%s.dir/tb.xml' % self.path_to_text
+        with open(lf_path) as lf_file:
+            rewritten_lf = lf_file.read()
+        # Nothing changed, nothing runs and the rewrites aren't added again
+        stub = self.stub()
+        sentences = disambig_utilities.disambiguate(self.path_to_text,
+                                                    worker_pool=stub)
+        self.assertEqual(stub.jobs, [])
+        with open(lf_path) as lf_file:
+            self.assertEqual(lf_file.read(), rewritten_lf)
+        self.assertEqual(
+            disambig_utilities.DisambiguationResult(sentences).entries,
+            expected.entries)
+        # A stale realization is run again on its own
+        os.remove('%s.dir/realize.nbest' % self.path_to_text)
+        stub = self.stub()
+        disambig_utilities.disambiguate(self.path_to_text, worker_pool=stub)
+        self.assertEqual(stub.jobs, [
+            (worker_utilities.REALIZE_TASK, self.path_to_text)])
+        # A changed text is parsed again, the parse being the same nothing
+        # after the rewrites needs to run
+        self.write_text('He saw the man with the telescope.\n')
+        stub = self.stub()
+        disambig_utilities.disambiguate(self.path_to_text, worker_pool=stub)
+        self.assertEqual(stub.jobs, [
+            (worker_utilities.PARSE_TASK, self.path_to_text)])
+        with open(lf_path) as lf_file:
+            self.assertEqual(lf_file.read(), rewritten_lf)
+
+    def test_post_process_runs_nothing(self):
+        stub = self.stub()
+        disambig_utilities.disambiguate(self.path_to_text, worker_pool=stub)
+        os.remove('%s.dir/realize.nbest' % self.path_to_text)
+        stub = self.stub()
+        with self.assertRaises(IOError):
+            disambig_utilities.disambiguate(self.path_to_text, True, stub)
+        self.assertEqual(stub.jobs, [])
+
+    def rewrite_ids(self):
+        root = ElementTree.parse('%s.dir/tb.xml' % self.path_to_text)
+        return [item.get('info') for item in root.getroot()
+                if '#' in item.get('info')]
+
+    def test_post_process_reruns_keep_one_set_of_rewrites(self):
+        disambig_utilities.disambiguate(self.path_to_text,
+                                        worker_pool=self.stub())
+        rewrite_ids = self.rewrite_ids()
+        for _ in xrange(2):
+            disambig_utilities.disambiguate(self.path_to_text, True)
+            self.assertEqual(self.rewrite_ids(), rewrite_ids)
+        # Nor without the manifest, ie. from before there was one
+        os.remove('%s.dir/%s' % (self.path_to_text,
+                                 manifest_utilities.MANIFEST_FILE_NAME))
+        for _ in xrange(2):
+            disambig_utilities.disambiguate(self.path_to_text, True)
+            rewrite_ids = self.rewrite_ids()
+            self.assertEqual(len(set(rewrite_ids)), len(rewrite_ids))
+            self.assertIn('s1-1#cleft', rewrite_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import constant_values
+from StringIO import StringIO
+from xml.etree import cElementTree as ElementTree
+from ..models.parse import Parse
+from ..models.lf_index import align_logical_forms, node_index
+from ..utilities import sentence_utilities
+
+__author__ = 'Ethan A. Hill'
+
+
+class TestParseLogicalForm(unittest.TestCase):
+    # These tests use a fixed tb.xml so they do not need OpenCCG
+
+    def setUp(self):
+        root = ElementTree.fromstring(constant_values.TEST_PP_ATTACHMENT_LF)
+        self.items = root.findall('item')
+
+    def test_dependencies_from_single_pass(self):
+        parse = Parse('test', self.items[0])
+        self.assertEqual(
+            constant_values.TEST_PP_ATTACHMENT_TOP_DEPENDENCIES,
+            parse.unlabeled_dependency_set(),
+            'dependency set did not match expected set')
+
+    def test_word_details_from_single_pass(self):
+        parse = Parse('test', self.items[1])
+        self.assertEqual(parse.pos_tag_of_word_at_index(4), 'IN')
+        self.assertEqual(parse.stem_of_word_at_index(1), 'see.01')
+        self.assertIsNone(parse.pos_tag_of_word_at_index(42))
+
+    def test_node_tables_from_single_pass(self):
+        item = self.items[0]
+        parse = Parse('test', item)
+        for node in item.findall('.//node[@id]'):
+            self.assertIs(parse.id_node_map[node.attrib['id']], node)
+        child_parent_map = {c: p for p in item.iter() for c in p}
+        self.assertEqual(child_parent_map, parse.child_parent_map)
+
+    def test_node_index(self):
+        self.assertEqual(node_index('w12'), 12)
+        self.assertEqual(node_index('x1'), 1)
+
+    def test_lf_index_structure(self):
+        parse = Parse('test', self.items[1])
+        lf_index = parse.lf_index
+        with_node = lf_index.node_at_index(4)
+        self.assertIs(with_node, lf_index.node_with_id('w4'))
+        # In the second parse 'with' attaches to 'man', not to 'saw'
+        self.assertIs(lf_index.parent_verb_node(with_node),
+                      lf_index.node_with_id('w1'))
+        self.assertTrue(lf_index.is_descendant(
+            with_node, lf_index.node_with_id('w3')))
+        self.assertFalse(lf_index.is_descendant(
+            lf_index.node_with_id('w3'), with_node))
+        self.assertFalse(lf_index.is_descendant(with_node, with_node))
+        self.assertIsNone(lf_index.parent_verb_node(
+            lf_index.node_with_id('w1')))
+
+    def test_align_logical_forms(self):
+        lf = self.items[0].find('lf')
+        nbest = ElementTree.fromstring(constant_values.TEST_REALIZE_NBEST)
+        realization_lf = nbest.find('seg[@id="s1-1"]/next/lf')
+        alignment = align_logical_forms(lf, realization_lf)
+        aligned_ids = dict((node.attrib['id'], other.attrib['id'])
+                           for node, other in alignment.iteritems()
+                           if 'id' in node.attrib)
+        self.assertEqual(aligned_ids, {'w0': 'w3', 'w1': 'w4', 'w2': 'w5',
+                                       'w3': 'w6', 'w4': 'w0', 'w5': 'w1',
+                                       'w6': 'w2'})
+        # 'with' hangs off 'man' in the second parse, so nothing matches
+        other_alignment = align_logical_forms(lf, self.items[1].find('lf'))
+        self.assertNotIn(lf.find('.//node[@id="w4"]'), other_alignment)
+        self.assertIn(lf.find('.//node[@id="w3"]'), other_alignment)
+
+    def test_sentence_parse_factory_groups_and_skips(self):
+        lf_file = StringIO(constant_values.TEST_PP_ATTACHMENT_LF)
+        groups = list(Parse.sentence_parse_factory('test', lf_file))
+        # Neither the unparsed sentence nor the rewrite should show up
+        self.assertEqual(len(groups), 1)
+        self.assertEqual([p.full_id for p in groups[0]],
+                         ['s1-1', 's1-2', 's1-3'])
+        self.assertEqual(
+            constant_values.TEST_PP_ATTACHMENT_NEXT_DEPENDENCIES,
+            groups[0][1].unlabeled_dependency_set())
+
+    def test_parse_factory(self):
+        lf_file = StringIO(constant_values.TEST_PP_ATTACHMENT_LF)
+        parses = Parse.parse_factory('test', lf_file)
+        self.assertEqual(len(parses), 3)
+
+    def test_lazy_parses_compile_on_demand(self):
+        parses = [Parse('test', item, lazy=True) for item in self.items[:3]]
+        self.assertFalse(any(parse.is_compiled() for parse in parses))
+        top, next_best = sentence_utilities.gather_both_top_parses(
+            reversed(parses), apply_filters=True)
+        self.assertEqual((top.full_id, next_best.full_id), ('s1-1', 's1-2'))
+        # Nothing past the first different enough parse should be compiled
+        self.assertFalse(parses[2].is_compiled())
+
+
+if __name__ == '__main__':
+    unittest.main()
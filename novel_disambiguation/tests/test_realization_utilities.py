@@ -0,0 +1,37 @@
+__author__ = 'Ethan A. Hill'
+
+import os
+import shutil
+import tempfile
+import unittest
+import constant_values
+from ..utilities import realization_utilities
+
+
+class TestRealizationIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        realization_path = os.path.join(self.directory, 'realize.nbest')
+        with open(realization_path, 'w') as realization_file:
+            realization_file.write(constant_values.TEST_REALIZE_NBEST)
+        self.index = realization_utilities.realization_index(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_scored_realizations_in_order(self):
+        realizations = self.index.realizations('s1-1#passive')
+        self.assertEqual([r.attrib['score'] for r in realizations],
+                         ['0.91', '0.42'])
+        self.assertEqual(realizations[0].find('str').text,
+                         'The man was seen by him with the telescope')
+        self.assertIsNotNone(realizations[1].find('lf/node'))
+
+    def test_incomplete_segments_are_dropped(self):
+        self.assertEqual(self.index.realizations('s1-1#cleft'), [])
+        self.assertEqual(self.index.realizations('s9-9'), [])
+        self.assertEqual(self.index.num_realizations, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
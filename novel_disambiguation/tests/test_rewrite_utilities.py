@@ -1,12 +1,150 @@
 __author__ = 'hill1303'
 
+import os
+import shutil
+import tempfile
 import unittest
+from collections import OrderedDict
+from StringIO import StringIO
+import constant_values
+from xml.etree import cElementTree as ElementTree
+from ..models.parse import Parse
 from ..utilities import rewrite_utilities
+from ..utilities import reversal_utilities
 
 class TestRewriteUtilities(unittest.TestCase):
     def test_apply_rewrites(self):
         self.assertEqual(True, False)
 
 
+class TestRewritePersistence(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xml_path = os.path.join(self.directory, 'tb.xml')
+        with open(self.xml_path, 'w') as xml_file:
+            xml_file.write(constant_values.TEST_PP_ATTACHMENT_LF)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_rewrites_keeps_existing_items(self):
+        rewrites = [ElementTree.Element('item', {'info': 's1-1#cleft'}),
+                    ElementTree.Element('item', {'info': 's1-2#cleft'})]
+        rewrite_utilities.append_rewrites_to_xml_file(rewrites, self.xml_path)
+        items = ElementTree.parse(self.xml_path).findall('item')
+        self.assertEqual([item.attrib['info'] for item in items],
+                         ['s1-1', 's1-2', 's1-3', 's2-1', 's1-1#passive',
+                          's1-1#cleft', 's1-2#cleft'])
+        with open(self.xml_path) as xml_file:
+            # The original declaration survives since nothing was re-parsed
+            self.assertTrue(xml_file.readline().startswith('<?xml'))
+
+    def test_append_rewrites_to_empty_root(self):
+        with open(self.xml_path, 'w') as xml_file:
+            xml_file.write('<regression/>')
+        rewrites = [ElementTree.Element('item', {'info': 's1-1#cleft'})]
+        rewrite_utilities.append_rewrites_to_xml_file(rewrites, self.xml_path)
+        items = ElementTree.parse(self.xml_path).findall('item')
+        self.assertEqual(len(items), 1)
+
+
+class TestCopyOnWriteRewrites(unittest.TestCase):
+    def setUp(self):
+        root = ElementTree.fromstring(constant_values.TEST_PP_ATTACHMENT_LF)
+        self.xml_lf = root.find('item')
+        self.original = ElementTree.tostring(self.xml_lf)
+        self.parse = Parse('tb.xml', self.xml_lf)
+
+    def test_passive_rewrite_leaves_original_untouched(self):
+        rewrite_lfs = []
+        rewrite_utilities.attempt_passive_rewrite('w1', self.parse,
+                                                  rewrite_lfs)
+        self.assertEqual(len(rewrite_lfs), 1)
+        self.assertEqual(rewrite_lfs[0].attrib['info'], 's1-1#passive')
+        self.assertEqual(ElementTree.tostring(self.xml_lf), self.original)
+        # Subtrees the rewrite never changes are shared, not copied
+        self.assertIs(rewrite_lfs[0].find('full-words'),
+                      self.xml_lf.find('full-words'))
+        self.assertIs(rewrite_lfs[0].find('.//node[@id="w4"]'),
+                      self.xml_lf.find('.//node[@id="w4"]'))
+
+    def test_cleft_rewrite_leaves_original_untouched(self):
+        rewrite_lfs = []
+        rewrite_utilities.attempt_cleft_rewrite('w1', self.parse, rewrite_lfs)
+        self.assertEqual(len(rewrite_lfs), 1)
+        self.assertEqual(ElementTree.tostring(self.xml_lf), self.original)
+        self.assertIsNotNone(rewrite_lfs[0].find('.//node[@pred="be"]'))
+        self.assertIsNone(self.xml_lf.find('.//node[@pred="be"]'))
+
+
+class TestRemoveRewrites(unittest.TestCase):
+    def test_first_rewrite_offset_across_chunks(self):
+        contents = constant_values.TEST_PP_ATTACHMENT_LF
+        expected = contents.index('<item numOfParses="1" info="s1-1#')
+        for chunk_size in [1, 7, 64, len(contents)]:
+            offset = rewrite_utilities.first_rewrite_offset(
+                StringIO(contents), chunk_size)
+            self.assertEqual(offset, expected)
+        without_rewrites = contents[:expected] + '</regression>'
+        self.assertIsNone(rewrite_utilities.first_rewrite_offset(
+            StringIO(without_rewrites), 7))
+
+
+class TestRewriteRouting(unittest.TestCase):
+    def setUp(self):
+        root = ElementTree.fromstring(constant_values.TEST_PP_ATTACHMENT_LF)
+        items = root.findall('item')
+        self.parse_pair = (Parse('tb.xml', items[0]),
+                           Parse('tb.xml', items[1]))
+        # 'with' attaches to the verb in one parse and the noun in the other
+        self.details = {4: ('IN', 'with'), 5: ('DT', 'the')}
+
+    def test_route_rewrites(self):
+        routes = rewrite_utilities.route_rewrites(self.parse_pair,
+                                                  self.details)
+        self.assertEqual([(rule.name, target) for rule, target in routes],
+                         [('passive', 'w1'), ('cleft', 'w1')])
+
+    def test_only_the_first_ambiguity_is_routed(self):
+        # A parse is rewritten at its first ambiguous word any rule applies
+        # to, later ones are left be
+        details = [(4, ('IN', 'with')), (1, ('CC', 'and'))]
+        routes = rewrite_utilities.route_rewrites(self.parse_pair,
+                                                  OrderedDict(details))
+        self.assertEqual([rule.name for rule, _ in routes],
+                         ['passive', 'cleft'])
+        routes = rewrite_utilities.route_rewrites(
+            self.parse_pair, OrderedDict(reversed(details)))
+        self.assertEqual([rule.name for rule, _ in routes],
+                         ['coordination'])
+
+    def test_attempt_rewrites_counts_hits(self):
+        rules = dict((rule.name, rule)
+                     for rule in rewrite_utilities.REWRITE_RULES)
+        hits = rules['passive'].hits
+        rewrite_lfs = []
+        rewrite_utilities.attempt_rewrites(self.parse_pair, self.details,
+                                           rewrite_lfs)
+        self.assertEqual([lf.attrib['info'] for lf in rewrite_lfs],
+                         ['s1-1#passive', 's1-1#cleft'])
+        self.assertEqual(rules['passive'].hits, hits + 1)
+
+
+class TestSpanBreaks(unittest.TestCase):
+    def test_shifted_span_is_not_broken(self):
+        correspondence = {(3, 'man'): (1, 'man'), (4, 'with'): (2, 'with')}
+        self.assertFalse(reversal_utilities.span_is_broken(correspondence))
+
+    def test_reordered_span_is_broken(self):
+        correspondence = {(3, 'man'): (6, 'man'), (4, 'with'): (0, 'with')}
+        self.assertTrue(reversal_utilities.span_is_broken(correspondence))
+
+    def test_repeated_words_use_pairwise_distances(self):
+        # Both 'the' words land on the same realization index
+        correspondence = {(2, 'the'): (5, 'the'), (5, 'the'): (5, 'the'),
+                          (3, 'man'): (6, 'man')}
+        self.assertTrue(reversal_utilities.span_is_broken(correspondence))
+
+
 if __name__ == '__main__':
     unittest.main()
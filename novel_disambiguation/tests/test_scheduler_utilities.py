@@ -0,0 +1,144 @@
+__author__ = 'Ethan A. Hill'
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import constant_values
+from ..utilities import disambig_utilities
+from ..utilities import scheduler_utilities
+from ..utilities import worker_utilities
+
+
+class RecordingJob(object):
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+
+
+class TestStageScheduler(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.active = {'ccg': 0, 'cpu': 0}
+        self.most_active = {'ccg': 0, 'cpu': 0}
+
+    def stage(self, name, resource, dependencies=(), fail_on=None):
+        def run(job):
+            if job.name == fail_on:
+                raise ValueError(job.name)
+            with self.lock:
+                self.active[resource] += 1
+                self.most_active[resource] = max(
+                    self.most_active[resource], self.active[resource])
+                self.events.append(('start', name, job.name))
+            time.sleep(0.01)
+            with self.lock:
+                self.active[resource] -= 1
+                self.events.append(('end', name, job.name))
+            job.stages.append(name)
+        return scheduler_utilities.Stage(name, run, resource, dependencies)
+
+    def test_stages_run_in_dependency_order(self):
+        stages = [self.stage('parse', 'ccg'),
+                  self.stage('analyse', 'cpu', ['parse']),
+                  self.stage('realize', 'ccg', ['analyse'])]
+        scheduler = scheduler_utilities.StageScheduler(
+            stages, {'ccg': 2, 'cpu': 2})
+        jobs = [RecordingJob('f%d' % i) for i in xrange(5)]
+        finished = scheduler.run(jobs)
+        self.assertEqual(finished, jobs)
+        for job in jobs:
+            self.assertEqual(job.stages, ['parse', 'analyse', 'realize'])
+        self.assertLessEqual(self.most_active['ccg'], 2)
+        self.assertLessEqual(self.most_active['cpu'], 2)
+
+    def test_files_overlap_across_stages(self):
+        stages = [self.stage('parse', 'ccg'),
+                  self.stage('analyse', 'cpu', ['parse'])]
+        scheduler = scheduler_utilities.StageScheduler(
+            stages, {'ccg': 1, 'cpu': 1})
+        scheduler.run([RecordingJob('a'), RecordingJob('b')])
+        # b is parsed while a is analysed
+        b_parse = self.events.index(('start', 'parse', 'b'))
+        a_analysed = self.events.index(('end', 'analyse', 'a'))
+        self.assertLess(b_parse, a_analysed)
+
+    def test_failed_job_is_skipped(self):
+        stages = [self.stage('parse', 'ccg'),
+                  self.stage('analyse', 'cpu', ['parse'], fail_on='b'),
+                  self.stage('realize', 'ccg', ['analyse'])]
+        scheduler = scheduler_utilities.StageScheduler(
+            stages, {'ccg': 1, 'cpu': 1})
+        jobs = [RecordingJob('a'), RecordingJob('b'), RecordingJob('c')]
+        finished = scheduler.run(jobs)
+        self.assertEqual([job.name for job in finished], ['a', 'c'])
+        self.assertEqual(jobs[1].stages, ['parse'])
+        self.assertNotIn(('start', 'realize', 'b'), self.events)
+
+    def test_finished_jobs_are_handed_on(self):
+        stages = [self.stage('parse', 'ccg'),
+                  self.stage('analyse', 'cpu', ['parse'], fail_on='b')]
+        scheduler = scheduler_utilities.StageScheduler(
+            stages, {'ccg': 1, 'cpu': 1})
+        handed_on = []
+
+        def on_finished(job):
+            # Every stage of the job is done by the time it is handed on
+            handed_on.append((job.name, list(job.stages)))
+        scheduler.run([RecordingJob('a'), RecordingJob('b')], on_finished)
+        self.assertEqual(handed_on, [('a', ['parse', 'analyse'])])
+
+    def test_utilization_report(self):
+        stages = [self.stage('parse', 'ccg'),
+                  self.stage('analyse', 'cpu', ['parse'])]
+        scheduler = scheduler_utilities.StageScheduler(
+            stages, {'ccg': 1, 'cpu': 1})
+        scheduler.run([RecordingJob('a')])
+        report = scheduler.utilization_report()
+        self.assertEqual(len(report), 4)
+        self.assertTrue(report[0].startswith('ccg: 1 slots'))
+        self.assertIn('parse (ccg): 1 runs', report[2])
+        self.assertEqual(stages[0].runs, 1)
+        self.assertGreater(stages[0].busy_seconds, 0)
+
+
+class TestPipelinedDisambiguation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.text_files = []
+        for name in ['first', 'second']:
+            path_to_text = os.path.join(self.directory, name)
+            with open(path_to_text, 'w') as text_file:
+                text_file.write('He saw the man with the telescope\n')
+            self.text_files.append(path_to_text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pipelined_matches_disambiguate(self):
+        pool = worker_utilities.worker_pool_factory(
+            'stub', 2, task_files={
+                worker_utilities.PARSE_TASK: {
+                    'tb.xml': constant_values.TEST_PP_ATTACHMENT_LF},
+                worker_utilities.REALIZE_TASK: {
+                    'realize.nbest': constant_values.TEST_REALIZE_NBEST}})
+        scheduler = disambig_utilities.disambiguation_scheduler(pool, 2)
+        sentence_sets = disambig_utilities.disambiguate_pipelined(
+            self.text_files, worker_pool=pool, scheduler=scheduler)
+        self.assertEqual(len(sentence_sets), 2)
+        self.assertEqual(pool.jobs_run, 6)
+        expected = disambig_utilities.disambiguate(
+            self.text_files[0], post_process=True)
+        for sentences in sentence_sets:
+            top_parse = sentences[0].top_parse
+            self.assertTrue(top_parse.rewrites[0].is_valid)
+            self.assertEqual(top_parse.reversal.realization,
+                             expected[0].top_parse.reversal.realization)
+        self.assertTrue(all(stage.runs == 2 for stage in scheduler.stages))
+
+
+if __name__ == '__main__':
+    unittest.main()
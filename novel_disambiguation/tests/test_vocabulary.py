@@ -0,0 +1,34 @@
+import unittest
+from ..models.vocabulary import Vocabulary
+
+__author__ = 'Ethan A. Hill'
+
+
+class TestVocabulary(unittest.TestCase):
+    def setUp(self):
+        self.vocabulary = Vocabulary()
+
+    def test_intern_is_stable(self):
+        word_id = self.vocabulary.intern('telescope')
+        self.assertEqual(word_id, self.vocabulary.intern('telescope'))
+        self.assertNotEqual(word_id, self.vocabulary.intern('man'))
+        self.assertEqual(self.vocabulary.string(word_id), 'telescope')
+        self.assertEqual(len(self.vocabulary), 2)
+
+    def test_dependency_round_trip(self):
+        code = self.vocabulary.encode_dependency('saw', 'with')
+        self.assertEqual(self.vocabulary.decode_dependency(code),
+                         ('saw', 'with'))
+        reverse = Vocabulary.reverse_dependency(code)
+        self.assertEqual(self.vocabulary.decode_dependency(reverse),
+                         ('with', 'saw'))
+
+    def test_self_reference(self):
+        self.assertTrue(Vocabulary.is_self_reference(
+            self.vocabulary.encode_dependency('it', 'it')))
+        self.assertFalse(Vocabulary.is_self_reference(
+            self.vocabulary.encode_dependency('it', 'would')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,313 @@
+__author__ = 'Ethan A. Hill'
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import constant_values
+from xml.etree import cElementTree as ElementTree
+from ..utilities import batch_utilities
+from ..utilities import build_utilities
+from ..utilities import disambig_utilities
+from ..utilities import system_utilities
+from ..utilities import worker_utilities
+
+# Answers each job line with some output, failing jobs for missing files
+FAKE_WORKER_SCRIPT = '''
+import os, sys
+for line in iter(sys.stdin.readline, ''):
+    task, path, berkeley = line.rstrip('\\n').split('\\t')
+    sys.stdout.write('%s %s\\n' % (task, path))
+    sys.stdout.write('DONE\\n' if os.path.exists(path) else 'FAILED\\n')
+    sys.stdout.flush()
+'''
+
+
+class TestStubWorker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path_to_text = os.path.join(self.directory, 'novel')
+        with open(self.path_to_text, 'w') as text_file:
+            text_file.write('He saw the man with the telescope\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disambiguate_with_stub_worker(self):
+        stub = worker_utilities.StubCcgWorker({
+            worker_utilities.PARSE_TASK: {
+                'tb.xml': constant_values.TEST_PP_ATTACHMENT_LF},
+            worker_utilities.REALIZE_TASK: {
+                'realize.nbest': constant_values.TEST_REALIZE_NBEST}})
+        sentences = disambig_utilities.disambiguate(
+            self.path_to_text, worker_pool=stub)
+        reversals_path = '%s.dir/reversals' % self.path_to_text
+        self.assertEqual(stub.jobs, [
+            (worker_utilities.PARSE_TASK, self.path_to_text),
+            (worker_utilities.REALIZE_TASK, self.path_to_text),
+            (worker_utilities.PARSE_TASK, reversals_path)])
+        top_parse = sentences[0].top_parse
+        self.assertTrue(top_parse.rewrites[0].is_valid)
+        self.assertEqual(top_parse.reversal.realization,
+                         'With the telescope he saw the man')
+
+    def test_pool_caps_concurrent_jobs(self):
+        active = []
+        most_active = []
+        lock = threading.Lock()
+
+        class SlowWorker(worker_utilities.CcgWorker):
+            def run(self, task, path_to_text, use_berkeley_target=False,
+                    deadline=None):
+                with lock:
+                    active.append(path_to_text)
+                    most_active.append(len(active))
+                time.sleep(0.01)
+                with lock:
+                    active.remove(path_to_text)
+                return task
+
+        pool = worker_utilities.CcgWorkerPool(SlowWorker, 2)
+        threads = [threading.Thread(target=pool.parse, args=('f%d' % i,))
+                   for i in xrange(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(pool.jobs_run, 6)
+        self.assertLessEqual(max(most_active), 2)
+
+    def test_persistent_worker_protocol(self):
+        worker = worker_utilities.PersistentCcgWorker(
+            [sys.executable, '-c', FAKE_WORKER_SCRIPT], self.directory)
+        try:
+            output = worker.run(worker_utilities.PARSE_TASK, 'novel')
+            self.assertEqual(output, 'parse novel\n')
+            self.assertRaises(subprocess.CalledProcessError, worker.run,
+                              worker_utilities.REALIZE_TASK, 'missing')
+            # The same process keeps answering after a failed job
+            output = worker.run(worker_utilities.REALIZE_TASK, 'novel')
+            self.assertEqual(output, 'realize novel\n')
+        finally:
+            worker.close()
+        # Each job's output is in the text's build log for its task
+        for task in [worker_utilities.PARSE_TASK,
+                     worker_utilities.REALIZE_TASK]:
+            log_path = os.path.join(self.directory, 'novel.dir',
+                                    worker_utilities.TASK_LOGS[task])
+            with open(log_path) as log_file:
+                self.assertEqual(log_file.read(), '%s novel\n' % task)
+
+
+class TestMemoryAdmission(unittest.TestCase):
+    def admit_in_thread(self, admission, description):
+        thread = threading.Thread(target=admission.admit, args=(description,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_static_jobs_cap_running_jobs(self):
+        admission = worker_utilities.MemoryAdmissionController(
+            static_jobs=2, poll_seconds=0.01)
+        admission.admit('first')
+        admission.admit('second')
+        waiting = self.admit_in_thread(admission, 'third')
+        waiting.join(0.05)
+        self.assertTrue(waiting.is_alive())
+        admission.release()
+        waiting.join(1)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual((admission.admitted, admission.waits), (3, 1))
+
+    def test_jobs_wait_for_headroom(self):
+        memory = {'available': 3000, 'rss': 0}
+        admission = worker_utilities.MemoryAdmissionController(
+            job_memory_kb=1000, reserve_kb=500, poll_seconds=0.01,
+            available_kb=lambda: memory['available'],
+            running_rss_kb=lambda: memory['rss'])
+        admission.admit('first')
+        # The first job may still grow by its whole heap
+        self.assertEqual(admission.headroom_kb(), 1500)
+        admission.admit('second')
+        waiting = self.admit_in_thread(admission, 'third')
+        waiting.join(0.05)
+        self.assertTrue(waiting.is_alive())
+        # Memory freed elsewhere is noticed without a release
+        memory['available'] = 4000
+        waiting.join(1)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(admission.running, 3)
+
+    def test_one_job_always_runs(self):
+        admission = worker_utilities.MemoryAdmissionController(
+            job_memory_kb=1000, available_kb=lambda: 0,
+            running_rss_kb=lambda: 0)
+        admission.admit('only')
+        self.assertEqual(admission.running, 1)
+
+    def test_pool_admits_jobs(self):
+        admission = worker_utilities.MemoryAdmissionController(static_jobs=1)
+        pool = worker_utilities.CcgWorkerPool(
+            worker_utilities.StubCcgWorker, 2, admission)
+        directory = tempfile.mkdtemp()
+        try:
+            pool.parse(os.path.join(directory, 'novel'))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual((admission.admitted, admission.running), (1, 0))
+
+    def test_persistent_pool_is_capped(self):
+        # Idle persistent workers hold their JVMs, subprocess ones don't
+        admission = worker_utilities.MemoryAdmissionController(static_jobs=2)
+        pool = worker_utilities.worker_pool_factory(
+            'persistent', 64, [sys.executable], admission=admission)
+        self.assertEqual(pool.num_workers, 2)
+        pool = worker_utilities.worker_pool_factory(
+            'subprocess', 64, admission=admission)
+        self.assertEqual(pool.num_workers, 64)
+
+
+class TestMemoryReadings(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.meminfo_path = os.path.join(self.directory, 'meminfo')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_meminfo(self, lines):
+        with open(self.meminfo_path, 'w') as meminfo_file:
+            meminfo_file.write('\n'.join(lines) + '\n')
+
+    def test_meminfo(self):
+        self.write_meminfo(['MemTotal:       16777216 kB',
+                            'MemFree:         1000000 kB',
+                            'MemAvailable:    8000000 kB',
+                            'HugePages_Total:       0'])
+        self.assertEqual(system_utilities.read_meminfo(self.meminfo_path),
+                         {'MemTotal': 16777216, 'MemFree': 1000000,
+                          'MemAvailable': 8000000, 'HugePages_Total': 0})
+        self.assertEqual(
+            system_utilities.total_available_ram(self.meminfo_path), 16)
+        self.assertEqual(
+            system_utilities.available_ram_kb(self.meminfo_path), 8000000)
+
+    def test_available_without_memavailable(self):
+        self.write_meminfo(['MemTotal:       16777216 kB',
+                            'MemFree:         1000000 kB',
+                            'Buffers:           20000 kB',
+                            'Cached:           300000 kB'])
+        self.assertEqual(
+            system_utilities.available_ram_kb(self.meminfo_path), 1320000)
+
+    def test_descendant_rss(self):
+        child = subprocess.Popen(
+            [sys.executable, '-c', 'import sys; sys.stdin.read()'],
+            stdin=subprocess.PIPE)
+        try:
+            self.assertGreater(system_utilities.descendant_rss_kb(), 0)
+        finally:
+            child.communicate('')
+
+
+class SlowSentenceWorker(worker_utilities.CcgWorker):
+    # Parses each line into an item, or realizes each item into a seg, but
+    # runs past any deadline when given a sentence of 'slow'
+
+    def __init__(self):
+        self.jobs = []
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        lines = batch_utilities.sentence_lines(path_to_text)
+        self.jobs.append((task, len(lines)))
+        if deadline is not None and 'slow' in lines:
+            raise build_utilities.DeadlineExceeded(task, deadline)
+        output_directory = '%s.dir' % path_to_text
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        if task == worker_utilities.PARSE_TASK:
+            root = ElementTree.Element('regression')
+            for number, line in enumerate(lines, 1):
+                ElementTree.SubElement(root, 'item', {
+                    'info': 's%d-1' % number, 'string': line})
+            output_path = os.path.join(output_directory, 'tb.xml')
+        else:
+            root = ElementTree.Element('nbest')
+            items = ElementTree.parse(
+                os.path.join(output_directory, 'tb.xml')).getroot()
+            for item in items:
+                ElementTree.SubElement(root, 'seg', {
+                    'id': item.attrib['info'],
+                    'string': item.attrib['string']})
+            output_path = os.path.join(output_directory, 'realize.nbest')
+        ElementTree.ElementTree(root).write(output_path)
+        return 'BUILD SUCCESSFUL'
+
+
+class TestDeadlineWorker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path_to_text = os.path.join(self.directory, 'novel')
+        self.lines = ['one', 'two', 'three', 'slow', 'five']
+        with open(self.path_to_text, 'w') as text_file:
+            text_file.write('\n'.join(self.lines))
+        self.skip_path = os.path.join(self.directory, 'skip_list')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def output_ids(self, file_name, tag, id_attribute):
+        root = ElementTree.parse(os.path.join(
+            '%s.dir' % self.path_to_text, file_name)).getroot()
+        return [(element.attrib[id_attribute], element.attrib['string'])
+                for element in root.iter(tag)]
+
+    def test_slow_sentence_is_bisected_out(self):
+        slow_worker = SlowSentenceWorker()
+        worker = worker_utilities.DeadlineCcgWorker(
+            slow_worker, {worker_utilities.PARSE_TASK: 1.0},
+            worker_utilities.SkipList(self.skip_path))
+        self.assertEqual(worker.deadline(worker_utilities.PARSE_TASK, 5),
+                         worker_utilities.DEADLINE_STARTUP_SECONDS + 5)
+        worker.run(worker_utilities.PARSE_TASK, self.path_to_text)
+        expected = [('s1-1', 'one'), ('s2-1', 'two'), ('s3-1', 'three'),
+                    ('s5-1', 'five')]
+        self.assertEqual(self.output_ids('tb.xml', 'item', 'info'), expected)
+        # The whole text, then straight to its halves until the slow
+        # sentence is on its own
+        self.assertEqual([count for _, count in slow_worker.jobs],
+                         [5, 2, 3, 1, 2, 1, 1])
+        self.assertTrue(all(task == worker_utilities.PARSE_TASK
+                            for task, _ in slow_worker.jobs))
+        # A later run leaves the slow sentence out from the start
+        skip_list = worker_utilities.SkipList(self.skip_path)
+        self.assertTrue(
+            skip_list.contains(worker_utilities.PARSE_TASK, 'slow'))
+        slow_worker = SlowSentenceWorker()
+        worker = worker_utilities.DeadlineCcgWorker(
+            slow_worker, {worker_utilities.PARSE_TASK: 1.0}, skip_list)
+        worker.run(worker_utilities.PARSE_TASK, self.path_to_text)
+        self.assertEqual([count for _, count in slow_worker.jobs], [3, 1])
+        self.assertEqual(self.output_ids('tb.xml', 'item', 'info'), expected)
+
+    def test_realization_pieces_keep_sentence_ids(self):
+        slow_worker = SlowSentenceWorker()
+        slow_worker.run(worker_utilities.PARSE_TASK, self.path_to_text)
+        worker = worker_utilities.DeadlineCcgWorker(
+            slow_worker, {worker_utilities.REALIZE_TASK: 1.0},
+            worker_utilities.SkipList())
+        worker.run(worker_utilities.REALIZE_TASK, self.path_to_text)
+        self.assertEqual(self.output_ids('realize.nbest', 'seg', 'id'),
+                         [('s1-1', 'one'), ('s2-1', 'two'),
+                          ('s3-1', 'three'), ('s5-1', 'five')])
+        self.assertTrue(worker.skip_list.contains(
+            worker_utilities.REALIZE_TASK, 'slow'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+__author__ = 'Ethan A. Hill'
+import bisect
+import logging
+import os
+import re
+from xml.etree import cElementTree as ElementTree
+
+
+__logger = logging.getLogger(__name__)
+__SENTENCE_ID_REGEX = re.compile('^s([0-9]+)(.*)$', re.DOTALL)
+# Hidden, so that listing the working directory never picks up a batch
+BATCH_DIRECTORY = '.batches'
+CHUNK_DIRECTORY = '.chunks'
+PIECE_DIRECTORY = '.pieces'
+# Each sentence is a round of OpenCCG work whatever its length
+__SENTENCE_COST_TOKENS = 10
+
+
+def sentence_lines(path_to_text):
+    # OpenCCG numbers the lines of a text file as sentences s1, s2, ...
+    with open(path_to_text) as text_file:
+        return text_file.read().splitlines()
+
+
+def split_sentence_id(sentence_id):
+    # 's12-3#passive' -> (12, '-3#passive')
+    match = __SENTENCE_ID_REGEX.match(sentence_id)
+    return int(match.group(1)), match.group(2)
+
+
+class Batch(object):
+    # Many small text files packed into one, along with the table that maps
+    # the batch's sentence ids back to the sentence ids of each member file
+
+    def __init__(self, path_to_text, member_paths, sentence_counts):
+        self.path_to_text = path_to_text
+        self.member_paths = member_paths
+        self.sentence_counts = sentence_counts
+        # Batch sentence numbers before the first sentence of each member
+        self.offsets = []
+        total = 0
+        for count in sentence_counts:
+            self.offsets.append(total)
+            total += count
+        self.num_sentences = total
+        self.__member_offsets = dict(zip(member_paths, self.offsets))
+
+    def output_directory(self):
+        return '%s.dir' % self.path_to_text
+
+    def member_output_directory(self, member_path):
+        return '%s.dir' % member_path
+
+    def member_sentence_id(self, batch_sentence_id):
+        number, suffix = split_sentence_id(batch_sentence_id)
+        if not 0 < number <= self.num_sentences:
+            return None, None
+        member = bisect.bisect_left(self.offsets, number) - 1
+        return (self.member_paths[member],
+                's%d%s' % (number - self.offsets[member], suffix))
+
+    def batch_sentence_id(self, member_path, member_sentence_id):
+        number, suffix = split_sentence_id(member_sentence_id)
+        offset = self.__member_offsets[member_path]
+        return 's%d%s' % (number + offset, suffix)
+
+
+def pack_batches(text_files, max_sentences=None, max_bytes=None):
+    # Greedily fill each batch in order until a limit would be passed, a file
+    # over the limits on its own becomes a batch of one
+    batches, batch = [], []
+    num_sentences, num_bytes = 0, 0
+    for text_file in text_files:
+        file_sentences = len(sentence_lines(text_file))
+        file_bytes = os.path.getsize(text_file)
+        too_many_sentences = (max_sentences is not None and
+                              num_sentences + file_sentences > max_sentences)
+        too_many_bytes = (max_bytes is not None and
+                          num_bytes + file_bytes > max_bytes)
+        if batch and (too_many_sentences or too_many_bytes):
+            batches.append(batch)
+            batch, num_sentences, num_bytes = [], 0, 0
+        batch.append(text_file)
+        num_sentences += file_sentences
+        num_bytes += file_bytes
+    if batch:
+        batches.append(batch)
+    __logger.debug('Packed %d files into %d batches',
+                   len(text_files), len(batches))
+    return batches
+
+
+def text_cost(lines):
+    return sum(__SENTENCE_COST_TOKENS + len(line.split()) for line in lines)
+
+
+def job_cost(job):
+    # A job is a text file or a batch of them
+    text_files = job if isinstance(job, list) else [job]
+    return sum(text_cost(sentence_lines(text_file))
+               for text_file in text_files)
+
+
+def longest_first(jobs):
+    # The costliest jobs start first, so none is left running alone at the end
+    return sorted(jobs, key=job_cost, reverse=True)
+
+
+def split_into_chunks(path_to_text, max_sentences):
+    # A file is the batch of its chunks, so the batch's mapping gives each
+    # chunk sentence its id in the file
+    lines = sentence_lines(path_to_text)
+    directory = os.path.join(os.path.dirname(path_to_text), CHUNK_DIRECTORY)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    chunk_paths, sentence_counts = [], []
+    for start in xrange(0, len(lines), max_sentences):
+        chunk_path = os.path.join(directory, '%s.part%d' % (
+            os.path.basename(path_to_text), len(chunk_paths) + 1))
+        chunk_lines = lines[start:start + max_sentences]
+        with open(chunk_path, 'w') as chunk_file:
+            chunk_file.write('\n'.join(chunk_lines))
+        chunk_paths.append(chunk_path)
+        sentence_counts.append(len(chunk_lines))
+    __logger.debug('Split %s into %d chunks', path_to_text, len(chunk_paths))
+    return Batch(path_to_text, chunk_paths, sentence_counts)
+
+
+def split_large_files(text_files, max_sentences):
+    # Files over max_sentences become chunks that are processed as files of
+    # their own, returns the files to process and the chunked files
+    files, chunked_files = [], []
+    for text_file in text_files:
+        if max_sentences and len(sentence_lines(text_file)) > max_sentences:
+            chunks = split_into_chunks(text_file, max_sentences)
+            chunked_files.append(chunks)
+            files.extend(chunks.member_paths)
+        else:
+            files.append(text_file)
+    return files, chunked_files
+
+
+def relabel_sentence(sentence, chunks, chunk_path):
+    path_to_text = chunks.path_to_text
+    sentence.parent_file_name = path_to_text
+    sentence.full_id = chunks.batch_sentence_id(chunk_path, sentence.full_id)
+    for parse in [p for p in [sentence.top_parse, sentence.next_best_parse]
+                  if p]:
+        parse.relabel(path_to_text,
+                      chunks.batch_sentence_id(chunk_path, parse.full_id))
+        for rewrite in parse.rewrites:
+            rewrite.full_id = chunks.batch_sentence_id(
+                chunk_path, rewrite.full_id)
+        if parse.reversal:
+            parse.reversal.parent_file_name = path_to_text
+
+
+def reassemble_chunks(sentences, chunked_files):
+    # Gives the sentences of every chunk their file's name and sentence ids
+    chunk_map = {}
+    for chunks in chunked_files:
+        for chunk_path in chunks.member_paths:
+            chunk_map[chunk_path] = chunks
+    for sentence in sentences:
+        chunks = chunk_map.get(sentence.parent_file_name)
+        if chunks is not None:
+            relabel_sentence(sentence, chunks, sentence.parent_file_name)
+    return sentences
+
+
+def batch_path_for(text_files):
+    first_file = text_files[0]
+    return os.path.join(os.path.dirname(first_file), BATCH_DIRECTORY,
+                        'batch-%s' % os.path.basename(first_file))
+
+
+def write_batch(path_to_text, member_paths):
+    __logger.debug('Writing batch %s of %s', path_to_text, member_paths)
+    directory = os.path.dirname(path_to_text)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    sentence_counts, lines = [], []
+    for member_path in member_paths:
+        member_lines = sentence_lines(member_path)
+        sentence_counts.append(len(member_lines))
+        lines.extend(member_lines)
+    with open(path_to_text, 'w') as batch_file:
+        batch_file.write('\n'.join(lines))
+    return Batch(path_to_text, member_paths, sentence_counts)
+
+
+def __xml_root(xml_path):
+    # The root tag and attributes, without reading the rest of the file
+    for event, element in ElementTree.iterparse(xml_path, events=('start',)):
+        return element.tag, dict(element.attrib)
+
+
+def __open_root(xml_file, tag, attributes):
+    xml_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    start_tag = ElementTree.tostring(ElementTree.Element(tag, attributes))
+    # An empty element serializes as '<tag ... />', reopen it
+    xml_file.write('%s>\n' % start_tag[:-3])
+
+
+def split_xml_file(batch, file_name, tag, id_attribute):
+    # Streams batch.dir/file_name into each member's .dir/file_name, giving
+    # every element its member's own sentence id
+    batch_xml_path = os.path.join(batch.output_directory(), file_name)
+    root_tag, root_attributes = __xml_root(batch_xml_path)
+    member_files = {}
+    for member_path in batch.member_paths:
+        directory = batch.member_output_directory(member_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        member_files[member_path] = open(
+            os.path.join(directory, file_name), 'w')
+        __open_root(member_files[member_path], root_tag, root_attributes)
+    try:
+        open_elements = []
+        events = ElementTree.iterparse(batch_xml_path, events=('start', 'end'))
+        for event, element in events:
+            if event == 'start':
+                open_elements.append(element)
+                continue
+            open_elements.pop()
+            if element.tag != tag or id_attribute not in element.attrib:
+                continue
+            member_path, member_id = batch.member_sentence_id(
+                element.attrib[id_attribute])
+            if member_path is None:
+                __logger.warning('Dropping %s %s of %s, it is not in the '
+                                 'batch', tag, element.attrib[id_attribute],
+                                 batch_xml_path)
+            else:
+                element.set(id_attribute, member_id)
+                element.tail = '\n'
+                member_files[member_path].write(ElementTree.tostring(element))
+            # Detach finished elements so the tree does not keep them alive
+            if open_elements:
+                open_elements[-1].remove(element)
+    finally:
+        for member_file in member_files.itervalues():
+            member_file.write('</%s>\n' % root_tag)
+            member_file.close()
+
+
+def copy_sentence_range(source_xml_path, target_xml_path, tag, id_attribute,
+                        start, count):
+    # Streams the elements of sentences start + 1 to start + count into
+    # their own file, numbered from s1
+    root_tag, root_attributes = __xml_root(source_xml_path)
+    with open(target_xml_path, 'w') as target_file:
+        __open_root(target_file, root_tag, root_attributes)
+        for event, element in ElementTree.iterparse(source_xml_path):
+            if element.tag != tag or id_attribute not in element.attrib:
+                continue
+            number, suffix = split_sentence_id(element.attrib[id_attribute])
+            if start < number <= start + count:
+                element.set(id_attribute, 's%d%s' % (number - start, suffix))
+                element.tail = '\n'
+                target_file.write(ElementTree.tostring(element))
+            element.clear()
+        target_file.write('</%s>\n' % root_tag)
+
+
+def merge_xml_files(batch, file_name, tag, id_attribute):
+    # The reverse of split_xml_file, ie. to realize the members' rewrites
+    batch_xml_path = os.path.join(batch.output_directory(), file_name)
+    root_tag, root_attributes = None, {}
+    with open(batch_xml_path + '.merging', 'w') as batch_file:
+        for member_path in batch.member_paths:
+            member_xml_path = os.path.join(
+                batch.member_output_directory(member_path), file_name)
+            if not os.path.exists(member_xml_path):
+                continue
+            if root_tag is None:
+                root_tag, root_attributes = __xml_root(member_xml_path)
+                __open_root(batch_file, root_tag, root_attributes)
+            for event, element in ElementTree.iterparse(member_xml_path):
+                if element.tag != tag or id_attribute not in element.attrib:
+                    continue
+                element.set(id_attribute, batch.batch_sentence_id(
+                    member_path, element.attrib[id_attribute]))
+                element.tail = '\n'
+                batch_file.write(ElementTree.tostring(element))
+                element.clear()
+        if root_tag is not None:
+            batch_file.write('</%s>\n' % root_tag)
+    os.rename(batch_xml_path + '.merging', batch_xml_path)
+
+
+def split_logical_forms(batch):
+    split_xml_file(batch, 'tb.xml', 'item', 'info')
+
+
+def merge_logical_forms(batch):
+    merge_xml_files(batch, 'tb.xml', 'item', 'info')
+
+
+def split_realizations(batch):
+    split_xml_file(batch, 'realize.nbest', 'seg', 'id')
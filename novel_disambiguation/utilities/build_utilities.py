@@ -1,25 +1,124 @@
 __author__ = 'Ethan A. Hill'
+import collections
 import logging
 import os
+import re
+import signal
 import subprocess
+import threading
+import time
 from ..constants import ccg_values
 
 
 __logger = logging.getLogger(__name__)
+# Only the end of a build's output is kept in memory, the rest is in its log
+BUILD_OUTPUT_TAIL_LINES = 200
+PROGRESS_LOG_INTERVAL = 100
 
 
-def ccg_build_parse(path_to_text, use_berkeley_target=False):
+class BuildProgress(object):
+    # A live count of the sentences a ccg-build has reached, read off the
+    # progress markers in its output
+    __PROGRESS_REGEX = re.compile(ccg_values.CCG_PROGRESS_REGEX_STRING)
+
+    def __init__(self, path_to_text):
+        self.path_to_text = path_to_text
+        self.sentence_ids = set()
+        self.num_lines = 0
+        self.start_time = time.time()
+
+    def update(self, line):
+        self.num_lines += 1
+        match = self.__PROGRESS_REGEX.search(line)
+        if match and match.group(1) not in self.sentence_ids:
+            self.sentence_ids.add(match.group(1))
+            return True
+        return False
+
+    def sentences_per_second(self):
+        return len(self.sentence_ids) / max(time.time() - self.start_time,
+                                            1e-9)
+
+    def report(self):
+        return '%s: %d sentences, %.2f sentences/s' % (
+            self.path_to_text, len(self.sentence_ids),
+            self.sentences_per_second())
+
+
+class DeadlineExceeded(Exception):
+    # A job ran past its deadline and was killed
+
+    def __init__(self, command, deadline, output=''):
+        Exception.__init__(self, '%s ran past its deadline of %.0fs' % (
+            command, deadline))
+        self.command = command
+        self.deadline = deadline
+        self.output = output
+
+
+def kill_process_group(process, killed):
+    killed.set()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # It finished just in time
+        pass
+
+
+def run_ccg_build(command, log_path, progress, cwd=None, deadline=None):
+    # Streams the build's output to log_path as it comes, keeping only the
+    # last lines around for the caller and for errors. Past the deadline, in
+    # seconds, the build and the JVM it started are killed.
+    tail = collections.deque(maxlen=BUILD_OUTPUT_TAIL_LINES)
+    log_directory = os.path.dirname(log_path)
+    if not os.path.exists(log_directory):
+        os.makedirs(log_directory)
+    with open(log_path, 'w') as log_file:
+        # A session of its own, so killing it takes the JVM along
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, cwd=cwd,
+                                   preexec_fn=os.setsid)
+        timer, killed = None, threading.Event()
+        if deadline is not None:
+            timer = threading.Timer(
+                deadline, kill_process_group, (process, killed))
+            timer.daemon = True
+            timer.start()
+        for line in iter(process.stdout.readline, ''):
+            log_file.write(line)
+            tail.append(line)
+            if not progress.update(line):
+                continue
+            # Keep the log current with the progress, for anyone tailing it
+            log_file.flush()
+            if len(progress.sentence_ids) % PROGRESS_LOG_INTERVAL == 0:
+                __logger.info('Progress %s', progress.report())
+        process.stdout.close()
+        return_code = process.wait()
+        if timer is not None:
+            timer.cancel()
+    timed_out = killed.is_set() and return_code
+    output_tail = ''.join(tail)
+    if timed_out:
+        __logger.warning('Killed %s past its deadline, %s', command,
+                         progress.report())
+        raise DeadlineExceeded(command, deadline, output_tail)
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, command, output_tail)
+    return output_tail
+
+
+def ccg_build_parse(path_to_text, use_berkeley_target=False,
+                    deadline=None):
     # We need to check a few things before running this process
     # TODO: Change these asserts to Exceptions...
-    #   1) Are we currently in the correct directory?
-    #   2) Does the file we passed in exist?
-    #       a) TODO: The file path must be relative to the ccgbank path for now
+    #   1) Does the file we passed in exist? Relative paths are relative to
+    #      the ccgbank directory, which ccg-build always runs in
     bank_path_expanded = os.path.expandvars(ccg_values.CCGBANK_PATH)
-    assert os.getcwd() == bank_path_expanded, (
-        'working directory %s is not %s' % (os.getcwd(), bank_path_expanded))
     full_path_to_text = os.path.join(bank_path_expanded, path_to_text)
     assert os.path.exists(full_path_to_text), (
         '%s does not exist' % full_path_to_text)
+    path_to_text = os.path.relpath(full_path_to_text, bank_path_expanded)
 
     if use_berkeley_target:
         target = 'test-bklParser-novel'
@@ -28,36 +127,38 @@ def ccg_build_parse(path_to_text, use_berkeley_target=False):
 
     __logger.debug('Attempting to parse %s using target %s.',
                    full_path_to_text, target)
-    process_output = subprocess.check_output(
+    progress = BuildProgress(full_path_to_text)
+    process_output = run_ccg_build(
         ['ccg-build', '-Dnovel.file=%s' % path_to_text, '-f', 'build-ps.xml',
-         target], stderr=subprocess.STDOUT, shell=False)
+         target], '%s.dir/parse.log' % full_path_to_text, progress,
+        cwd=bank_path_expanded, deadline=deadline)
 
-    __logger.debug('Finished parsing %s with captured output %s',
-                   path_to_text, process_output)
+    __logger.debug('Finished parsing %s, %s', path_to_text, progress.report())
 
     return process_output
 
 
-def ccg_build_realize(path_to_text, use_berkeley_target=False):
+def ccg_build_realize(path_to_text, use_berkeley_target=False,
+                      deadline=None):
 
     # We need to check a few things before running this process
     # TODO: Change these asserts to Exceptions...
-    #   1) Are we currently in the correct directory?
-    #   2) Does the file we passed in exist?
-    #       a) TODO: The file path must be relative to the ccgbank path for now
+    #   1) Does the file we passed in exist? Relative paths are relative to
+    #      the ccgbank directory, which ccg-build always runs in
     bank_path_expanded = os.path.expandvars(ccg_values.CCGBANK_PATH)
-    assert os.getcwd() == bank_path_expanded, (
-        'working directory %s is not %s' % (os.getcwd(), bank_path_expanded))
     full_path_to_text = os.path.join(bank_path_expanded, path_to_text)
     assert os.path.exists(full_path_to_text), (
         '%s does not exist' % full_path_to_text)
+    path_to_text = os.path.relpath(full_path_to_text, bank_path_expanded)
 
     target = 'test-bklParser-novel' if use_berkeley_target else 'test-novel'
     __logger.debug('Attempting to realize %s using target %s.',
                    full_path_to_text, target)
-    process_output = subprocess.check_output(
+    progress = BuildProgress(full_path_to_text)
+    process_output = run_ccg_build(
         ['ccg-build', '-Dnovel.file=%s' % path_to_text, '-f', 'build-rz.xml',
-         target], stderr=subprocess.STDOUT, shell=False)
-    __logger.debug('Finished realizing %s with captured output %s',
-                   path_to_text, process_output)
+         target], '%s.dir/realize.log' % full_path_to_text, progress,
+        cwd=bank_path_expanded, deadline=deadline)
+    __logger.debug('Finished realizing %s, %s', path_to_text,
+                   progress.report())
     return process_output
\ No newline at end of file
@@ -0,0 +1,200 @@
+__author__ = 'Ethan A. Hill'
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+from ..constants import ccg_values
+
+
+__logger = logging.getLogger(__name__)
+__HASH_CHUNK_SIZE = 1 << 16
+# The grammar fingerprint only needs computing once per run
+__grammar_fingerprint = None
+__grammar_fingerprint_lock = threading.Lock()
+# An entry still being put after this long was left by a run that died
+UNFINISHED_PUT_SECONDS = 60 * 60
+
+
+def update_hash_with_file(file_hash, file_path):
+    with open(file_path, 'rb') as hashed_file:
+        chunk = hashed_file.read(__HASH_CHUNK_SIZE)
+        while chunk:
+            file_hash.update(chunk)
+            chunk = hashed_file.read(__HASH_CHUNK_SIZE)
+
+
+def grammar_fingerprint():
+    # A hash over the grammar files and ccg-env, which holds the JVM settings
+    global __grammar_fingerprint
+    with __grammar_fingerprint_lock:
+        if __grammar_fingerprint is None:
+            fingerprint = hashlib.sha1()
+            paths = [os.path.expandvars(ccg_values.OPENCCG_BIN_ENV_FILE_PATH)]
+            grammar_path = os.path.expandvars(ccg_values.CCG_GRAMMAR_PATH)
+            for directory, _, file_names in sorted(os.walk(grammar_path)):
+                paths.extend(os.path.join(directory, file_name)
+                             for file_name in sorted(file_names))
+            for path in paths:
+                fingerprint.update(path)
+                if os.path.isfile(path):
+                    update_hash_with_file(fingerprint, path)
+            __grammar_fingerprint = fingerprint.hexdigest()
+            __logger.debug('Grammar fingerprint is %s', __grammar_fingerprint)
+    return __grammar_fingerprint
+
+
+def cache_key(input_path, *parts):
+    key = hashlib.sha1()
+    for part in parts:
+        key.update('%s\0' % part)
+    update_hash_with_file(key, input_path)
+    return key.hexdigest()
+
+
+def process_is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        # Another user's process is still a process
+        return e.errno == errno.EPERM
+    return True
+
+
+def is_abandoned_put(temporary_directory):
+    # Named <key>.<pid>.<thread> by the put building it, which may be in
+    # another process sharing the store
+    try:
+        pid = int(os.path.basename(temporary_directory).split('.')[1])
+        age = time.time() - os.path.getmtime(temporary_directory)
+    except (ValueError, IndexError, OSError):
+        return False
+    return age > UNFINISHED_PUT_SECONDS or not process_is_running(pid)
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, file_name))
+               for file_name in os.listdir(directory))
+
+
+class OutputCache(object):
+    # Content addressed store of OpenCCG output files, one directory per key,
+    # evicting the least recently used entries past max_bytes. Caches in
+    # other processes may share the store, the bound is on the store as a
+    # whole.
+
+    def __init__(self, store_directory, max_bytes):
+        self.store_directory = store_directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+        if not os.path.exists(store_directory):
+            os.makedirs(store_directory)
+        for key in os.listdir(store_directory):
+            entry_directory = os.path.join(store_directory, key)
+            # A put still going on elsewhere is left be
+            if '.' in key and is_abandoned_put(entry_directory):
+                shutil.rmtree(entry_directory, ignore_errors=True)
+        # key -> [size in bytes, last use], rebuilt from the store each run
+        self.__entries = self.__read_store()
+
+    def __read_store(self):
+        # The entries on disk, put by this cache or any other. The mtime of
+        # an entry is its last use, get touches it.
+        entries = {}
+        for key in os.listdir(self.store_directory):
+            if '.' in key:
+                continue
+            entry_directory = os.path.join(self.store_directory, key)
+            try:
+                entries[key] = [directory_size(entry_directory),
+                                os.path.getmtime(entry_directory)]
+            except OSError:
+                # Evicted by another cache as we looked
+                continue
+        return entries
+
+    def size(self):
+        with self.__lock:
+            return sum(size for size, _ in self.__entries.itervalues())
+
+    def get(self, key, output_directory):
+        # Copies the entry's files into output_directory, True on a hit
+        entry_directory = os.path.join(self.store_directory, key)
+        with self.__lock:
+            if key not in self.__entries:
+                self.misses += 1
+                return False
+            self.__entries[key][1] = time.time()
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        try:
+            for file_name in os.listdir(entry_directory):
+                shutil.copyfile(os.path.join(entry_directory, file_name),
+                                os.path.join(output_directory, file_name))
+            os.utime(entry_directory, None)
+        except (OSError, IOError), e:
+            # Another cache over the store evicted it, it is a miss after all
+            logging.getLogger(__name__).debug(
+                'Cache entry %s went missing: %s', key, e)
+            with self.__lock:
+                self.__entries.pop(key, None)
+                self.misses += 1
+            return False
+        with self.__lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, file_paths):
+        entry_directory = os.path.join(self.store_directory, key)
+        # Build the entry aside, so readers never see half of one
+        temporary_directory = '%s.%d.%d' % (
+            entry_directory, os.getpid(), threading.current_thread().ident)
+        os.makedirs(temporary_directory)
+        for file_path in file_paths:
+            shutil.copyfile(file_path, os.path.join(
+                temporary_directory, os.path.basename(file_path)))
+        size = directory_size(temporary_directory)
+        with self.__lock:
+            # Caches in other processes may share the store and have put
+            # the same entry already
+            stored = key in self.__entries or os.path.exists(entry_directory)
+            if not stored:
+                try:
+                    os.rename(temporary_directory, entry_directory)
+                except OSError:
+                    # Another process got there between the check and now
+                    stored = True
+            if stored:
+                shutil.rmtree(temporary_directory, ignore_errors=True)
+                if key not in self.__entries:
+                    self.__entries[key] = [size, time.time()]
+                return
+            self.__entries[key] = [size, time.time()]
+            self.__evict()
+
+    def __evict(self):
+        # Other caches' entries count toward the bound too
+        self.__entries = self.__read_store()
+        total = sum(size for size, _ in self.__entries.itervalues())
+        by_last_use = sorted(self.__entries,
+                             key=lambda key: self.__entries[key][1])
+        for key in by_last_use:
+            if total <= self.max_bytes:
+                break
+            size, _ = self.__entries.pop(key)
+            total -= size
+            self.evictions += 1
+            shutil.rmtree(os.path.join(self.store_directory, key),
+                          ignore_errors=True)
+
+    def report(self):
+        return ('cache %s: %d hits, %d misses, %d evictions, %d entries '
+                'using %dKB' % (self.store_directory, self.hits, self.misses,
+                                self.evictions, len(self.__entries),
+                                self.size() / 1024))
@@ -1,44 +1,231 @@
 __author__ = 'Ethan A. Hill'
+import itertools
 import logging
-import build_utilities
+import multiprocessing
+import os
+from xml.etree import cElementTree as ElementTree
 import sentence_utilities
 import rewrite_utilities
 import reversal_utilities
+import realization_utilities
+import worker_utilities
+import batch_utilities
+import cache_utilities
+import journal_utilities
+import manifest_utilities
+import scheduler_utilities
+import system_utilities
 from ..utilities import option_utilities
 
 
 __logger = logging.getLogger(__name__)
+CCG_RESOURCE = 'ccg'
+CPU_RESOURCE = 'cpu'
 
 
-def disambiguate(path_to_text, post_process=False):
-    parse_output_directory = '%s.dir' % path_to_text
+class DisambiguationJob(object):
+    # The state of one text file as it moves through the disambiguation stages
+
+    def __init__(self, path_to_text, post_process=False, worker_pool=None):
+        # Relative paths are relative to ccgbank, whatever the working directory
+        self.path_to_text = system_utilities.ccgbank_path(path_to_text)
+        self.parse_output_directory = '%s.dir' % self.path_to_text
+        self.lf_path = os.path.join(self.parse_output_directory, 'tb.xml')
+        # Post processing runs no OpenCCG stages, otherwise those whose
+        # outputs are out of date by the manifest run
+        self.post_process = post_process
+        self.manifest = manifest_utilities.StageManifest(
+            self.parse_output_directory)
+        # Without a pool, each OpenCCG job starts its own ccg-build
+        self.ccg_worker = worker_pool or worker_utilities.SubprocessCcgWorker()
+        self.sentences = None
+        self.realizations = None
+        self.path_to_reparse_text = None
+
+    def __repr__(self):
+        return self.path_to_text
+
+
+def run_stale_ccg_stage(job, stage_name, task, path_to_text, inputs,
+                        outputs):
+    # Runs an OpenCCG job unless its outputs are up to date with its inputs
+    # and the grammar, returns whether it ran
+    if job.post_process:
+        return False
+    parameters = {'grammar': cache_utilities.grammar_fingerprint()}
+    if job.manifest.is_fresh(stage_name, inputs, outputs, parameters):
+        __logger.debug('%s of %s is up to date', stage_name, path_to_text)
+        return False
+    input_hashes = job.manifest.hashes(inputs)
+    job.ccg_worker.run(task, path_to_text)
+    job.manifest.record(stage_name, input_hashes, outputs, parameters)
+    return True
+
+
+def parse_stage(job):
+    __logger.debug('Parsing text file %s ', job.path_to_text)
+    run_stale_ccg_stage(job, 'parse_stage', worker_utilities.PARSE_TASK,
+                        job.path_to_text, [job.path_to_text], [job.lf_path])
+
+
+def sentence_stage(job):
+    job.sentences = sentence_utilities.sentence_factory(
+        job.parse_output_directory)
+
+
+def rewrite_stage(job):
+    # The rewrites go into tb.xml, unless they are there already
+    if job.manifest.is_fresh('rewrite_stage', [job.lf_path], [job.lf_path]):
+        rewrite_utilities.apply_rewrites(
+            job.sentences, job.parse_output_directory, append_to_xml=False)
+        return
+    if job.post_process:
+        # The run that realized the parses appended its rewrites, though
+        # the manifest doesn't know of it, they are replaced not added to
+        rewrite_utilities.remove_rewrites_from_xml_file(job.lf_path)
+    input_hashes = job.manifest.hashes([job.lf_path])
+    rewrite_utilities.apply_rewrites(job.sentences, job.parse_output_directory)
+    job.manifest.record('rewrite_stage', input_hashes, [job.lf_path])
+
+
+def realize_stage(job):
+    __logger.debug('Realizing parses for %s ', job.path_to_text)
+    run_stale_ccg_stage(
+        job, 'realize_stage', worker_utilities.REALIZE_TASK, job.path_to_text,
+        [job.lf_path], [os.path.join(job.parse_output_directory,
+                                     'realize.nbest')])
+
+
+def validate_rewrite_stage(job):
+    # Both rewrites and reversals check against the same realizations
+    job.realizations = realization_utilities.realization_index(
+        job.parse_output_directory)
+    rewrite_utilities.validate_rewrites(
+        job.sentences, job.parse_output_directory, job.realizations)
+
+
+def reversal_stage(job):
+    job.path_to_reparse_text = reversal_utilities.prepare_reversals(
+        job.sentences, job.parse_output_directory, job.realizations)
+    # The index is not needed again, let it go
+    job.realizations = None
+
+
+def reparse_stage(job):
+    # Now reparse the newly created reversals
+    __logger.debug('Parsing text file %s ', job.path_to_reparse_text)
+    run_stale_ccg_stage(
+        job, 'reparse_stage', worker_utilities.PARSE_TASK,
+        job.path_to_reparse_text, [job.path_to_reparse_text],
+        [os.path.join('%s.dir' % job.path_to_reparse_text, 'tb.xml')])
+
+
+def validate_reversal_stage(job):
+    reversal_utilities.validate_reversals(
+        job.sentences, job.parse_output_directory)
+
+
+def disambiguation_stages():
+    # OpenCCG stages hold a ccg worker, and with it a JVM, the others a core
+    stage_functions = [
+        (parse_stage, CCG_RESOURCE), (sentence_stage, CPU_RESOURCE),
+        (rewrite_stage, CPU_RESOURCE), (realize_stage, CCG_RESOURCE),
+        (validate_rewrite_stage, CPU_RESOURCE), (reversal_stage, CPU_RESOURCE),
+        (reparse_stage, CCG_RESOURCE), (validate_reversal_stage, CPU_RESOURCE)]
+    stages = []
+    for function, resource in stage_functions:
+        dependencies = [stages[-1].name] if stages else []
+        stages.append(scheduler_utilities.Stage(
+            function.__name__, function, resource, dependencies))
+    return stages
+
+
+def disambiguate(path_to_text, post_process=False, worker_pool=None):
+    job = DisambiguationJob(path_to_text, post_process, worker_pool)
     __logger.debug('Processing text file %s into directory %s',
-                   path_to_text, parse_output_directory)
-    # We only want to parse if we are not to post process things
+                   job.path_to_text, job.parse_output_directory)
+    for stage in disambiguation_stages():
+        stage.function(job)
+    __logger.debug('Finished processing text file %s into directory %s',
+                   job.path_to_text, job.parse_output_directory)
+    return job.sentences
+
+
+def disambiguation_scheduler(worker_pool, cpu_slots=None):
+    # Files overlap stage by stage, ie. one parses while another is analysed
+    resource_limits = {CCG_RESOURCE: worker_pool.num_workers,
+                       CPU_RESOURCE: cpu_slots or multiprocessing.cpu_count()}
+    return scheduler_utilities.StageScheduler(
+        disambiguation_stages(), resource_limits)
+
+
+def disambiguate_pipelined(text_files, post_process=False, worker_pool=None,
+                           scheduler=None, result_handler=None):
+    # With a result_handler, each file and its sentences are handed to it as
+    # soon as the file is done rather than returned at the end
+    scheduler = scheduler or disambiguation_scheduler(worker_pool)
+    jobs = [DisambiguationJob(text_file, post_process, worker_pool)
+            for text_file in text_files]
+    if result_handler is None:
+        return [job.sentences for job in scheduler.run(jobs)]
+
+    def hand_on(job):
+        sentences, job.sentences = job.sentences, None
+        result_handler(job.path_to_text, sentences)
+    scheduler.run(jobs, hand_on)
+
+
+def disambiguate_batch(text_files, post_process=False, worker_pool=None):
+    # Like disambiguate, but every OpenCCG job runs once for all of the files
+    text_files = [system_utilities.ccgbank_path(f) for f in text_files]
+    ccg_worker = worker_pool or worker_utilities.SubprocessCcgWorker()
+    batch = batch_utilities.write_batch(
+        batch_utilities.batch_path_for(text_files), text_files)
+    __logger.debug('Processing text files %s as batch %s',
+                   text_files, batch.path_to_text)
     if not post_process:
-        __logger.debug('Parsing text file %s ', path_to_text)
-        build_utilities.ccg_build_parse(path_to_text)
-    sentences = sentence_utilities.sentence_factory(parse_output_directory)
-    # Apply rewrites if we can...
-    rewrite_utilities.apply_rewrites(sentences, parse_output_directory)
+        __logger.debug('Parsing batch %s ', batch.path_to_text)
+        ccg_worker.run(worker_utilities.PARSE_TASK, batch.path_to_text)
+        batch_utilities.split_logical_forms(batch)
+    output_directories = ['%s.dir' % f for f in text_files]
+    sentence_sets = [sentence_utilities.sentence_factory(directory)
+                     for directory in output_directories]
+    for sentences, directory in zip(sentence_sets, output_directories):
+        if post_process:
+            # The run that realized the parses appended its rewrites
+            rewrite_utilities.remove_rewrites_from_xml_file(
+                os.path.join(directory, 'tb.xml'))
+        rewrite_utilities.apply_rewrites(sentences, directory)
     if not post_process:
-        __logger.debug('Realizing parses for %s ', path_to_text)
-        build_utilities.ccg_build_realize(path_to_text)
-    rewrite_utilities.validate_rewrites(sentences, parse_output_directory)
-    path_to_reparse_text = reversal_utilities.prepare_reversals(
-        sentences, parse_output_directory)
-    # Now reparse the newly created reversals
+        # Realize every file's rewrites together
+        batch_utilities.merge_logical_forms(batch)
+        __logger.debug('Realizing parses for batch %s ', batch.path_to_text)
+        ccg_worker.run(worker_utilities.REALIZE_TASK, batch.path_to_text)
+        batch_utilities.split_realizations(batch)
+    reversal_paths = []
+    for sentences, directory in zip(sentence_sets, output_directories):
+        realizations = realization_utilities.realization_index(directory)
+        rewrite_utilities.validate_rewrites(
+            sentences, directory, realizations)
+        reversal_paths.append(reversal_utilities.prepare_reversals(
+            sentences, directory, realizations))
+    # The reversals of every file are reparsed as a batch of their own
+    reversal_batch = batch_utilities.write_batch(
+        '%s/reversals' % batch.output_directory(), reversal_paths)
     if not post_process:
-        __logger.debug('Parsing text file %s ', path_to_reparse_text)
-        build_utilities.ccg_build_parse(path_to_reparse_text)
-
-    reversal_utilities.validate_reversals(sentences, parse_output_directory)
-    __logger.debug('Finished processing text file %s into directory %s',
-                   path_to_text, parse_output_directory)
-    return sentences
+        __logger.debug('Parsing reversals of batch %s ', batch.path_to_text)
+        ccg_worker.run(
+            worker_utilities.PARSE_TASK, reversal_batch.path_to_text)
+        batch_utilities.split_logical_forms(reversal_batch)
+    for sentences, directory in zip(sentence_sets, output_directories):
+        reversal_utilities.validate_reversals(sentences, directory)
+    __logger.debug('Finished processing text files %s as batch %s',
+                   text_files, batch.path_to_text)
+    return list(itertools.chain.from_iterable(sentence_sets))
 
 
-def disambiguation_worker(job_queue, output_queue, post_process=False):
+def disambiguation_worker(job_queue, output_queue, post_process=False,
+                          worker_pool=None, job_function=disambiguate):
     while True:
         item = job_queue.get()
         # Process tasks as they come into the queue
@@ -46,7 +233,7 @@ def disambiguation_worker(job_queue, output_queue, post_process=False):
                       'process...', item, job_queue.qsize())
         try:
             # Do work, item is positional, we don't know about the others
-            captured_output = disambiguate(item, post_process)
+            captured_output = job_function(item, post_process, worker_pool)
             output_queue.put(captured_output)
         except Exception, e:
             __logger.exception('Exception %s encountered, skipping %s', e, item)
@@ -57,6 +244,106 @@ def disambiguation_worker(job_queue, output_queue, post_process=False):
     return output_queue
 
 
+class DisambiguationResult(object):
+    # What the output needs of some sentences, kept as xml strings so that it
+    # pickles small between processes: a sort key, the sentence and its
+    # options for each sentence
+
+    def __init__(self, sentences):
+        self.entries = []
+        for sentence in sentences:
+            # Text files are absolute while processing, but relative to
+            # ccgbank in the output
+            text_file = system_utilities.ccgbank_relative_path(
+                sentence.parent_file_name)
+            options = []
+            if sentence.is_ambiguous():
+                for option in option_utilities.options_factory(sentence):
+                    option_xml = option.xmlize()
+                    option_xml.set('text_file', text_file)
+                    options.append(ElementTree.tostring(option_xml))
+            sentence_xml = sentence.xmlize()
+            sentence_xml.set('text_file', text_file)
+            sort_key = (text_file, int(sentence.full_id[1:]))
+            self.entries.append((sort_key, ElementTree.tostring(sentence_xml),
+                                 options))
+
+
+# Each process of a process pool keeps its own ccg workers
+__process_worker_pool = None
+
+
+def initialize_process(pool_arguments):
+    global __process_worker_pool
+    pool_arguments = dict(pool_arguments)
+    cache_directory = pool_arguments.pop('cache_directory', None)
+    cache_bytes = pool_arguments.pop('cache_bytes', None)
+    if cache_directory:
+        pool_arguments['cache'] = cache_utilities.OutputCache(
+            cache_directory, cache_bytes)
+    skip_list_path = pool_arguments.pop('skip_list_path', None)
+    if skip_list_path:
+        pool_arguments['skip_list'] = worker_utilities.SkipList(
+            skip_list_path)
+    journal_path = pool_arguments.pop('journal_path', None)
+    if journal_path:
+        # The main process has started the journal over if need be
+        pool_arguments['journal'] = journal_utilities.Journal(
+            journal_path, resume=True)
+    try:
+        __process_worker_pool = worker_utilities.worker_pool_factory(
+            num_workers=1, **pool_arguments)
+    except Exception, e:
+        # Raising here would only have the pool start another process, jobs
+        # fall back to a ccg-build each
+        __logger.exception('Exception %s encountered creating ccg workers '
+                           'for process %d', e, os.getpid())
+
+
+def process_job(job):
+    job_function, item, post_process, chunked_files = job
+    __logger.info('Attempting to process %s in process %d', item,
+                  os.getpid())
+    try:
+        sentences = job_function(item, post_process, __process_worker_pool)
+        batch_utilities.reassemble_chunks(sentences, chunked_files)
+        return item, DisambiguationResult(sentences)
+    except Exception, e:
+        __logger.exception('Exception %s encountered, skipping %s', e, item)
+        return None
+    finally:
+        __logger.info('Finished processing %s', item)
+
+
+def disambiguate_in_processes(items, num_processes, post_process=False,
+                              pool_arguments=None, job_function=disambiguate,
+                              chunked_files=(), result_handler=None):
+    # Like disambiguation_worker threads, but the Python work of each job
+    # runs in a process of its own, free of the GIL. pool_arguments are
+    # those of worker_pool_factory, with a cache_directory and cache_bytes
+    # and a skip_list_path and journal_path in place of the objects they
+    # make. With a result_handler, each item and its result are handed to it
+    # as they arrive instead.
+    pool = multiprocessing.Pool(num_processes, initialize_process,
+                                (pool_arguments or {}, ))
+    try:
+        jobs = [(job_function, item, post_process, chunked_files)
+                for item in items]
+        results = []
+        for output in pool.imap_unordered(process_job, jobs):
+            if output is None:
+                continue
+            item, result = output
+            if result_handler is None:
+                results.append(result)
+            else:
+                result_handler(item, result)
+        return results
+    finally:
+        pool.close()
+        pool.join()
+
+
 def gather_disambiguation_options(sentences):
     # Obviously only ambiguous sentences can have utilities options
     ambiguous = [sentence for sentence in sentences if sentence.is_ambiguous()]
@@ -0,0 +1,332 @@
+__author__ = 'Ethan A. Hill'
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import uuid
+from xml.etree import cElementTree as ElementTree
+
+import batch_utilities
+import manifest_utilities
+import system_utilities
+
+
+__logger = logging.getLogger(__name__)
+XML_DUMP_ROOT = 'raw_data'
+OPTION_DUMP_ROOT = 'novel_disambiguation'
+SHARD_ROOT = 'shard'
+SHARD_INDEX_NAME = 'index'
+# What of the shards a combined dump was built from, beside the dump
+BUILT_FROM_SUFFIX = '.shards'
+# The element each dump is made of, under its root
+DUMP_ELEMENTS = {XML_DUMP_ROOT: 'sentence', OPTION_DUMP_ROOT: 'option'}
+
+
+class StreamingXmlWriter(object):
+    # Writes the root's start tag on opening, then each element as it comes,
+    # so nothing but the element being written is held in memory
+
+    def __init__(self, path, root_tag):
+        self.path = path
+        self.root_tag = root_tag
+        self.num_elements = 0
+        self.__file = open(path, 'w')
+        self.__file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        self.__file.write('<%s>\n' % root_tag)
+
+    def write(self, element):
+        # Elements may come already serialized
+        if not isinstance(element, basestring):
+            element = ElementTree.tostring(element)
+        self.__file.write(element)
+        self.__file.write('\n')
+        self.num_elements += 1
+
+    def flush(self):
+        self.__file.flush()
+
+    def close(self):
+        if not self.__file.closed:
+            self.__file.write('</%s>\n' % self.root_tag)
+            self.__file.close()
+
+
+class DumpWriters(object):
+    # The xml and option dumps, either of which may be off, written one
+    # DisambiguationResult at a time by however many threads finish jobs
+
+    def __init__(self, xml_dump_path=None, option_dump_path=None):
+        self.__lock = threading.Lock()
+        self.xml_writer = None
+        self.option_writer = None
+        if xml_dump_path:
+            self.xml_writer = StreamingXmlWriter(xml_dump_path, XML_DUMP_ROOT)
+        if option_dump_path:
+            self.option_writer = StreamingXmlWriter(
+                option_dump_path, OPTION_DUMP_ROOT)
+
+    def write_result(self, result, item=None):
+        # The dumps are in the order results finish, whatever their item
+        with self.__lock:
+            for _, sentence_xml, options_xml in result.entries:
+                if self.xml_writer is not None:
+                    self.xml_writer.write(sentence_xml)
+                if self.option_writer is not None:
+                    for option_xml in options_xml:
+                        self.option_writer.write(option_xml)
+            # Whatever finished is on disk should the run die later
+            for writer in [self.xml_writer, self.option_writer]:
+                if writer is not None:
+                    writer.flush()
+
+    def close(self):
+        with self.__lock:
+            for writer in [self.xml_writer, self.option_writer]:
+                if writer is not None:
+                    writer.close()
+                    logging.getLogger(__name__).debug(
+                        'Wrote %d elements to %s', writer.num_elements,
+                        writer.path)
+
+
+def shard_name(path_to_text):
+    # Readable, but unique for texts of the same name in different places
+    return '%s-%s.xml' % (os.path.basename(path_to_text),
+                          hashlib.sha1(path_to_text).hexdigest()[:12])
+
+
+class ShardWriter(object):
+    # Writes the results of each text file, or chunk of one, to a shard of
+    # its own under shard_directory, noting what each shard holds in an
+    # append only index whose later lines supersede earlier ones. Each
+    # writer is a run of its own; its shards replace those of earlier runs
+    # that hold any of the same files.
+
+    def __init__(self, shard_directory):
+        self.shard_directory = shard_directory
+        self.index_path = os.path.join(shard_directory, SHARD_INDEX_NAME)
+        self.run = uuid.uuid4().hex
+        self.num_shards = 0
+        self.__lock = threading.Lock()
+        if not os.path.exists(shard_directory):
+            os.makedirs(shard_directory)
+
+    def write_result(self, result, item):
+        if isinstance(item, (list, tuple)):
+            # A batch's files each get a shard
+            for path_to_text in item:
+                text_file = system_utilities.ccgbank_relative_path(
+                    path_to_text)
+                self.__write_shard(path_to_text, [
+                    entry for entry in result.entries
+                    if entry[0][0] == text_file])
+        else:
+            self.__write_shard(item, result.entries)
+
+    def __write_shard(self, path_to_text, entries):
+        name = shard_name(path_to_text)
+        shard_path = os.path.join(self.shard_directory, name)
+        writer = StreamingXmlWriter('%s.tmp' % shard_path, SHARD_ROOT)
+        num_options = 0
+        for _, sentence_xml, options_xml in sorted(entries):
+            writer.write(sentence_xml)
+            for option_xml in options_xml:
+                writer.write(option_xml)
+            num_options += len(options_xml)
+        writer.close()
+        os.rename('%s.tmp' % shard_path, shard_path)
+        record = {'shard': name, 'job': path_to_text, 'run': self.run,
+                  'text_files': sorted(set(key[0] for key, _, _ in entries)),
+                  'sentences': len(entries), 'options': num_options,
+                  'sha1': manifest_utilities.file_sha1(shard_path)}
+        with self.__lock:
+            with open(self.index_path, 'a') as index_file:
+                index_file.write(json.dumps(record, sort_keys=True) + '\n')
+            self.num_shards += 1
+
+    def close(self):
+        logging.getLogger(__name__).debug(
+            'Wrote %d shards to %s', self.num_shards, self.shard_directory)
+
+
+def read_shard_index(shard_directory, keep_text_files=None):
+    # Shard name -> its latest index record, but for shards superseded by a
+    # later run writing any of their files, ie. the chunks of a file that
+    # is no longer chunked. Given keep_text_files, as they are in the dumps,
+    # the shards of every other file are left out too.
+    index = {}
+    names_by_file = {}
+    index_path = os.path.join(shard_directory, SHARD_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return index
+    with open(index_path) as index_file:
+        for line in index_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn by a run that died
+                continue
+            superseded = set([record['shard']])
+            for text_file in record['text_files']:
+                superseded.update(
+                    name for name in names_by_file.get(text_file, ())
+                    if index[name].get('run') != record.get('run'))
+            for name in superseded & set(index):
+                for text_file in index.pop(name)['text_files']:
+                    names_by_file[text_file].discard(name)
+            index[record['shard']] = record
+            for text_file in record['text_files']:
+                names_by_file.setdefault(text_file, set()).add(
+                    record['shard'])
+    if keep_text_files is not None:
+        keep_text_files = set(keep_text_files)
+        index = dict((name, record) for name, record in index.iteritems()
+                     if keep_text_files.intersection(record['text_files']))
+    return index
+
+
+def prune_shards(shard_directory, keep_text_files=None):
+    # Deletes the shards no longer in the index and rewrites the index with
+    # only the latest record of each shard left, returning it
+    index = read_shard_index(shard_directory, keep_text_files)
+    index_path = os.path.join(shard_directory, SHARD_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return index
+    with open('%s.tmp' % index_path, 'w') as index_file:
+        for name in sorted(index):
+            index_file.write(json.dumps(index[name], sort_keys=True) + '\n')
+    os.rename('%s.tmp' % index_path, index_path)
+    num_pruned = 0
+    for name in os.listdir(shard_directory):
+        if name.endswith('.xml') and name not in index:
+            os.remove(os.path.join(shard_directory, name))
+            num_pruned += 1
+    logging.getLogger(__name__).info('Pruned %d shards from %s', num_pruned,
+                                     shard_directory)
+    return index
+
+
+def record_key(element):
+    # Sentences and options both sort by their text file and sentence
+    number, _ = batch_utilities.split_sentence_id(
+        element.attrib['sentence_id'])
+    return element.attrib['text_file'], number
+
+
+def xml_records(xml_path, tag):
+    # The (key, xml) of each tag element just under the root, one at a time
+    depth = 0
+    for event, element in ElementTree.iterparse(xml_path, ('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and element.tag == tag:
+            element.tail = None
+            yield record_key(element), ElementTree.tostring(element)
+            element.clear()
+
+
+def __keyed_records(stream_number, records):
+    for position, (key, xml) in enumerate(records):
+        yield (key, stream_number, position), xml
+
+
+def merged_records(record_streams):
+    # k-way merge of (key, xml) streams each sorted by key, so the merge is
+    # too. Ties go to the earlier stream, keeping the merge deterministic.
+    keyed_streams = [__keyed_records(stream_number, records)
+                     for stream_number, records in enumerate(record_streams)]
+    for (key, _, _), xml in heapq.merge(*keyed_streams):
+        yield key, xml
+
+
+def shard_records(shard_directory, index, tag, text_files=None):
+    # The records of every shard in key order. A shard holds a single text
+    # file, so only the shards of one file (ie. its chunks) are ever open
+    # together, however many shards there are.
+    shards_by_file = {}
+    for name, record in index.iteritems():
+        for text_file in record['text_files']:
+            shards_by_file.setdefault(text_file, []).append(name)
+    if text_files is not None:
+        shards_by_file = dict((text_file, names) for text_file, names
+                              in shards_by_file.iteritems()
+                              if text_file in text_files)
+    for text_file in sorted(shards_by_file):
+        streams = [xml_records(os.path.join(shard_directory, name), tag)
+                   for name in sorted(shards_by_file[text_file])]
+        for key_and_xml in merged_records(streams):
+            yield key_and_xml
+
+
+def write_dump(dump_path, root_tag, records):
+    # Written aside and moved into place, so a dump is never half written,
+    # and may be built from its own previous version
+    writer = StreamingXmlWriter('%s.tmp' % dump_path, root_tag)
+    for xml in records:
+        writer.write(xml)
+    writer.close()
+    os.rename('%s.tmp' % dump_path, dump_path)
+    return writer.num_elements
+
+
+def update_dump(shard_directory, dump_path, root_tag, rebuild=False):
+    # Merges the shards into a combined dump. A dump built from them before
+    # only has the files of shards that changed since replaced.
+    index = read_shard_index(shard_directory)
+    tag = DUMP_ELEMENTS[root_tag]
+    built_from_path = dump_path + BUILT_FROM_SUFFIX
+    built_from = None
+    if not rebuild and os.path.exists(dump_path) and os.path.exists(
+            built_from_path):
+        with open(built_from_path) as built_from_file:
+            built_from = json.load(built_from_file)
+    logger = logging.getLogger(__name__)
+    if built_from is None:
+        records = (xml for _, xml in shard_records(
+            shard_directory, index, tag))
+        num_elements = write_dump(dump_path, root_tag, records)
+        logger.info('Merged %d shards into %s, %d elements', len(index),
+                    dump_path, num_elements)
+    else:
+        changed = [name for name in set(index) | set(built_from)
+                   if index.get(name, {}).get('sha1') !=
+                   built_from.get(name, {}).get('sha1')]
+        if not changed:
+            logger.info('%s is up to date with its shards', dump_path)
+            return
+        # Every file of a changed shard, before and after, is replaced
+        text_files = set()
+        for name in changed:
+            for record in [index.get(name), built_from.get(name)]:
+                if record is not None:
+                    text_files.update(record['text_files'])
+        unchanged = ((key, xml) for key, xml in xml_records(dump_path, tag)
+                     if key[0] not in text_files)
+        replacements = shard_records(shard_directory, index, tag, text_files)
+        records = (xml for _, xml in merged_records(
+            [unchanged, replacements]))
+        num_elements = write_dump(dump_path, root_tag, records)
+        logger.info('Patched %d changed shards into %s, %d elements',
+                    len(changed), dump_path, num_elements)
+    built_from = dict((name, {'sha1': record['sha1'],
+                              'text_files': record['text_files']})
+                      for name, record in index.iteritems())
+    with open('%s.tmp' % built_from_path, 'w') as built_from_file:
+        json.dump(built_from, built_from_file, sort_keys=True)
+    os.rename('%s.tmp' % built_from_path, built_from_path)
+
+
+def update_dumps(shard_directory, xml_dump_path=None, option_dump_path=None,
+                 rebuild=False, keep_text_files=None):
+    # Superseded shards are gone from the dumps and the shard directory
+    # both. Those of files a run didn't process are kept, unless pruned by
+    # keep_text_files.
+    prune_shards(shard_directory, keep_text_files)
+    for dump_path, root_tag in [(xml_dump_path, XML_DUMP_ROOT),
+                                (option_dump_path, OPTION_DUMP_ROOT)]:
+        if dump_path:
+            update_dump(shard_directory, dump_path, root_tag, rebuild)
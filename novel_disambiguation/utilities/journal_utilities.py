@@ -0,0 +1,127 @@
+__author__ = 'Ethan A. Hill'
+import cPickle
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+
+__logger = logging.getLogger(__name__)
+# The stage recorded once a job's results are saved
+FINISHED_STAGE = 'finished'
+
+
+def job_key(job):
+    # A job is a text file or a batch of them, read back from json as lists
+    # of unicode
+    if isinstance(job, list):
+        return tuple(job_key(text_file) for text_file in job)
+    if isinstance(job, unicode):
+        job = job.encode('utf-8')
+    return os.path.abspath(job)
+
+
+class Journal(object):
+    # An append only record of the work a run has done, one json object per
+    # line: the OpenCCG tasks run on each text and, once a job is finished,
+    # where its pickled results are. Processes may share one, every record
+    # is a single write. Unless resuming, the journal starts over.
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.results_directory = '%s.results' % path
+        self.__lock = threading.Lock()
+        # key -> stages done, and key -> results path in the order finished
+        self.__stages = {}
+        self.__results = {}
+        self.__finished_order = []
+        torn = False
+        if resume and os.path.exists(path):
+            torn = self.__load()
+        else:
+            if os.path.exists(self.results_directory):
+                shutil.rmtree(self.results_directory)
+            open(path, 'w').close()
+        if not os.path.exists(self.results_directory):
+            os.makedirs(self.results_directory)
+        self.__file = open(path, 'a')
+        if torn:
+            # Records start on lines of their own
+            self.__file.write('\n')
+
+    def __load(self):
+        # Returns whether the last record was left without its newline
+        line = '\n'
+        with open(self.path) as journal_file:
+            for line_number, line in enumerate(journal_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The run died writing it
+                    logging.getLogger(__name__).warning(
+                        'Ignoring line %d of journal %s', line_number,
+                        self.path)
+                    continue
+                self.__add(job_key(record['job']), record['stage'],
+                           record.get('result'))
+        return not line.endswith('\n')
+
+    def __add(self, key, stage, result_path):
+        self.__stages.setdefault(key, set()).add(stage)
+        if stage == FINISHED_STAGE:
+            if key not in self.__results:
+                self.__finished_order.append(key)
+            self.__results[key] = result_path
+
+    def __len__(self):
+        return len(self.__finished_order)
+
+    def record(self, job, stage, result_path=None):
+        key = job_key(job)
+        line = json.dumps({'job': key, 'stage': stage,
+                           'result': result_path}) + '\n'
+        with self.__lock:
+            self.__file.write(line)
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__add(key, stage, result_path)
+
+    def completed(self, job, stage):
+        with self.__lock:
+            return stage in self.__stages.get(job_key(job), ())
+
+    def finished(self, job):
+        return self.completed(job, FINISHED_STAGE)
+
+    def save_result(self, job, result):
+        # The results are in place before the journal says they are
+        key = job_key(job)
+        result_path = os.path.join(
+            self.results_directory,
+            '%s.pickle' % hashlib.sha1(repr(key)).hexdigest())
+        with open('%s.tmp' % result_path, 'wb') as result_file:
+            cPickle.dump(result, result_file, cPickle.HIGHEST_PROTOCOL)
+        os.rename('%s.tmp' % result_path, result_path)
+        self.record(job, FINISHED_STAGE, result_path)
+
+    def results(self, jobs=None):
+        # Each job and its saved results in the order the jobs finished,
+        # across every run of the journal, one at a time. Given jobs, only
+        # theirs.
+        with self.__lock:
+            finished = [(key, self.__results[key])
+                        for key in self.__finished_order]
+        if jobs is not None:
+            keys = set(job_key(job) for job in jobs)
+            finished = [(key, path) for key, path in finished if key in keys]
+        for key, result_path in finished:
+            with open(result_path, 'rb') as result_file:
+                yield key, cPickle.load(result_file)
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
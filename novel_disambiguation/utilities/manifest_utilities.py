@@ -0,0 +1,115 @@
+__author__ = 'Ethan A. Hill'
+import hashlib
+import json
+import logging
+import os
+
+import cache_utilities
+
+
+__logger = logging.getLogger(__name__)
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def file_sha1(path):
+    file_hash = hashlib.sha1()
+    cache_utilities.update_hash_with_file(file_hash, path)
+    return file_hash.hexdigest()
+
+
+class StageManifest(object):
+    # The sidecar manifest of a text's output directory. For each stage that
+    # ran, the hashes of its inputs as it started and of its outputs as it
+    # finished, along with its parameters (ie. the grammar), so a stage whose
+    # inputs and outputs are as it left them need not run again. A file is
+    # only hashed again when its size or mtime has changed.
+
+    def __init__(self, output_directory):
+        self.output_directory = output_directory
+        self.path = os.path.join(output_directory, MANIFEST_FILE_NAME)
+        # Records in the order the stages last ran, and name -> [size,
+        # mtime, sha1] of every file seen
+        self.__stages = []
+        self.__files = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as manifest_file:
+                    manifest = json.load(manifest_file)
+                self.__stages = manifest['stages']
+                self.__files = manifest['files']
+            except (ValueError, KeyError), e:
+                logging.getLogger(__name__).warning(
+                    'Ignoring manifest %s: %s', self.path, e)
+
+    def __name(self, path):
+        return os.path.relpath(path, self.output_directory)
+
+    def __record_for(self, stage):
+        for index, record in enumerate(self.__stages):
+            if record['stage'] == stage:
+                return index, record
+        return None, None
+
+    def file_hash(self, path):
+        # None for a file that isn't there
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+        name = self.__name(path)
+        known = self.__files.get(name)
+        if known and known[:2] == [status.st_size, status.st_mtime]:
+            return known[2]
+        sha1 = file_sha1(path)
+        self.__files[name] = [status.st_size, status.st_mtime, sha1]
+        return sha1
+
+    def hashes(self, paths):
+        return dict((self.__name(path), self.file_hash(path))
+                    for path in paths)
+
+    def __expected_hash(self, index, name, sha1):
+        # Outputs may be changed in place by later stages, ie. rewrites are
+        # appended to the parses in tb.xml, follow the file along
+        for record in self.__stages[index + 1:]:
+            outputs = record['outputs']
+            if name in outputs and record['inputs'].get(name) == sha1:
+                sha1 = outputs[name]
+        return sha1
+
+    def is_fresh(self, stage, inputs, outputs, parameters=None):
+        index, record = self.__record_for(stage)
+        if record is None or record['parameters'] != (parameters or {}):
+            return False
+        # A file the stage changes in place is checked as one of its outputs
+        for path in inputs:
+            name = self.__name(path)
+            if path not in outputs and (
+                    self.file_hash(path) != record['inputs'].get(name)):
+                return False
+        for path in outputs:
+            name = self.__name(path)
+            current = self.file_hash(path)
+            if current is None or current != self.__expected_hash(
+                    index, name, record['outputs'].get(name)):
+                return False
+        return True
+
+    def record(self, stage, input_hashes, outputs, parameters=None):
+        # input_hashes are those taken before the stage ran
+        index, _ = self.__record_for(stage)
+        if index is not None:
+            del self.__stages[index]
+        self.__stages.append({'stage': stage, 'inputs': input_hashes,
+                              'outputs': self.hashes(outputs),
+                              'parameters': parameters or {}})
+        self.save()
+
+    def save(self):
+        if not os.path.exists(self.output_directory):
+            os.makedirs(self.output_directory)
+        temporary_path = '%s.tmp' % self.path
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump({'stages': self.__stages, 'files': self.__files},
+                      manifest_file, indent=1, sort_keys=True)
+        os.rename(temporary_path, self.path)
@@ -0,0 +1,74 @@
+__author__ = 'Ethan A. Hill'
+import logging
+import resource
+import time
+from xml.etree import cElementTree as ElementTree
+
+
+__logger = logging.getLogger(__name__)
+
+
+class RealizationIndex(object):
+    # The complete, scored realizations of realize.nbest keyed by seg id,
+    # read in one streaming pass and shared by rewrites and reversals
+
+    def __init__(self, realization_path):
+        self.realization_path = realization_path
+        self.seg_realization_map = {}
+        self.num_realizations = 0
+        start_time = time.time()
+        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.__load(realization_path)
+        self.parse_seconds = time.time() - start_time
+        # Peak resident set size only grows, so this is an upper bound
+        self.peak_rss_growth_kb = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss)
+
+    def __load(self, realization_path):
+        open_elements = []
+        skipping = False
+        events = ElementTree.iterparse(
+            realization_path, events=('start', 'end'))
+        for event, element in events:
+            if event == 'start':
+                if element.tag == 'seg':
+                    skipping = element.attrib.get('complete') != 'true'
+                open_elements.append(element)
+                continue
+            open_elements.pop()
+            if element.tag != 'seg':
+                # Don't hold on to the insides of incomplete segments
+                if skipping and open_elements and \
+                        open_elements[-1].tag == 'seg':
+                    element.clear()
+                continue
+            # Detach finished segments so the tree does not keep them alive
+            if open_elements:
+                open_elements[-1].remove(element)
+            if not skipping:
+                realizations = [child for child in element
+                                if 'score' in child.attrib]
+                self.seg_realization_map.setdefault(
+                    element.attrib.get('id'), []).extend(realizations)
+                self.num_realizations += len(realizations)
+            element.clear()
+            skipping = False
+
+    def realizations(self, seg_id):
+        # Realizations are kept in the order realize.nbest lists them
+        return self.seg_realization_map.get(seg_id, [])
+
+    def report(self):
+        return ('%d realizations for %d segments from %s in %.3fs, '
+                'peak memory grew %dKB' % (
+                    self.num_realizations, len(self.seg_realization_map),
+                    self.realization_path, self.parse_seconds,
+                    self.peak_rss_growth_kb))
+
+
+def realization_index(parse_output_directory):
+    realization_path = '%s/realize.nbest' % parse_output_directory
+    __logger.debug('Loading realizations from %s', realization_path)
+    index = RealizationIndex(realization_path)
+    __logger.debug('Loaded %s', index.report())
+    return index
@@ -3,10 +3,11 @@ import string
 import itertools
 import logging
 import re
-from xml.etree import cElementTree as ElementTree
 from ..models.parse import Parse
+from ..models.lf_index import align_logical_forms, node_index
 from ..models.reversal import Reversal
 from disambig_utilities import sentence_utilities
+import realization_utilities
 
 __logger = logging.getLogger(__name__)
 
@@ -26,60 +27,35 @@ def relative_word_distances(word_index_map):
     return word_distances_map
 
 
-def build_xpath_to_node(node, tree_parent_map):
-    __logger.debug('Building up the xpath expression to a node in an xml tree.')
-    # We need to gather the full xpath
-    tags = []
-    # 'lf' is the top level tag of a logical form
-    while node is not None and node.tag != 'lf':
-        # We want to ignore the id attribute to establish correspondence
-        items = node.attrib
-        attributes = [node.tag]
-        for item in items:
-            value = items[item]
-            if item !='id':
-                attributes.append('[@%s="%s"]' % (item, value))
-        tags.append(''.join(attributes))
-        node = tree_parent_map.get(node)
-    # These tags are in bottom up order so we have to switch to top down
-    path_to_node = '/'.join(reversed(tags))
-    __logger.debug('Built xpath expression "%s" to an xml tree node.',
-                   path_to_node)
-    return path_to_node
-
-
 def word_correspondence(parse, realization_xml, ambiguous_details_index_map):
     __logger.debug('Establishing correspondence between parse %s and its '
                    'realization.', parse)
 
     # Get all ambiguous words from the tree
-    parse_words = parse.xml_lf.findall('.//*node[@id][@pred]')
-    # Establish a mapping of child nodes to parent nodes in the tree
-    child_parent_map = {c: p for p in parse.xml_lf.iter() for c in p}
-    realization_lf = realization_xml.find('lf')
-    # We have to assume that these word lists are the same length
+    lf_index = parse.lf_index
+    parse_words = [n for n in lf_index.elements if n.tag == 'node' and
+                   'id' in n.attrib and 'pred' in n.attrib]
+    # Pair the parse's nodes with the realization's nodes in one walk
+    alignment = align_logical_forms(
+        parse.xml_lf.find('lf'), realization_xml.find('lf'))
     correspondence = {}
     for parse_node in parse_words:
-        parse_index = parse_node.attrib.get('id')
-        # prefixed with a single character
-        parse_index_match = re.match('.([0-9]+).*', parse_index)
-        parse_index = int(parse_index_match.group(1))
+        parse_index = node_index(parse_node.attrib.get('id'))
         # We are only really interested in the ambiguity for correspondence
         if parse_index in ambiguous_details_index_map:
             ambig_tag, ambig_stem = ambiguous_details_index_map[parse_index]
             parse_stem = parse_node.attrib.get('pred')
             # Stem must also match for alignment
             if ambig_stem == parse_stem:
-                # Use this path to find the corresponding node in realization
-                path_to_node = build_xpath_to_node(parse_node, child_parent_map)
                 # Now get the realization's information
-                realization_node = realization_lf.find(path_to_node)
+                realization_node = alignment.get(parse_node)
+                if realization_node is None:
+                    __logger.debug('No node in the realization of parse %s '
+                                   'corresponds to %s', parse, parse_stem)
+                    continue
                 realization_stem = realization_node.attrib.get('pred')
-                realization_index = realization_node.attrib.get('id')
-                # prefixed with a single character
-                realization_index_match = re.match(
-                    '.([0-9]+).*', realization_index)
-                realization_index = int(realization_index_match.group(1))
+                realization_index = node_index(
+                    realization_node.attrib.get('id'))
                 correspondence[parse_index, parse_stem] = (
                     realization_index, realization_stem)
     __logger.debug('Established correspondence...%s for parse %s and its '
@@ -102,6 +78,33 @@ def distances_change(reference_distances, realization_distances):
     return False
 
 
+def span_is_broken(correspondence):
+    # Maps (index, stem) -> (realization index, realization stem)
+    offsets, stems, realization_indices = set(), set(), set()
+    for (index, stem), (real_index, real_stem) in correspondence.iteritems():
+        if stem != real_stem:
+            break
+        offsets.add(real_index - index)
+        stems.add(stem)
+        realization_indices.add(real_index)
+    else:
+        # With distinct words, every relative distance stays the same exactly
+        # when all of the words shift by the same offset
+        if len(stems) == len(realization_indices) == len(correspondence):
+            return len(offsets) > 1
+    # Repeated words collapse in the pairwise distances, so compare those
+    original_index_stem_map = {}
+    realization_index_stem_map = {}
+    for index, stem in correspondence:
+        original_index_stem_map[index] = stem
+        real_index, real_stem = correspondence[index, stem]
+        realization_index_stem_map[real_index] = real_stem
+    original_distances = relative_word_distances(original_index_stem_map)
+    realization_distances = relative_word_distances(
+        realization_index_stem_map)
+    return distances_change(original_distances, realization_distances)
+
+
 def breaks_ambiguous_span(ambiguous_details_index_map, parse, realization_xml):
     __logger.debug('Checking if ambiguous span is broken by realization of '
                    'parse %s', parse)
@@ -116,18 +119,7 @@ def breaks_ambiguous_span(ambiguous_details_index_map, parse, realization_xml):
     if reference_text != realization_text:
         correspondence = word_correspondence(
             parse, realization_xml, ambiguous_details_index_map)
-        # Put the correspondence into separate mappings
-        original_index_stem_map = {}
-        realization_index_stem_map = {}
-        for index, stem in correspondence:
-            original_index_stem_map[index] = stem
-            real_index, real_stem = correspondence[index, stem]
-            realization_index_stem_map[real_index] = real_stem
-        # Now get the distances from the stem maps
-        original_distances = relative_word_distances(original_index_stem_map)
-        realization_distances = relative_word_distances(
-            realization_index_stem_map)
-        return distances_change(original_distances, realization_distances)
+        return span_is_broken(correspondence)
     else:
         # The realization and reference were identical...
         __logger.debug('reference text "%s" was identical to realization text '
@@ -147,13 +139,14 @@ def write_out_reversals(parse_output_directory, realizations_to_print):
     return reversal_path
 
 
-def prepare_reversals(sentences, parse_output_directory):
+def prepare_reversals(sentences, parse_output_directory, realizations=None):
     __logger.debug('Preparing reversals for sentences %s using directory %s',
                    sentences, parse_output_directory)
     path_match = re.match('(^.*).dir$', parse_output_directory)
     text_file_name = path_match.group(1)
-    realization_path = '%s/realize.nbest' % parse_output_directory
-    realizations_xml = ElementTree.parse(realization_path)
+    if realizations is None:
+        realizations = realization_utilities.realization_index(
+            parse_output_directory)
     # Only look at the ambiguous sentences
     ambiguous = [sentence for sentence in sentences if sentence.is_ambiguous()]
     realizations_to_print = []
@@ -161,10 +154,8 @@ def prepare_reversals(sentences, parse_output_directory):
         for parse in [sentence.top_parse, sentence.next_best_parse]:
             index_details_map = sentence.parse_specific_ambiguity_details(
                 parse)
-            realizations = realizations_xml.findall(
-                './/seg[@id="%s"][@complete="true"]/*[@score]' % parse.full_id)
             # A bit long winded... builds the reversal if possible
-            for realization in realizations:
+            for realization in realizations.realizations(parse.full_id):
                 if breaks_ambiguous_span(index_details_map, parse, realization):
                     realized_text = realization.find('str').text
                     realizations_to_print.append(realized_text)
@@ -186,12 +177,13 @@ def validate_reversals(sentences, parse_output_directory):
     reversal_filename = '%s/reversals' % parse_output_directory
     reversal_directory_path = '%s/reversals.dir' % parse_output_directory
     reversal_lf = '%s/tb.xml' % reversal_directory_path
-    reparses = Parse.parse_factory(reversal_filename, reversal_lf)
+    # Only the top reparse of each reversal ever needs its dependencies
+    reparses = Parse.parse_factory(reversal_filename, reversal_lf, lazy=True)
     # Now take these parses and find parses associated with each sentence
     sentence_dict = sentence_utilities.sentence_id_parse_map(reparses)
     ambiguous = [sentence for sentence in sentences if sentence.is_ambiguous()]
     for sentence in ambiguous:
-        ambiguous_span = sentence.ambiguous_span()
+        ambiguous_codes = sentence.ambiguous_codes()
         parses = [sentence.top_parse, sentence.next_best_parse]
         # Only look at parses which have a reversal
         parses = [parse for parse in parses if parse.reversal]
@@ -200,7 +192,8 @@ def validate_reversals(sentences, parse_output_directory):
             reversal_parses = sorted(sentence_dict.get(reversal_id))
             # Only interested in the top parse, nothing more
             top_reversal_parse = reversal_parses[0]
-            parse.reversal.validate(parse, top_reversal_parse, ambiguous_span)
+            parse.reversal.validate(
+                parse, top_reversal_parse, ambiguous_codes)
 
     __logger.debug('Finished validating reversals for sentences %s using '
                    'directory %s', sentences, parse_output_directory)
\ No newline at end of file
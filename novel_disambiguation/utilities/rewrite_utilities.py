@@ -1,51 +1,47 @@
 __author__ = 'Ethan A. Hill'
 import copy
+import os
 import string
 import re
 import itertools
 import logging
+import threading
+import time
 from xml.etree import cElementTree as ElementTree
 
 from ..constants import ccg_values
 from ..models.rewrite import Rewrite
+from ..models.lf_index import align_logical_forms, node_index
+from ..utilities import realization_utilities
 from ..utilities import reversal_utilities
 
 
 __logger = logging.getLogger(__name__)
+# Enough of the end of tb.xml to find the closing tag of its root
+__TAIL_READ_SIZE = 4096
+# Rewrites are items whose info has the rule after the sentence id
+__REWRITE_ITEM_PATTERN = re.compile(r'<item\b[^>]*\binfo="[^"]*#')
+__SCAN_CHUNK_SIZE = 1 << 16
 
 
 def find_parse_tree_node(node_index, parse):
-    parse_nodes = parse.xml_lf.findall('.//node[@id]')
-    for node in parse_nodes:
-        parse_index = node.attrib.get('id')
-        # prefixed with a single character
-        parse_index_match = re.match('.([0-9]+).*', parse_index)
-        if int(parse_index_match.group(1)) == node_index:
-            return node
-    # This should never happen
-    return None
+    # The parse's structural index finds nodes by their word index
+    return parse.lf_index.node_at_index(node_index)
 
 
 def parent_verb_node(node, parse):
-    child_parent_tree_map = {c: p for p in parse.xml_lf.iter() for c in p}
-    while node is not None and node.tag != 'lf':
-        node = child_parent_tree_map.get(node)
-        if 'id' in node.attrib:
-            node_index = node.attrib.get('id')
-            # prefixed with a single character
-            node_index_match = re.match('.([0-9]+).*', node_index)
-            node_index = int(node_index_match.group(1))
-            tag = parse.pos_tag_of_word_at_index(node_index)
-            if 'VB' in tag:
-                return node
-    # This should probably throw an exception too but maybe not
-    __logger.warning('Parent verb was not found for parse %s', parse)
-    return None
+    verb_node = parse.lf_index.parent_verb_node(node)
+    if verb_node is None:
+        # This should probably throw an exception too but maybe not
+        __logger.warning('Parent verb was not found for parse %s', parse)
+    return verb_node
 
 
-def has_node_as_child(node, other_node):
+def has_node_as_child(node, other_node, lf_index):
+    # Look for a node with other_node's id below node, in node's own tree
     other_node_index = other_node.attrib.get('id')
-    if node.find('.//node[@id="%s"]' % other_node_index) is not None:
+    descendant = lf_index.node_with_id(other_node_index)
+    if descendant is not None and lf_index.is_descendant(descendant, node):
         return True
     else:
         return False
@@ -62,7 +58,7 @@ def ambiguous_parent_verb_index(node_index, parse_pair):
     # Do the parent verb nodes exist?
     if parent_verb is not None and other_parent_verb is not None:
         # Now see which verb is higher up in the tree
-        if has_node_as_child(parent_verb, other_parent_verb):
+        if has_node_as_child(parent_verb, other_parent_verb, parse.lf_index):
             top_level_verb = parent_verb
         else:
             top_level_verb = other_parent_verb
@@ -70,38 +66,114 @@ def ambiguous_parent_verb_index(node_index, parse_pair):
     return None
 
 
-def append_rewrite_to_xml_file(rewrite_xml, xml_file_path):
+def append_rewrites_to_xml_file(rewrite_xmls, xml_file_path):
+    if not rewrite_xmls:
+        return
+    with open(xml_file_path, 'rb+') as xml_file:
+        # Only the closing root tag at the very end of the file is read
+        xml_file.seek(0, os.SEEK_END)
+        file_size = xml_file.tell()
+        tail_offset = max(0, file_size - __TAIL_READ_SIZE)
+        xml_file.seek(tail_offset)
+        tail = xml_file.read()
+        closing_tag = re.search(r'</[^<>]+>\s*$', tail)
+        if closing_tag is not None:
+            # Stream the new items in where the closing tag used to be
+            xml_file.seek(tail_offset + closing_tag.start())
+            xml_file.truncate()
+            for rewrite_xml in rewrite_xmls:
+                xml_file.write(ElementTree.tostring(rewrite_xml))
+            xml_file.write(closing_tag.group(0))
+            return
+    # An empty root (ie. <regression/>) has no closing tag to write before
+    __logger.debug('No closing tag found in %s, rewriting the whole file',
+                   xml_file_path)
     xml_file = ElementTree.parse(xml_file_path)
     root = xml_file.getroot()
-    root.append(rewrite_xml)
+    root.extend(rewrite_xmls)
     xml_file.write(xml_file_path)
 
 
-def rewrite_validation_map(parse_lf, rewrite_lf):
-    verification_map = {}
-    parent_child_map = {c: p for p in rewrite_lf.iter() for c in p}
-    for node in parse_lf.findall('.//node[@id]'):
-        node_id = node.attrib.get('id')
-        # The node id's should be the same before realization
-        rewrite_node = rewrite_lf.find('.//node[@id="%s"]' % node_id)
-        # Use reversal utilities xpath builder...
-        rewrite_path = reversal_utilities.build_xpath_to_node(
-            rewrite_node, parent_child_map)
-        verification_map[node_id] = rewrite_path
-    return verification_map
+def first_rewrite_offset(xml_file, chunk_size=__SCAN_CHUNK_SIZE):
+    # Where the first rewrite item starts, None without any. The file is
+    # read a chunk at a time, the last tag of each carried over to the next
+    # in case the chunk cut it off.
+    offset = 0
+    unscanned = ''
+    chunk = xml_file.read(chunk_size)
+    while chunk:
+        unscanned += chunk
+        first_rewrite = __REWRITE_ITEM_PATTERN.search(unscanned)
+        if first_rewrite is not None:
+            return offset + first_rewrite.start()
+        last_tag = unscanned.rfind('<')
+        if last_tag == -1:
+            last_tag = len(unscanned)
+        offset += last_tag
+        unscanned = unscanned[last_tag:]
+        chunk = xml_file.read(chunk_size)
+    return None
 
 
-def attempt_cleft_rewrite(verb_index, parse, xml_path):
-    xml_lf_copy = copy.deepcopy(parse.xml_lf)
-    # Use the copy to make the changes
-    verb_node = xml_lf_copy.find('.//node[@id="%s"]' % verb_index)
-    subject_node = verb_node.find('rel[@name="Arg0"]/node[@id]')
-    object_node = verb_node.find('rel[@name="Arg1"]/node[@id]')
+def remove_rewrites_from_xml_file(xml_file_path):
+    # Rewrites are only ever appended, so the file is cut back to where the
+    # first of them starts, leaving the parses as they were written
+    with open(xml_file_path, 'rb+') as xml_file:
+        rewrites_offset = first_rewrite_offset(xml_file)
+        if rewrites_offset is None:
+            return
+        xml_file.seek(0, os.SEEK_END)
+        xml_file.seek(max(0, xml_file.tell() - __TAIL_READ_SIZE))
+        closing_tag = re.search(r'</[^<>]+>\s*$', xml_file.read())
+        xml_file.seek(rewrites_offset)
+        xml_file.truncate()
+        xml_file.write(closing_tag.group(0))
+
+
+def shallow_clone(element):
+    # The clone gets its own attributes but shares the original's children
+    clone = ElementTree.Element(element.tag, dict(element.attrib))
+    clone.text = element.text
+    clone.tail = element.tail
+    clone.extend(list(element))
+    return clone
+
+
+def writable_node(element, clones, lf_index):
+    # Copy on write: clone element and every ancestor not already cloned,
+    # so untouched subtrees stay shared with the original tree
+    if element in clones:
+        return clones[element]
+    clone = shallow_clone(element)
+    clones[element] = clone
+    parent = lf_index.parent(element)
+    if parent is not None:
+        parent_clone = writable_node(parent, clones, lf_index)
+        for position, child in enumerate(parent_clone):
+            if child is element:
+                parent_clone[position] = clone
+                break
+    return clone
+
+
+def attempt_cleft_rewrite(verb_index, parse, rewrite_lfs):
+    lf_index = parse.lf_index
+    # Check the original tree before copying anything
+    original_verb = lf_index.node_with_id(verb_index)
+    if original_verb is None:
+        return
+    subject_node = original_verb.find('rel[@name="Arg0"]/node[@id]')
+    object_node = original_verb.find('rel[@name="Arg1"]/node[@id]')
 
     # If these nodes don't exist, then we can't apply this rewrite
     if subject_node is not None and object_node is not None:
+        clones = {}
+        xml_lf_copy = writable_node(parse.xml_lf, clones, lf_index)
+        # Only the spine from the root to the verb needs to be copied
+        verb_node = writable_node(original_verb, clones, lf_index)
         xml_lf_copy.attrib['info'] += '#cleft'
-        verb_parent = xml_lf_copy.find('.//node[@id="%s"]/..' % verb_index)
+        verb_parent = writable_node(
+            lf_index.parent(original_verb), clones, lf_index)
         # Create a be verb above the verb parent
         be_node = ElementTree.SubElement(
             verb_parent, 'node', {'id': 'w0b', 'pred': 'be'})
@@ -113,7 +185,7 @@ def attempt_cleft_rewrite(verb_index, parse, xml_path):
             verb_node.attrib.pop('mood')
 
         # Find the object under the verb
-        object_parent = verb_node.find("./rel[@name='Arg1']/node/..")
+        object_parent = original_verb.find("./rel[@name='Arg1']/node/..")
         # Add object to 'be' verb, and remove object from verb
         object_parent_be = ElementTree.SubElement(
             be_node, 'rel', {'name': 'Arg0'})
@@ -136,26 +208,32 @@ def attempt_cleft_rewrite(verb_index, parse, xml_path):
         verb_parent.remove(verb_node)
 
         # Append the newly created tree to the list of parse lfs
-        append_rewrite_to_xml_file(xml_lf_copy, xml_path)
+        rewrite_lfs.append(xml_lf_copy)
         # Add the rewrite to the parse
         rewrite_id = xml_lf_copy.attrib.get('info')
-        validation_map = rewrite_validation_map(parse.xml_lf, xml_lf_copy)
-        parse.rewrites.append(Rewrite(rewrite_id, validation_map))
+        parse.rewrites.append(Rewrite(rewrite_id, xml_lf_copy.find('lf')))
 
 
-def attempt_passive_rewrite(verb_index, parse, xml_path):
-    xml_lf_copy = copy.deepcopy(parse.xml_lf)
-    # Use the copy to make the changes
-    verb_node = xml_lf_copy.find('.//node[@id="%s"]' % verb_index)
-    subject_node = verb_node.find('rel[@name="Arg0"]/node[@id]')
-    object_node = verb_node.find('rel[@name="Arg1"]/node[@id]')
+def attempt_passive_rewrite(verb_index, parse, rewrite_lfs):
+    lf_index = parse.lf_index
+    # Check the original tree before copying anything
+    original_verb = lf_index.node_with_id(verb_index)
+    if original_verb is None:
+        return
+    subject_node = original_verb.find('rel[@name="Arg0"]/node[@id]')
+    object_node = original_verb.find('rel[@name="Arg1"]/node[@id]')
 
     # If these nodes don't exist, then we can't apply this rewrite
     if subject_node is not None and object_node is not None:
+        clones = {}
+        xml_lf_copy = writable_node(parse.xml_lf, clones, lf_index)
+        # Only the spine from the root to the verb needs to be copied
+        verb_node = writable_node(original_verb, clones, lf_index)
         # Create a copy of this node and set up its attributes
         xml_lf_copy.attrib['info'] += '#passive'
 
-        verb_parent = xml_lf_copy.find('.//node[@id="%s"]/..' % verb_index)
+        verb_parent = writable_node(
+            lf_index.parent(original_verb), clones, lf_index)
         passive_node = ElementTree.SubElement(
             verb_parent, 'node', {'id': 'w0pass', 'pred': 'PASS'})
 
@@ -166,7 +244,8 @@ def attempt_passive_rewrite(verb_index, parse, xml_path):
                 passive_node.attrib[attribute] = value
                 verb_node.attrib['partic'] = 'pass'
         # Move the object node from the verb node to the passive node
-        object_parent = verb_node.find('rel[@name="Arg1"]/node/..')
+        object_parent = writable_node(
+            original_verb.find('rel[@name="Arg1"]/node/..'), clones, lf_index)
 
         object_parent.set('name', 'Arg0')
         passive_node.append(object_parent)
@@ -187,13 +266,15 @@ def attempt_passive_rewrite(verb_index, parse, xml_path):
         by_node = ElementTree.SubElement(
             by_node_parent, 'node', {'id': 'w0by', 'pred': 'by'})
         # Move the subject over to the passive node, under the by node
-        subject_parent = verb_node.find('rel[@name="Arg0"]/node/..')
+        subject_parent = writable_node(
+            original_verb.find('rel[@name="Arg0"]/node/..'), clones, lf_index)
 
         subject_parent.set('name', 'Arg1')
         # Change the subject pred if it is a pronoun
         if subject_node.attrib.get('pred') in ccg_values.OBJECT_PRONOUNS:
             pronoun_to_change = subject_node.attrib.get('pred')
             new_pronoun = ccg_values.OBJECT_PRONOUNS.get(pronoun_to_change)
+            subject_node = writable_node(subject_node, clones, lf_index)
             subject_node.set('pred', new_pronoun)
         by_node.append(subject_parent)
         verb_node.remove(subject_parent)
@@ -205,25 +286,48 @@ def attempt_passive_rewrite(verb_index, parse, xml_path):
         verb_parent.remove(verb_node)
 
         # Append the newly created tree to the list of parse lfs
-        append_rewrite_to_xml_file(xml_lf_copy, xml_path)
+        rewrite_lfs.append(xml_lf_copy)
         # Add the rewrite to the parse
         rewrite_id = xml_lf_copy.attrib.get('info')
-        validation_map = rewrite_validation_map(parse.xml_lf, xml_lf_copy)
-        parse.rewrites.append(Rewrite(rewrite_id, validation_map))
-
-
-def attempt_coordination_rewrite(conjunction_index, parse, xml_path):
-    conjunction_node = find_parse_tree_node(conjunction_index, parse)
-    conjunction_node_index = conjunction_node.attrib.get('id')
-
-    xml_lf_copy = copy.deepcopy(parse.xml_lf)
-    # Refind this node with the xml copy
-    conjunction_node = xml_lf_copy.find(
-        './/node[@id="%s"]' % conjunction_node_index)
-    first_node = conjunction_node.find('rel[@name="First"]/node[@id]')
-    next_node = conjunction_node.find('rel[@name="Next"]/node[@id]')
+        parse.rewrites.append(Rewrite(rewrite_id, xml_lf_copy.find('lf')))
+
+
+def transplant_for_conjunct(transplant, existing_ids, conjunct_number):
+    transplant_ids = [sub.attrib.get('id') for sub in transplant.iter()
+                      if sub.attrib.get('id')]
+    # Share the transplant as is when none of its ids need to change
+    if (len(set(transplant_ids)) == len(transplant_ids) and
+            existing_ids.isdisjoint(transplant_ids)):
+        existing_ids.update(transplant_ids)
+        return transplant
+    copy_transplant = copy.deepcopy(transplant)
+    # Alter sub elements of transplant to avoid reference issues
+    for sub in copy_transplant.iter():
+        if sub.attrib.get('id'):
+            sub_id = sub.attrib.get('id')
+            # Change the id a little if already used before
+            if sub_id in existing_ids:
+                sub_id = '%scoord%d' % (sub_id, conjunct_number)
+            existing_ids.add(sub_id)
+            sub.set('id', sub_id)
+    return copy_transplant
+
+
+def attempt_coordination_rewrite(conjunction_index, parse, rewrite_lfs):
+    lf_index = parse.lf_index
+    # Check the original tree before copying anything
+    original_conjunction = find_parse_tree_node(conjunction_index, parse)
+    if original_conjunction is None:
+        return
+    first_node = original_conjunction.find('rel[@name="First"]/node[@id]')
+    next_node = original_conjunction.find('rel[@name="Next"]/node[@id]')
 
     if first_node is not None and next_node is not None:
+        clones = {}
+        xml_lf_copy = writable_node(parse.xml_lf, clones, lf_index)
+        # Only the spines down to the conjunction and conjuncts are copied
+        conjunction_node = writable_node(
+            original_conjunction, clones, lf_index)
         xml_lf_copy.attrib['info'] += '#coordination'
         # Transplant the nodes on the conjunction to first and next nodes
         nodes_on_conjunction = []
@@ -236,78 +340,175 @@ def attempt_coordination_rewrite(conjunction_index, parse, xml_path):
         # When we transplant the nodes, make sure the ids are not the same
         existing_ids = set()
         for i, node in enumerate([first_node, next_node]):
+            node = writable_node(node, clones, lf_index)
             for transplant in nodes_on_conjunction:
-                copy_transplant = copy.deepcopy(transplant)
-                # Alter sub elements of transplant to avoid reference issues
-                for sub in copy_transplant.iter():
-                    if sub.attrib.get('id'):
-                        sub_id = sub.attrib.get('id')
-                        # Change the id a little if already used before
-                        if sub_id in existing_ids:
-                            sub_id = '%scoord%d' % (sub_id, i)
-                        existing_ids.add(sub_id)
-                        sub.set('id', sub_id)
-                node.append(copy_transplant)
+                node.append(
+                    transplant_for_conjunct(transplant, existing_ids, i))
         # Now switch first node with next node
-        first_node_parent = conjunction_node.find(
+        first_node_parent = original_conjunction.find(
             'rel[@name="First"]/node[@id]/..')
 
-        next_node_parent = conjunction_node.find(
+        next_node_parent = original_conjunction.find(
             'rel[@name="Next"]/node[@id]/..')
-        first_node_parent.set('name', 'Next')
-        next_node_parent.set('name', 'First')
+        writable_node(first_node_parent, clones, lf_index).set('name', 'Next')
+        writable_node(next_node_parent, clones, lf_index).set('name', 'First')
         # Append the newly created tree to the list of parse lfs
-        append_rewrite_to_xml_file(xml_lf_copy, xml_path)
+        rewrite_lfs.append(xml_lf_copy)
         # Add the rewrite to the parse
         rewrite_id = xml_lf_copy.attrib.get('info')
-        validation_map = rewrite_validation_map(parse.xml_lf, xml_lf_copy)
-        parse.rewrites.append(Rewrite(rewrite_id, validation_map))
+        parse.rewrites.append(Rewrite(rewrite_id, xml_lf_copy.find('lf')))
 
 
-def attempt_rewrites(parse_pair, parse_specific_ambiguity_details, xml_path):
-    parse, other_parse = parse_pair
+class RewriteRule(object):
+    # A rewrite applies where one of its pos tags appears in an ambiguous
+    # word's tag; subclasses locate the node to rewrite and attempt it
+    name = None
+    pos_tags = ()
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+        self.__lock = threading.Lock()
+
+    def applies_to(self, pos_tag):
+        return any(tag in pos_tag for tag in self.pos_tags)
+
+    def target_index(self, ambiguous_index, parse_pair):
+        raise NotImplementedError
+
+    def attempt(self, target_index, parse, rewrite_lfs):
+        raise NotImplementedError
+
+    def record(self, rewrote, seconds):
+        # Sentences may be rewritten from several threads at once
+        with self.__lock:
+            if rewrote:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.seconds += seconds
+
+    def report(self):
+        return '%s: %d hits, %d misses, %.3fs' % (
+            self.name, self.hits, self.misses, self.seconds)
+
+
+class PassiveRewriteRule(RewriteRule):
+    name = 'passive'
+    pos_tags = ('RB', 'IN')
+
+    def target_index(self, ambiguous_index, parse_pair):
+        return ambiguous_parent_verb_index(ambiguous_index, parse_pair)
+
+    def attempt(self, target_index, parse, rewrite_lfs):
+        attempt_passive_rewrite(target_index, parse, rewrite_lfs)
+
+
+class CleftRewriteRule(PassiveRewriteRule):
+    name = 'cleft'
+
+    def attempt(self, target_index, parse, rewrite_lfs):
+        attempt_cleft_rewrite(target_index, parse, rewrite_lfs)
+
+
+class CoordinationRewriteRule(RewriteRule):
+    name = 'coordination'
+    pos_tags = ('CC',)
+
+    def target_index(self, ambiguous_index, parse_pair):
+        parse, other_parse = parse_pair
+        if find_parse_tree_node(ambiguous_index, parse) is not None:
+            return ambiguous_index
+        return None
+
+    def attempt(self, target_index, parse, rewrite_lfs):
+        attempt_coordination_rewrite(target_index, parse, rewrite_lfs)
+
+
+# Rewrites are attempted in this order, add new rules with register_rewrite
+REWRITE_RULES = [PassiveRewriteRule(), CleftRewriteRule(),
+                 CoordinationRewriteRule()]
+
+
+def register_rewrite(rule):
+    REWRITE_RULES.append(rule)
+
+
+def rewrite_rule_report():
+    return [rule.report() for rule in REWRITE_RULES]
+
+
+def route_rewrites(parse_pair, parse_specific_ambiguity_details):
+    # The (rule, target index) of each rule that applies to the first
+    # ambiguous index any rule applies to. Only that index of a parse is
+    # rewritten, so a rule rewrites a parse at most once.
     for index, details in parse_specific_ambiguity_details.iteritems():
         pos_tag, stem = details
-        if 'RB' in pos_tag or 'IN' in pos_tag:
-            verb_index = ambiguous_parent_verb_index(index, parse_pair)
-            # If finding the parent verb index was successful
-            if verb_index:
-                attempt_passive_rewrite(verb_index, parse, xml_path)
-                attempt_cleft_rewrite(verb_index, parse, xml_path)
-            break
-        elif 'CC' in pos_tag:
-            attempt_coordination_rewrite(index, parse, xml_path)
-            break
-
-
-def apply_rewrites(sentences, parse_output_directory):
+        rules = [rule for rule in REWRITE_RULES if rule.applies_to(pos_tag)]
+        if rules:
+            routes = [(rule, rule.target_index(index, parse_pair))
+                      for rule in rules]
+            return [(rule, target) for rule, target in routes
+                    if target is not None]
+    return []
+
+
+def attempt_rewrites(parse_pair, parse_specific_ambiguity_details,
+                     rewrite_lfs):
+    parse, other_parse = parse_pair
+    routes = route_rewrites(parse_pair, parse_specific_ambiguity_details)
+    for rule, target in routes:
+        num_rewrites = len(parse.rewrites)
+        start_time = time.time()
+        rule.attempt(target, parse, rewrite_lfs)
+        rule.record(len(parse.rewrites) > num_rewrites,
+                    time.time() - start_time)
+
+
+def sentence_rewrites(sentence):
+    rewrite_lfs = []
+    parses = [sentence.top_parse, sentence.next_best_parse]
+    # Iterate over (top, next best) and then (next best, top)
+    for ordered_parse_pair in itertools.permutations(parses, 2):
+        parse, other_parse = ordered_parse_pair
+        ambiguity_details = sentence.parse_specific_ambiguity_details(parse)
+        attempt_rewrites(ordered_parse_pair, ambiguity_details, rewrite_lfs)
+    return rewrite_lfs
+
+
+def apply_rewrites(sentences, parse_output_directory, append_to_xml=True):
+    # Without append_to_xml, the rewrites are only given to the parses, ie.
+    # tb.xml already has them from an earlier run
     __logger.debug('Applying possible rewrites to sentences %s', sentences)
     xml_path = '%s/tb.xml' % parse_output_directory
     ambiguous = [sentence for sentence in sentences if sentence.is_ambiguous()]
-    for sentence in ambiguous:
-        parses = [sentence.top_parse, sentence.next_best_parse]
-        # Iterate over (top, next best) and then (next best, top)
-        for ordered_parse_pair in itertools.permutations(parses, 2):
-            parse, other_parse = ordered_parse_pair
-            ambiguity_details = sentence.parse_specific_ambiguity_details(parse)
-            attempt_rewrites(
-                ordered_parse_pair, ambiguity_details, xml_path)
-    __logger.debug('Finished applying possible rewrites to sentences %s',
-                   sentences)
+    # Gather every rewrite for the file so tb.xml is only touched once
+    rewrite_lfs = list(itertools.chain.from_iterable(
+        sentence_rewrites(sentence) for sentence in ambiguous))
+    if append_to_xml:
+        append_rewrites_to_xml_file(rewrite_lfs, xml_path)
+    __logger.debug('Finished applying %d possible rewrites to sentences %s',
+                   len(rewrite_lfs), sentences)
+    __logger.debug('Rewrite rule totals: %s', '; '.join(rewrite_rule_report()))
 
 
 def rewrite_word_correspondence(parse, realization_xml, rewrite, ambiguity):
     __logger.debug('Establishing correspondence between parse %s and its '
                    'realization.', parse)
-    realization_lf = realization_xml.find('lf')
-    # We have to assume that these word lists are the same length
+    # Pair the rewrite's nodes with the realization's nodes in one walk
+    alignment = align_logical_forms(
+        rewrite.rewrite_lf, realization_xml.find('lf'))
+    # Rewrites keep the node ids of their parse, the first node wins
+    realization_id_map = {}
+    for rewrite_node in rewrite.rewrite_lf.iter('node'):
+        rewrite_node_id = rewrite_node.attrib.get('id')
+        if rewrite_node_id and rewrite_node_id not in realization_id_map:
+            realization_id_map[rewrite_node_id] = alignment.get(rewrite_node)
     correspondence = {}
-    for parse_node_index, path_to_node in rewrite.validation_map.iteritems():
+    for parse_node_id, parse_node in parse.lf_index.id_node_map.iteritems():
         # Gather parse details
-        parse_node = parse.xml_lf.find('.//node[@id="%s"]' % parse_node_index)
-        # prefixed with a single character
-        parse_index_match = re.match('.([0-9]+).*', parse_node_index)
-        parse_index = int(parse_index_match.group(1))
+        parse_index = node_index(parse_node_id)
         # We are only interested in the ambiguity
         if parse_index in ambiguity:
             parse_stem = parse_node.attrib.get('pred')
@@ -315,13 +516,14 @@ def rewrite_word_correspondence(parse, realization_xml, rewrite, ambiguity):
             # For alignment, stems must match too
             if parse_stem == ambig_stem:
                 # Gather rewrite details
-                realization_word = realization_lf.find(path_to_node)
+                realization_word = realization_id_map.get(parse_node_id)
+                if realization_word is None:
+                    __logger.debug('No node in the realization of rewrite %s '
+                                   'corresponds to %s', rewrite, parse_stem)
+                    continue
                 realization_stem = realization_word.attrib.get('pred')
-                realization_index = realization_word.attrib.get('id')
-                # prefixed with a single character
-                realization_index_match = re.match(
-                    '.([0-9]+).*', realization_index)
-                realization_index = int(realization_index_match.group(1))
+                realization_index = node_index(
+                    realization_word.attrib.get('id'))
                 correspondence[parse_index, parse_stem] = (
                     realization_index, realization_stem)
     __logger.debug('Established correspondence...\n%s \nfor parse %s and its '
@@ -339,22 +541,7 @@ def breaks_ambiguous_span(ambiguous_details_map, parse, realization, rewrite):
     if reference_text != realization_text:
         correspondence = rewrite_word_correspondence(
             parse, realization, rewrite, ambiguous_details_map)
-        # Put the correspondence into separate mappings
-        original_index_stem_map = {}
-        realization_index_stem_map = {}
-        for index, stem in correspondence:
-            original_index_stem_map[index] = stem
-            real_index, real_stem = correspondence[index, stem]
-            realization_index_stem_map[real_index] = real_stem
-
-        # Now get the distances from the stem maps using a reversal utility
-        original_distances = reversal_utilities.relative_word_distances(
-            original_index_stem_map)
-        realization_distances = reversal_utilities.relative_word_distances(
-            realization_index_stem_map)
-        # Check if the distances have changed
-        span_is_broken = reversal_utilities.distances_change(
-            original_distances, realization_distances)
+        span_is_broken = reversal_utilities.span_is_broken(correspondence)
         if span_is_broken:
             __logger.debug('Realization %s breaks ambiguous span for parse %s',
                            realization, parse)
@@ -369,9 +556,10 @@ def breaks_ambiguous_span(ambiguous_details_map, parse, realization, rewrite):
         return False
 
 
-def validate_rewrites(sentences, parse_output_directory):
-    realization_path = '%s/realize.nbest' % parse_output_directory
-    realizations_xml = ElementTree.parse(realization_path)
+def validate_rewrites(sentences, parse_output_directory, realizations=None):
+    if realizations is None:
+        realizations = realization_utilities.realization_index(
+            parse_output_directory)
     ambiguous = [sentence for sentence in sentences if sentence.is_ambiguous()]
     for sentence in ambiguous:
         for parse in [sentence.top_parse, sentence.next_best_parse]:
@@ -379,10 +567,7 @@ def validate_rewrites(sentences, parse_output_directory):
                 parse)
             # We don't really want to look at coordination rewrites
             for rewrite in parse.rewrites:
-                realizations = realizations_xml.findall(
-                    './/seg[@id="%s"][@complete="true"]/*[@score]' %
-                    rewrite.full_id)
-                for real in realizations:
+                for real in realizations.realizations(rewrite.full_id):
                     if breaks_ambiguous_span(details_map, parse, real, rewrite):
                         realized_text = real.find('str').text
                         # We've found a realization, break out of the loop
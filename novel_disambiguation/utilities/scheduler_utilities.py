@@ -0,0 +1,152 @@
+__author__ = 'Ethan A. Hill'
+import logging
+import threading
+import time
+from Queue import PriorityQueue
+
+
+__logger = logging.getLogger(__name__)
+
+
+class Stage(object):
+    # One step of a job, run on a thread of the named resource once every
+    # stage it depends on has finished for that job
+
+    def __init__(self, name, function, resource, dependencies=()):
+        self.name = name
+        self.function = function
+        self.resource = resource
+        self.dependencies = tuple(dependencies)
+        self.busy_seconds = 0.0
+        self.runs = 0
+
+
+class StageScheduler(object):
+    # Runs many jobs through a DAG of stages. Each resource has its own queue
+    # and as many threads as its limit, so stages of different jobs overlap,
+    # ie. one file is parsed while another is analysed.
+
+    def __init__(self, stages, resource_limits):
+        self.stages = stages
+        self.resource_limits = resource_limits
+        self.__dependents = dict((stage.name, []) for stage in stages)
+        for stage in stages:
+            for dependency in stage.dependencies:
+                self.__dependents[dependency].append(stage)
+        self.__queues = dict((resource, PriorityQueue())
+                             for resource in resource_limits)
+        self.__lock = threading.Lock()
+        self.__all_done = threading.Condition(self.__lock)
+        self.__remaining = {}
+        self.__finished = {}
+        self.__failed = set()
+        self.__jobs_left = 0
+        self.__on_finished = None
+        self.wall_seconds = 0.0
+
+    def __submit(self, job_number, stage):
+        # Earlier jobs go first, so finished results arrive in order
+        self.__queues[stage.resource].put((job_number, stage.name, stage))
+
+    def run(self, jobs, on_finished=None):
+        # Each stage function gets the job and returns nothing, jobs carry
+        # their own state from stage to stage. Returns the jobs that finished,
+        # each also handed to on_finished as soon as its last stage is done.
+        start_time = time.time()
+        self.__on_finished = on_finished
+        self.__jobs = list(jobs)
+        self.__jobs_left = len(self.__jobs)
+        for job_number in xrange(len(self.__jobs)):
+            self.__remaining[job_number] = dict(
+                (stage.name, len(stage.dependencies)) for stage in self.stages)
+            self.__finished[job_number] = set()
+        threads = []
+        for resource, limit in self.resource_limits.iteritems():
+            for _ in xrange(limit):
+                thread = threading.Thread(
+                    target=self.__resource_worker, args=(resource, ))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for job_number in xrange(len(self.__jobs)):
+            for stage in self.stages:
+                if not stage.dependencies:
+                    self.__submit(job_number, stage)
+        with self.__all_done:
+            while self.__jobs_left:
+                self.__all_done.wait(1)
+        # Wake each worker with a sentinel so it can exit
+        for resource, limit in self.resource_limits.iteritems():
+            for _ in xrange(limit):
+                self.__queues[resource].put((float('inf'), None, None))
+        for thread in threads:
+            thread.join()
+        self.wall_seconds = time.time() - start_time
+        return [job for job_number, job in enumerate(self.__jobs)
+                if job_number not in self.__failed]
+
+    def __resource_worker(self, resource):
+        queue = self.__queues[resource]
+        while True:
+            job_number, _, stage = queue.get()
+            if stage is None:
+                return
+            job = self.__jobs[job_number]
+            start_time = time.time()
+            try:
+                stage.function(job)
+                failed = False
+            except Exception, e:
+                logging.getLogger(__name__).exception(
+                    'Exception %s encountered in stage %s, skipping %s',
+                    e, stage.name, job)
+                failed = True
+            with self.__lock:
+                stage.busy_seconds += time.time() - start_time
+                stage.runs += 1
+                job_done = self.__stage_finished(job_number, stage, failed)
+            if job_done and self.__on_finished is not None:
+                try:
+                    self.__on_finished(job)
+                except Exception, e:
+                    logging.getLogger(__name__).exception(
+                        'Exception %s encountered handing on %s', e, job)
+            if job_done:
+                with self.__lock:
+                    self.__job_finished()
+
+    def __stage_finished(self, job_number, stage, failed):
+        # Whether the job just finished, successfully or not
+        if job_number in self.__failed:
+            return False
+        if failed:
+            self.__failed.add(job_number)
+            self.__job_finished()
+            return False
+        finished = self.__finished[job_number]
+        finished.add(stage.name)
+        for dependent in self.__dependents[stage.name]:
+            self.__remaining[job_number][dependent.name] -= 1
+            if not self.__remaining[job_number][dependent.name]:
+                self.__submit(job_number, dependent)
+        return len(finished) == len(self.stages)
+
+    def __job_finished(self):
+        self.__jobs_left -= 1
+        if not self.__jobs_left:
+            self.__all_done.notify_all()
+
+    def utilization_report(self):
+        lines = []
+        wall_seconds = max(self.wall_seconds, 1e-9)
+        for resource, limit in sorted(self.resource_limits.iteritems()):
+            busy = sum(stage.busy_seconds for stage in self.stages
+                       if stage.resource == resource)
+            lines.append('%s: %d slots, %.0f%% utilized' % (
+                resource, limit, 100 * busy / (limit * wall_seconds)))
+        for stage in self.stages:
+            lines.append('  %s (%s): %d runs, %.1fs busy, %.0f%% of the run'
+                         % (stage.name, stage.resource, stage.runs,
+                            stage.busy_seconds,
+                            100 * stage.busy_seconds / wall_seconds))
+        return lines
@@ -5,14 +5,15 @@ from collections import defaultdict
 from ..constants import ccg_values
 from ..models.parse import Parse
 from ..models.sentence import Sentence
+from ..models.vocabulary import Vocabulary
 
 __logger = logging.getLogger(__name__)
 
 
 def has_dependency_self_reference(parse):
-    unlabeled_dependencies = parse.unlabeled_dependency_set()
+    unlabeled_dependencies = parse.unlabeled_dependency_codes()
     # If head == dependent, we want to filter this parse out
-    has_self_reference = any(head == dependent for head, dependent in unlabeled_dependencies)
+    has_self_reference = any(Vocabulary.is_self_reference(code) for code in unlabeled_dependencies)
     if has_self_reference:
         __logger.debug("Parse [{!s}] has dependency where head is the same as dependent".format(parse))
     return has_self_reference
@@ -28,21 +29,22 @@ def has_single_root(parse):
 
 
 def should_apply_filter(parse):
-    apply_filter = has_dependency_self_reference(parse) or not has_single_root(parse)
+    # The root check only needs the xml, so it goes before the dependencies
+    apply_filter = not has_single_root(parse) or has_dependency_self_reference(parse)
     if apply_filter:
         __logger.debug("Parse [{!s}] should be filtered".format(parse))
     return apply_filter
 
 
 def different_by_reverse_dependency_only(parse, other):
-    dependencies = parse.unlabeled_dependency_set()
-    other_dependencies = other.unlabeled_dependency_set()
+    dependencies = parse.unlabeled_dependency_codes()
+    other_dependencies = other.unlabeled_dependency_codes()
     difference = dependencies.symmetric_difference(other_dependencies)
     # We are looking only at a difference where one parse has (head, dependent)
     # and the other has (dependent, head)
     if len(difference) == 2:
-        head, dependent = difference.pop()
-        if (dependent, head) in difference:
+        code, other_code = difference
+        if Vocabulary.reverse_dependency(code) == other_code:
             __logger.debug("Parse [{!s}] and [{!s}] are different only by "
                            "a dependency's direction being reversed".format(parse, other))
             return True
@@ -50,8 +52,8 @@ def different_by_reverse_dependency_only(parse, other):
 
 
 def different_by_one_dependency_only(parse, other):
-    dependencies = parse.unlabeled_dependency_set()
-    other_dependencies = other.unlabeled_dependency_set()
+    dependencies = parse.unlabeled_dependency_codes()
+    other_dependencies = other.unlabeled_dependency_codes()
     difference = dependencies.symmetric_difference(other_dependencies)
     if len(difference) == 1:
         __logger.debug("Parse [{!s}] and [{!s}] are different only by a "
@@ -89,20 +91,19 @@ def has_auxiliary_attachment(parse, attachment_details):
 
 
 def has_uninteresting_dependency_difference(parse, other):
-    dependencies = parse.unlabeled_dependency_set()
-    other_dependencies = other.unlabeled_dependency_set()
+    dependencies = parse.unlabeled_dependency_codes()
+    other_dependencies = other.unlabeled_dependency_codes()
     differences = dependencies.symmetric_difference(other_dependencies)
     for examine in [parse, other]:
-        dependencies = examine.dependency_details_map
-        for details, unlabeled in dependencies.iteritems():
-            # We only want to look at the details of the ambiguous span
-            if unlabeled in differences and has_auxiliary_attachment(examine, details):
+        # We only want to look at the details of the ambiguous span
+        for details in examine.dependency_details_for(differences):
+            if has_auxiliary_attachment(examine, details):
                 return True
     return False
 
 
 def is_different_enough(parse, other):
-    if parse.unlabeled_dependency_set() != other.unlabeled_dependency_set():
+    if parse.unlabeled_dependency_codes() != other.unlabeled_dependency_codes():
         # Gather up all the conditions that we are filtering on
         only_by_reverse = different_by_reverse_dependency_only(parse, other)
         only_by_one = different_by_one_dependency_only(parse, other)
@@ -113,9 +114,13 @@ def is_different_enough(parse, other):
     return False
 
 
-def gather_both_top_parses(parses):
+def gather_both_top_parses(parses, apply_filters=False):
     top_parse = None
+    # Sorting only looks at parse ids, so lazy parses pay for dependency
+    # extraction only once a filter or comparison actually looks at them
     for parse in sorted(parses):
+        if apply_filters and should_apply_filter(parse):
+            continue
         if top_parse is None:
             top_parse = parse
         elif is_different_enough(top_parse, parse):
@@ -136,17 +141,20 @@ def sentence_factory(parse_output_directory):
     # Extract the sentence filename from the parse directory
     path_match = re.match('(^.*).dir$', parse_output_directory)
     text_file_name = path_match.group(1)
-    # Gather all parses
-    parses = Parse.parse_factory(text_file_name, lf_path)
-    # Now examine these Parses and filter out those which have a
-    # self-reference (ie. head == dependent) and which have two roots..
-    parses = [parse for parse in parses if not should_apply_filter(parse)]
-    sentence_dict = sentence_id_parse_map(parses)
+    # Gather parses one sentence at a time, so only one n-best list is alive
+    sentence_parses = Parse.sentence_parse_factory(
+        text_file_name, lf_path, lazy=True)
     # Now generate the sentences...
     sentences = []
-    for sentence_id, sent_parses in sentence_dict.iteritems():
-        # Grab the top two parses (next_best may be None)
-        top_parse, next_best_parse = gather_both_top_parses(sent_parses)
+    for sent_parses in sentence_parses:
+        sentence_id = sent_parses[0].sentence_id()
+        # Grab the top two parses (next_best may be None), filtering out
+        # those which have a self-reference (ie. head == dependent) and
+        # which have two roots along the way
+        top_parse, next_best_parse = gather_both_top_parses(
+            sent_parses, apply_filters=True)
+        if top_parse is None:
+            continue
         if next_best_parse is None:
             __logger.debug("Next best parse not found for sentence: {!s}, file:{!s}".format(sentence_id, text_file_name))
         sentences.append(Sentence(text_file_name, top_parse, next_best_parse))
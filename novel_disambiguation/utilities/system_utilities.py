@@ -2,40 +2,88 @@ __author__ = 'Ethan A. Hill'
 import argparse
 import logging
 import os
-import sys
-import subprocess
 import re
 import math
 
 from ..constants import ccg_values
 
 __logger = logging.getLogger(__name__)
+MEMINFO_PATH = '/proc/meminfo'
 
 
-def total_available_ram():
-    """Checks for the amount of available ram in the system.
+def ccgbank_path(path):
+    # Paths given on the command line are relative to the ccgbank directory
+    return os.path.join(os.path.expandvars(ccg_values.CCGBANK_PATH), path)
+
+
+def ccgbank_relative_path(path):
+    # As output, so dumps don't depend on where ccgbank is
+    return os.path.relpath(path, os.path.expandvars(ccg_values.CCGBANK_PATH))
+
+
+def read_meminfo(meminfo_path=MEMINFO_PATH):
+    # /proc/meminfo as a dictionary of sizes in kB, ie. {'MemTotal': 8056916}
+    meminfo = {}
+    with open(meminfo_path) as meminfo_file:
+        for line in meminfo_file:
+            name, _, value = line.partition(':')
+            fields = value.split()
+            if fields and fields[0].isdigit():
+                meminfo[name] = int(fields[0])
+    return meminfo
+
+
+def total_available_ram(meminfo_path=MEMINFO_PATH):
+    """Checks for the amount of ram in the system.
 
     Returns:
-        An integer value corresponding to the number of available processors
-        in the system which this module is being executed in.
+        An integer value corresponding to the number of gigabytes of ram in
+        the system which this module is being executed in.
     """
-    __logger.debug('Checking amount of available RAM.')
-    # Check the operating system
-    if 'linux' in sys.platform:
-        __logger.debug('Using a %s OS.' % sys.platform)
-        __logger.debug(
-            'Executing command: free -g | grep Mem: | awk {print $2}')
-        free_mem = subprocess.Popen(['free', '-g'], stdout=subprocess.PIPE)
-        grep = subprocess.Popen(
-            ['grep', 'Mem:'], stdin=free_mem.stdout, stdout=subprocess.PIPE)
-        awk = subprocess.Popen(
-            ['awk', '{print $2}'], stdin=grep.stdout, stdout=subprocess.PIPE)
-        end_of_pipe = awk.stdout
-        ram_list = [line.strip() for line in end_of_pipe]
-        ram = ram_list[0]
-    # ram is actually a string
+    __logger.debug('Checking amount of RAM in %s.', meminfo_path)
+    ram = read_meminfo(meminfo_path)['MemTotal'] / (1024 * 1024)
     __logger.debug('{!s}G of RAM is available for system use.'.format(ram))
-    return int(ram)
+    return ram
+
+
+def available_ram_kb(meminfo_path=MEMINFO_PATH):
+    # What can be allocated right now without swapping
+    meminfo = read_meminfo(meminfo_path)
+    if 'MemAvailable' in meminfo:
+        return meminfo['MemAvailable']
+    # Kernels before 3.14 don't estimate it for us
+    return sum(meminfo.get(name, 0)
+               for name in ['MemFree', 'Buffers', 'Cached'])
+
+
+def descendant_rss_kb(pid=None):
+    # The resident memory of every process started beneath pid, ie. the JVMs
+    # of running ccg-build jobs
+    pid = pid or os.getpid()
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as stat_file:
+                # The command name may hold spaces, the fields after it don't
+                fields = stat_file.read().rsplit(')', 1)[1].split()
+        except (IOError, IndexError):
+            # The process ended while we were looking
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    page_kb = os.sysconf('SC_PAGE_SIZE') / 1024
+    total_kb = 0
+    pending = list(children.get(pid, []))
+    while pending:
+        child = pending.pop()
+        pending.extend(children.get(child, []))
+        try:
+            with open('/proc/%d/statm' % child) as statm_file:
+                total_kb += int(statm_file.read().split()[1]) * page_kb
+        except (IOError, IndexError):
+            continue
+    return total_kb
 
 
 def maximum_ram_usage():
@@ -90,7 +138,9 @@ def initialize_arg_parser():
                              'optional arguments.')
 
     parser.add_argument('-pp', '--post-process', action='store_true',
-                        help='use when parsing/realization is not necessary')
+                        help='use when parsing/realization is not necessary. '
+                             'Without it, only the OpenCCG stages whose '
+                             'outputs are out of date with their inputs run')
 
     # It is probably easiest and best to make listing files an exclusive op
     list_group = parser.add_mutually_exclusive_group()
@@ -119,6 +169,66 @@ def initialize_arg_parser():
                         help='create an xml dump of paraphrases into this file '
                              'with details about each option')
 
+    parser.add_argument('-wb', '--worker-backend', default='subprocess',
+                        choices=['subprocess', 'persistent'],
+                        help='how OpenCCG jobs are run: a new ccg-build per '
+                             'job, or long running workers that keep the '
+                             'grammar loaded (see --worker-command)')
+    parser.add_argument('-wc', '--worker-command', nargs='+',
+                        help='command starting a persistent OpenCCG worker, '
+                             'run from "$OPENCCG_HOME/ccgbank"')
+    parser.add_argument('-mj', '--max-ccg-jobs', type=int,
+                        help='run at most this many OpenCCG jobs at once, '
+                             'instead of admitting jobs as memory frees up, '
+                             'ie. for reproducible benchmarks')
+
+    parser.add_argument('-cd', '--cache-directory', nargs=1,
+                        help='reuse parses and realizations stored in this '
+                             'directory when the input and grammar are '
+                             'unchanged')
+    parser.add_argument('-cs', '--cache-size', type=int, default=1024,
+                        help='megabytes the cache may use before the least '
+                             'recently used outputs are evicted')
+    parser.add_argument('-bs', '--batch-sentences', type=int,
+                        help='pack small files into batches of up to this '
+                             'many sentences, running OpenCCG once per batch')
+    parser.add_argument('-bb', '--batch-bytes', type=int,
+                        help='pack small files into batches of up to this '
+                             'many bytes, running OpenCCG once per batch')
+    parser.add_argument('-pd', '--parse-deadline', type=float,
+                        help='seconds per sentence a parse may take before '
+                             'it is bisected to find the slow sentences')
+    parser.add_argument('-rd', '--realize-deadline', type=float,
+                        help='seconds per sentence a realization may take '
+                             'before it is bisected to find the slow '
+                             'sentences')
+    parser.add_argument('-sl', '--skip-list', nargs=1,
+                        help='file of sentences too slow to parse or '
+                             'realize, read at the start and added to as '
+                             'more are found')
+    parser.add_argument('-ss', '--split-sentences', type=int,
+                        help='split files of more than this many sentences '
+                             'into chunks processed as separate jobs')
+    parser.add_argument('-np', '--processes', type=int,
+                        help='process files in this many processes rather '
+                             'than threads, so the Python analysis of files '
+                             'runs on as many cores')
+    parser.add_argument('-ps', '--pipeline-stages', action='store_true',
+                        help='schedule each stage of every file separately, '
+                             'so one file parses while another is analysed')
+    parser.add_argument('-sd', '--shard-directory', nargs=1,
+                        help='write the results of each file to a shard of '
+                             'its own in this directory, then bring the '
+                             'dumps up to date from every shard there, only '
+                             'replacing the files of changed shards')
+    parser.add_argument('-jn', '--journal', nargs=1,
+                        help='record the work done in this file as it '
+                             'finishes, with each job\'s results beside it, '
+                             'and assemble the dumps from it at the end')
+    parser.add_argument('-rs', '--resume', action='store_true',
+                        help='carry on from the --journal of a run that did '
+                             'not finish, skipping the work it records')
+
     # Any parsers that are to be used should exclusive options from each other
     parser_group = parser.add_mutually_exclusive_group()
     parser_group.add_argument('-b', '--berkeley-parser', action='store_true',
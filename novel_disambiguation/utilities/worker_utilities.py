@@ -0,0 +1,538 @@
+__author__ = 'Ethan A. Hill'
+import collections
+import itertools
+import logging
+import os
+import subprocess
+import threading
+import time
+from Queue import Queue
+
+import batch_utilities
+import build_utilities
+import cache_utilities
+import system_utilities
+from ..constants import ccg_values
+
+
+__logger = logging.getLogger(__name__)
+
+PARSE_TASK = 'parse'
+REALIZE_TASK = 'realize'
+
+
+class CcgWorker(object):
+    # Runs OpenCCG parse and realize jobs for a text file whose path is
+    # relative to the ccgbank directory, raising DeadlineExceeded if a job
+    # runs for more than deadline seconds
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SubprocessCcgWorker(CcgWorker):
+    # Starts a new ccg-build, and with it a new JVM, for every job
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        if task == PARSE_TASK:
+            return build_utilities.ccg_build_parse(
+                path_to_text, use_berkeley_target, deadline)
+        return build_utilities.ccg_build_realize(
+            path_to_text, use_berkeley_target, deadline)
+
+
+class PersistentCcgWorker(CcgWorker):
+    # Keeps one long running process, and its loaded grammar, for all jobs.
+    # Each job is written to its stdin as a line of tab separated task, text
+    # path and berkeley flag. The process echoes its build output and ends
+    # each job with a line holding DONE or FAILED. The output goes to the
+    # text's build log, as a ccg-build's would.
+
+    def __init__(self, command, working_directory=None):
+        self.command = command
+        self.working_directory = working_directory or os.path.expandvars(
+            ccg_values.CCGBANK_PATH)
+        self.__process = None
+
+    def __start(self):
+        logging.getLogger(__name__).debug(
+            'Starting persistent ccg worker %s', self.command)
+        self.__process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=self.working_directory,
+            preexec_fn=os.setsid)
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        if self.__process is None or self.__process.poll() is not None:
+            self.__start()
+        job = '%s\t%s\t%d\n' % (task, path_to_text, int(use_berkeley_target))
+        self.__process.stdin.write(job)
+        self.__process.stdin.flush()
+        timer, killed = None, threading.Event()
+        if deadline is not None:
+            # Losing the loaded grammar is the price of a runaway job
+            timer = threading.Timer(
+                deadline, build_utilities.kill_process_group,
+                (self.__process, killed))
+            timer.daemon = True
+            timer.start()
+        log_path = os.path.join(self.working_directory,
+                                '%s.dir' % path_to_text, TASK_LOGS[task])
+        try:
+            return self.__read_job_output(log_path)
+        except subprocess.CalledProcessError, e:
+            if killed.is_set():
+                raise build_utilities.DeadlineExceeded(
+                    self.command, deadline, e.output)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def __read_job_output(self, log_path):
+        # Only the last lines are kept around, the rest is in the log
+        tail = collections.deque(
+            maxlen=build_utilities.BUILD_OUTPUT_TAIL_LINES)
+        log_directory = os.path.dirname(log_path)
+        if not os.path.exists(log_directory):
+            os.makedirs(log_directory)
+        with open(log_path, 'w') as log_file:
+            while True:
+                line = self.__process.stdout.readline()
+                if not line:
+                    # The worker died, a fresh one is started for the next
+                    # job
+                    self.__process = None
+                    raise subprocess.CalledProcessError(
+                        -1, self.command, ''.join(tail))
+                if line.rstrip('\n') == 'DONE':
+                    return ''.join(tail)
+                if line.rstrip('\n') == 'FAILED':
+                    raise subprocess.CalledProcessError(
+                        1, self.command, ''.join(tail))
+                log_file.write(line)
+                tail.append(line)
+
+    def close(self):
+        if self.__process is not None and self.__process.poll() is None:
+            self.__process.stdin.close()
+            self.__process.wait()
+        self.__process = None
+
+
+class StubCcgWorker(CcgWorker):
+    # Stands in for OpenCCG: drops canned files into the text's output
+    # directory, ie. {'parse': {'tb.xml': ...}, 'realize': {...}}
+
+    def __init__(self, task_files=None):
+        self.task_files = task_files or {}
+        self.jobs = []
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        self.jobs.append((task, path_to_text))
+        output_directory = '%s.dir' % path_to_text
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        for file_name, contents in self.task_files.get(task, {}).iteritems():
+            with open(os.path.join(output_directory, file_name), 'w') as f:
+                f.write(contents)
+        return 'BUILD SUCCESSFUL'
+
+
+class CachingCcgWorker(CcgWorker):
+    # Restores tb.xml or realize.nbest from an OutputCache when the input,
+    # the job and the grammar are unchanged, otherwise runs the job
+
+    def __init__(self, worker, cache):
+        self.worker = worker
+        self.cache = cache
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        output_directory = '%s.dir' % path_to_text
+        if task == PARSE_TASK:
+            input_path = path_to_text
+            output_path = os.path.join(output_directory, 'tb.xml')
+        else:
+            # Realization works from the logical forms, rewrites included
+            input_path = os.path.join(output_directory, 'tb.xml')
+            output_path = os.path.join(output_directory, 'realize.nbest')
+        key = cache_utilities.cache_key(
+            input_path, task, use_berkeley_target,
+            cache_utilities.grammar_fingerprint())
+        if self.cache.get(key, output_directory):
+            return 'BUILD SUCCESSFUL'
+        process_output = self.worker.run(
+            task, path_to_text, use_berkeley_target, deadline)
+        try:
+            self.cache.put(key, [output_path])
+        except (OSError, IOError), e:
+            # The job is done either way, it just isn't cached
+            logging.getLogger(__name__).warning(
+                'Could not cache %s of %s: %s', task, path_to_text, e)
+        return process_output
+
+    def close(self):
+        self.worker.close()
+
+
+class JournalingCcgWorker(CcgWorker):
+    # Records each job in a journal once it is done, and doesn't run jobs
+    # the journal already has, their output being left from an earlier run
+
+    def __init__(self, worker, journal):
+        self.worker = worker
+        self.journal = journal
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        if self.journal.completed(path_to_text, task):
+            logging.getLogger(__name__).debug(
+                'Journal has %s of %s, not running it again', task,
+                path_to_text)
+            return 'BUILD SUCCESSFUL'
+        process_output = self.worker.run(
+            task, path_to_text, use_berkeley_target, deadline)
+        self.journal.record(path_to_text, task)
+        return process_output
+
+    def close(self):
+        self.worker.close()
+
+
+# Time for ccg-build to start its JVM and load the grammar, on top of the
+# time allowed for each sentence
+DEADLINE_STARTUP_SECONDS = 120
+# What each task reads and writes in the text's output directory, by tag and
+# sentence id attribute
+TASK_OUTPUTS = {PARSE_TASK: ('tb.xml', 'item', 'info'),
+                REALIZE_TASK: ('realize.nbest', 'seg', 'id')}
+# The build log of each task in the text's output directory
+TASK_LOGS = {PARSE_TASK: 'parse.log', REALIZE_TASK: 'realize.log'}
+
+
+class SkipList(object):
+    # Sentences that ran some task past its deadline, one tab separated task
+    # and sentence per line, kept across runs when given a path
+
+    def __init__(self, path=None):
+        self.path = path
+        self.__entries = set()
+        self.__lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as skip_file:
+                for line in skip_file:
+                    task, _, sentence = line.rstrip('\n').partition('\t')
+                    self.__entries.add((task, sentence))
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def contains(self, task, sentence):
+        return (task, sentence) in self.__entries
+
+    def add(self, task, sentence):
+        with self.__lock:
+            if (task, sentence) in self.__entries:
+                return
+            self.__entries.add((task, sentence))
+            if self.path:
+                with open(self.path, 'a') as skip_file:
+                    skip_file.write('%s\t%s\n' % (task, sentence))
+
+
+class DeadlineCcgWorker(CcgWorker):
+    # Gives each job a deadline that grows with its sentences. A job past its
+    # deadline is bisected until the sentences that are too slow on their own
+    # are found, they go on the skip list and are left out of this and every
+    # later run. What finished is merged back under the text's sentence ids.
+
+    def __init__(self, worker, seconds_per_sentence, skip_list):
+        self.worker = worker
+        # ie. {PARSE_TASK: 2.0}, tasks without one have no deadline
+        self.seconds_per_sentence = seconds_per_sentence
+        self.skip_list = skip_list
+
+    def deadline(self, task, num_sentences):
+        if task not in self.seconds_per_sentence:
+            return None
+        return (DEADLINE_STARTUP_SECONDS +
+                self.seconds_per_sentence[task] * num_sentences)
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        lines = batch_utilities.sentence_lines(path_to_text)
+        skipped = [self.skip_list.contains(task, line) for line in lines]
+        # Pieces of the text in order, with whether each ran to completion
+        pieces = []
+        if not any(skipped):
+            try:
+                return self.worker.run(
+                    task, path_to_text, use_berkeley_target,
+                    self.deadline(task, len(lines)))
+            except build_utilities.DeadlineExceeded:
+                logging.getLogger(__name__).warning(
+                    'Bisecting %s of %s to find its slow sentences', task,
+                    path_to_text)
+            # The whole text already ran out of time, no need to run it as
+            # a piece again
+            self.__bisect(task, path_to_text, lines, 0, len(lines),
+                          use_berkeley_target, pieces)
+            return self.__merge_pieces(task, path_to_text, pieces)
+        start = 0
+        for is_skipped, group in itertools.groupby(skipped):
+            count = len(list(group))
+            if is_skipped:
+                pieces.append((self.__piece_path(path_to_text, start, count),
+                               count, False))
+            else:
+                self.__run_range(task, path_to_text, lines, start, count,
+                                 use_berkeley_target, pieces)
+            start += count
+        return self.__merge_pieces(task, path_to_text, pieces)
+
+    def __piece_path(self, path_to_text, start, count):
+        return os.path.join(
+            os.path.dirname(path_to_text), batch_utilities.PIECE_DIRECTORY,
+            '%s.%d-%d' % (os.path.basename(path_to_text), start + 1,
+                          start + count))
+
+    def __write_piece(self, task, path_to_text, lines, start, count):
+        piece_path = self.__piece_path(path_to_text, start, count)
+        piece_directory = '%s.dir' % piece_path
+        if not os.path.exists(piece_directory):
+            os.makedirs(piece_directory)
+        with open(piece_path, 'w') as piece_file:
+            piece_file.write('\n'.join(lines[start:start + count]))
+        if task == REALIZE_TASK:
+            # Realization reads the logical forms, rewrites and all
+            batch_utilities.copy_sentence_range(
+                '%s.dir/tb.xml' % path_to_text,
+                os.path.join(piece_directory, 'tb.xml'), 'item', 'info',
+                start, count)
+        return piece_path
+
+    def __run_range(self, task, path_to_text, lines, start, count,
+                    use_berkeley_target, pieces):
+        piece_path = self.__write_piece(task, path_to_text, lines, start,
+                                        count)
+        try:
+            self.worker.run(task, piece_path, use_berkeley_target,
+                            self.deadline(task, count))
+            pieces.append((piece_path, count, True))
+        except build_utilities.DeadlineExceeded:
+            self.__bisect(task, path_to_text, lines, start, count,
+                          use_berkeley_target, pieces)
+
+    def __bisect(self, task, path_to_text, lines, start, count,
+                 use_berkeley_target, pieces):
+        # The range ran past its deadline, run each half of it on its own
+        if count == 1:
+            logging.getLogger(__name__).warning(
+                'Skipping %s of sentence %d of %s from now on: %s', task,
+                start + 1, path_to_text, lines[start])
+            self.skip_list.add(task, lines[start])
+            pieces.append((self.__piece_path(path_to_text, start, count),
+                           count, False))
+            return
+        half = count / 2
+        self.__run_range(task, path_to_text, lines, start, half,
+                         use_berkeley_target, pieces)
+        self.__run_range(task, path_to_text, lines, start + half,
+                         count - half, use_berkeley_target, pieces)
+
+    def __merge_pieces(self, task, path_to_text, pieces):
+        file_name, tag, id_attribute = TASK_OUTPUTS[task]
+        for piece_path, _, finished in pieces:
+            # A killed job may have left half an output behind
+            output_path = os.path.join('%s.dir' % piece_path, file_name)
+            if not finished and os.path.exists(output_path):
+                os.remove(output_path)
+        output_directory = '%s.dir' % path_to_text
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        # The text is the batch of its pieces, so ids map straight back
+        batch = batch_utilities.Batch(
+            path_to_text, [piece_path for piece_path, _, _ in pieces],
+            [count for _, count, _ in pieces])
+        batch_utilities.merge_xml_files(batch, file_name, tag, id_attribute)
+        num_skipped = sum(count for _, count, finished in pieces
+                          if not finished)
+        return 'Finished %s of %s in %d pieces, skipping %d sentences' % (
+            task, path_to_text, len(pieces), num_skipped)
+
+
+# A ccg-build's JVM is gone once its job is, and admission decides how many
+# run, so a subprocess pool need only be bounded by what's sane to have
+# waiting
+MAX_POOL_WORKERS = 64
+
+
+def memory_worker_limit():
+    # Every worker holds a JVM of up to the ccg-env heap size
+    return max(1, system_utilities.max_threads_available())
+
+
+class MemoryAdmissionController(object):
+    # Starts an OpenCCG job only when memory has room for another JVM heap.
+    # Jobs already running may still grow to a full heap, so what they don't
+    # yet use of theirs is held back from MemAvailable. With static_jobs, at
+    # most that many jobs run whatever the memory, for reproducible runs.
+
+    def __init__(self, job_memory_kb=None, reserve_kb=512 * 1024,
+                 static_jobs=None, poll_seconds=1.0,
+                 available_kb=system_utilities.available_ram_kb,
+                 running_rss_kb=system_utilities.descendant_rss_kb):
+        self.job_memory_kb = job_memory_kb
+        self.reserve_kb = reserve_kb
+        self.static_jobs = static_jobs
+        self.poll_seconds = poll_seconds
+        self.available_kb = available_kb
+        self.running_rss_kb = running_rss_kb
+        self.running = 0
+        self.admitted = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.__condition = threading.Condition()
+
+    def headroom_kb(self):
+        unclaimed_kb = max(0, self.running * self.job_memory_kb -
+                           self.running_rss_kb())
+        return self.available_kb() - unclaimed_kb - self.reserve_kb
+
+    def __has_room(self):
+        if self.static_jobs is not None:
+            return self.running < self.static_jobs
+        # One job always runs, or nothing would ever finish
+        return not self.running or self.headroom_kb() >= self.job_memory_kb
+
+    def admit(self, description):
+        logger = logging.getLogger(__name__)
+        with self.__condition:
+            start_time = time.time()
+            waited = False
+            while not self.__has_room():
+                if not waited:
+                    logger.info('Holding %s, %d jobs running', description,
+                                self.running)
+                    self.waits += 1
+                    waited = True
+                # Memory frees up without anyone telling us, so poll as well
+                self.__condition.wait(self.poll_seconds)
+            self.running += 1
+            self.admitted += 1
+            if waited:
+                self.wait_seconds += time.time() - start_time
+            logger.debug('Admitted %s as job %d of %d running', description,
+                         self.admitted, self.running)
+
+    def release(self):
+        with self.__condition:
+            self.running -= 1
+            self.__condition.notify_all()
+
+    def report(self):
+        if self.static_jobs is not None:
+            limit = 'at most %d jobs' % self.static_jobs
+        else:
+            limit = '%dKB per job' % self.job_memory_kb
+        return ('admitted %d ccg jobs (%s), %d waited %.1fs for memory' % (
+            self.admitted, limit, self.waits, self.wait_seconds))
+
+
+def memory_admission_controller(static_jobs=None):
+    if static_jobs:
+        return MemoryAdmissionController(static_jobs=static_jobs)
+    # ccg-env sets the heap in gigabytes
+    return MemoryAdmissionController(
+        system_utilities.maximum_ram_usage() * 1024 * 1024)
+
+
+class CcgWorkerPool(object):
+    # Hands out at most num_workers workers, blocking callers until one is
+    # free, so file threads never run more JVMs than memory allows
+
+    def __init__(self, worker_factory, num_workers, admission=None):
+        self.num_workers = num_workers
+        self.admission = admission
+        self.__workers = [worker_factory() for _ in xrange(num_workers)]
+        self.__idle_workers = Queue()
+        for worker in self.__workers:
+            self.__idle_workers.put(worker)
+        self.__lock = threading.Lock()
+        self.jobs_run = 0
+
+    def run(self, task, path_to_text, use_berkeley_target=False,
+            deadline=None):
+        worker = self.__idle_workers.get()
+        if self.admission is not None:
+            self.admission.admit('%s of %s' % (task, path_to_text))
+        try:
+            logging.getLogger(__name__).debug(
+                'Running %s of %s on worker %s', task, path_to_text, worker)
+            return worker.run(task, path_to_text, use_berkeley_target,
+                              deadline)
+        finally:
+            if self.admission is not None:
+                self.admission.release()
+            with self.__lock:
+                self.jobs_run += 1
+            self.__idle_workers.put(worker)
+
+    def parse(self, path_to_text, use_berkeley_target=False):
+        return self.run(PARSE_TASK, path_to_text, use_berkeley_target)
+
+    def realize(self, path_to_text, use_berkeley_target=False):
+        return self.run(REALIZE_TASK, path_to_text, use_berkeley_target)
+
+    def close(self):
+        for worker in self.__workers:
+            worker.close()
+
+
+def worker_pool_factory(backend='subprocess', num_workers=1,
+                        worker_command=None, task_files=None, cache=None,
+                        admission=None, seconds_per_sentence=None,
+                        skip_list=None, journal=None):
+    if backend == 'stub':
+        # No JVMs are started, so memory does not limit the stub
+        factory = lambda: StubCcgWorker(task_files)
+        admission = None
+    else:
+        if admission is None:
+            # Without live admission, size the pool for memory up front
+            num_workers = min(num_workers, memory_worker_limit())
+        if backend == 'persistent':
+            if not worker_command:
+                raise ValueError('persistent workers need a worker command')
+            # Idle workers keep their JVMs, which admission doesn't count,
+            # so there are only as many as memory, or the static jobs, allow
+            if admission is not None and admission.static_jobs:
+                num_workers = min(num_workers, admission.static_jobs)
+            else:
+                num_workers = min(num_workers, memory_worker_limit())
+            factory = lambda: PersistentCcgWorker(worker_command)
+        else:
+            factory = SubprocessCcgWorker
+    if seconds_per_sentence or skip_list is not None:
+        if skip_list is None:
+            skip_list = SkipList()
+        untimed_factory = factory
+        factory = lambda: DeadlineCcgWorker(
+            untimed_factory(), seconds_per_sentence or {}, skip_list)
+    if cache is not None:
+        uncached_factory = factory
+        factory = lambda: CachingCcgWorker(uncached_factory(), cache)
+    if journal is not None:
+        unjournaled_factory = factory
+        factory = lambda: JournalingCcgWorker(unjournaled_factory(), journal)
+    __logger.debug('Creating a pool of %d %s ccg workers',
+                   num_workers, backend)
+    return CcgWorkerPool(factory, num_workers, admission)